@@ -0,0 +1,251 @@
+"""
+This file holds the benchmark suite of the non-personalized recommenders.
+The association values, the top N association recommenders and the most rated recommender are timed over the bundled
+data-set (if its pickles are available) and over synthetic data-sets of configurable size. For every function it
+reports latency percentiles and throughput, besides the time needed to build the indexes and the peak memory. The
+results are written to a JSON file, so two runs can be compared to spot regressions.
+Usage example:
+    python benchmark.py --synthetic 6000x3700x1000000 --queries 200 --output benchmark.json
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import resource
+import argparse
+import platform
+import tempfile
+import numpy as np
+import data
+import main
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+PERCENTILES = [50, 90, 95, 99]  # latency percentiles reported for every function
+STARS = [None, 1, 2, 3, 4, 5]  # star thresholds the most rated queries go through
+
+
+def synthetic_dataset(num_users, num_movies, num_ratings, seed=0):
+    """
+    Generates a random data-set with the same format as the parsed .dat files (see 'data.load_dat').
+    The popularity of the movies follows a Zipf-like distribution, like in real data-sets. A user rates a movie at most
+    once, so the amount of ratings may be slightly lower than requested.
+    :param num_users: number of users
+    :param num_movies: number of movies
+    :param num_ratings: number of ratings to draw
+    :param seed: seed of the random generator
+    :return: a dictionary of movies (indexed by movie ID) AND a list of ratings
+    """
+    random = np.random.RandomState(seed)
+    popularity = 1.0 / np.arange(1, num_movies + 1) ** 0.8
+    popularity = popularity[random.permutation(num_movies)]
+    movie_index = random.choice(num_movies, size=num_ratings, p=popularity / popularity.sum())
+    user_index = random.randint(0, num_users, size=num_ratings)
+    # Repeated (user, movie) pairs are dropped:
+    pairs = np.unique(user_index.astype(np.int64) * num_movies + movie_index)
+    pairs = pairs[random.permutation(len(pairs))]
+    userids = pairs // num_movies + 1
+    movieids = pairs % num_movies + 1
+    stars = random.randint(1, 6, size=len(pairs))
+    timestamps = 956703932 + np.sort(random.randint(0, 3 * 365 * 24 * 3600, size=len(pairs)))
+    movies = {}
+    for movieid in range(1, num_movies + 1):
+        movies[str(movieid)] = {'title': "Movie %d (2000)" % movieid, 'genre': "Drama"}
+    ratings = []
+    for i in range(len(pairs)):
+        ratings.append({'userid': str(userids[i]), 'movieid': str(movieids[i]), 'rating': str(stars[i]),
+                        'timestamp': str(timestamps[i])})
+    return movies, ratings
+
+
+def latency_report(latencies):
+    """
+    Summarizes the latencies of a function.
+    :param latencies: list of latencies (in seconds), one per call
+    :return: a dictionary with the amount of calls, the mean, max and percentile latencies (in ms) and the throughput
+    (calls per second)
+    """
+    latencies = np.array(latencies) * 1000.0
+    report = {'calls': len(latencies),
+              'mean_ms': float(latencies.mean()),
+              'max_ms': float(latencies.max()),
+              'throughput_per_s': float(len(latencies) / (latencies.sum() / 1000.0)) if latencies.sum() > 0 else None}
+    for percentile in PERCENTILES:
+        report['p%d_ms' % percentile] = float(np.percentile(latencies, percentile))
+    return report
+
+
+def peak_memory_mb():
+    """
+    Retrieves the peak resident memory of the process so far. It never decreases, so the peak of a data-set includes
+    the peak of the data-sets benchmarked before it.
+    :return: a float number of megabytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes:
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def time_calls(function, arguments):
+    """
+    Calls the function once per tuple of arguments and measures every call.
+    :param function: function to time
+    :param arguments: list of tuples of arguments
+    :return: a list of latencies (in seconds)
+    """
+    latencies = []
+    for args in arguments:
+        start = time.time()
+        function(*args)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def benchmark_dataset(name, movies_path, ratings_path, queries=100, N=10, seed=0):
+    """
+    Benchmarks the non-personalized recommenders (with the current 'main.ASSOCIATION_MODE') over the data-set stored in
+    the pickles provided by parameter. The precomputed association index is not used, every query hits the engine.
+    :param name: name of the data-set in the report
+    :param movies_path: path to the pickle of the movies
+    :param ratings_path: path to the pickle of the ratings
+    :param queries: number of calls to every function
+    :param N: size of the top N lists
+    :param seed: seed of the random query movies
+    :return: a dictionary with the report of the data-set
+    """
+    locations = (main.MOVIE_PICKLE_LOCATION, main.RATINGS_PICKLE_LOCATION, main.ASSOCIATION_INDEX_LOCATION)
+    main.MOVIE_PICKLE_LOCATION = movies_path
+    main.RATINGS_PICKLE_LOCATION = ratings_path
+    main.ASSOCIATION_INDEX_LOCATION = None
+    try:
+        report = {'dataset': name, 'mode': main.ASSOCIATION_MODE, 'N': N}
+        start = time.time()
+        ratings = main.get_dataset().ratings()
+        main.get_dataset().movies()
+        report['load_s'] = time.time() - start
+        report['ratings'] = len(ratings)
+        start = time.time()
+        engine = main.get_cooccurrence()
+        report['build_association_s'] = time.time() - start
+        start = time.time()
+        main.get_popularity()
+        report['build_popularity_s'] = time.time() - start
+        # Query movies are drawn among the rated ones:
+        random = np.random.RandomState(seed)
+        movieX = [int(movieid) for movieid in random.choice(engine.movieids, size=queries)]
+        movieY = [int(movieid) for movieid in random.choice(engine.movieids, size=queries)]
+        pairs = zip(movieX, movieY)
+        functions = {}
+        functions['calculate_simple_association'] = time_calls(main.calculate_simple_association, pairs)
+        functions['calculate_advanced_association'] = time_calls(main.calculate_advanced_association, pairs)
+        functions['topN_movies_simple_association'] = time_calls(main.topN_movies_simple_association,
+                                                                 [(movieid, N) for movieid in movieX])
+        functions['topN_movies_advanced_association'] = time_calls(main.topN_movies_advanced_association,
+                                                                   [(movieid, N) for movieid in movieX])
+        functions['topN_most_rated_movies'] = time_calls(main.topN_most_rated_movies,
+                                                         [(N, STARS[i % len(STARS)]) for i in range(queries)])
+        report['functions'] = {}
+        for function_name, latencies in functions.items():
+            report['functions'][function_name] = latency_report(latencies)
+        report['peak_memory_mb'] = peak_memory_mb()
+        return report
+    finally:
+        # The indexes of the data-set are dropped, so they don't stay in memory while the next data-set is measured:
+        main.get_dataset().invalidate()
+        main.MOVIE_PICKLE_LOCATION, main.RATINGS_PICKLE_LOCATION, main.ASSOCIATION_INDEX_LOCATION = locations
+
+
+def benchmark_synthetic(num_users, num_movies, num_ratings, queries=100, N=10, seed=0):
+    """
+    Benchmarks the non-personalized recommenders over a synthetic data-set (see 'synthetic_dataset'). Its pickles are
+    written to a temporary directory, which is removed afterwards.
+    :param num_users: number of users
+    :param num_movies: number of movies
+    :param num_ratings: number of ratings to draw
+    :param queries: number of calls to every function
+    :param N: size of the top N lists
+    :param seed: seed of the random generator
+    :return: a dictionary with the report of the data-set
+    """
+    movies, ratings = synthetic_dataset(num_users, num_movies, num_ratings, seed)
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        movies_path = os.path.join(directory, "movies.pkl")
+        ratings_path = os.path.join(directory, "ratings.pkl")
+        data.dump_pickle(movies, movies_path)
+        data.dump_pickle(ratings, ratings_path)
+        del movies, ratings
+        name = "synthetic-%dx%dx%d" % (num_users, num_movies, num_ratings)
+        return benchmark_dataset(name, movies_path, ratings_path, queries, N, seed)
+    finally:
+        shutil.rmtree(directory)
+
+
+def run(synthetic=None, bundled=True, queries=100, N=10, mode=None, output=None):
+    """
+    Runs the whole benchmark suite and writes the results to a JSON file.
+    :param synthetic: list of tuples (users, movies, ratings), one per synthetic data-set
+    :param bundled: if True, the bundled data-set (see 'main.MOVIE_PICKLE_LOCATION') is benchmarked as well
+    :param queries: number of calls to every function
+    :param N: size of the top N lists
+    :param mode: query mode of the association recommenders (see 'main.ASSOCIATION_MODE'). The current one if None.
+    :param output: path to the JSON file. If None, a file name is generated (see 'data.generate_file_name').
+    :return: a dictionary with the results
+    """
+    previous_mode = main.ASSOCIATION_MODE
+    if mode is not None:
+        main.ASSOCIATION_MODE = mode
+    results = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+               'started': time.strftime("%Y-%m-%d %H:%M:%S"), 'datasets': []}
+    try:
+        if bundled:
+            if os.path.exists(main.MOVIE_PICKLE_LOCATION) and os.path.exists(main.RATINGS_PICKLE_LOCATION):
+                results['datasets'].append(benchmark_dataset("bundled", main.MOVIE_PICKLE_LOCATION,
+                                                             main.RATINGS_PICKLE_LOCATION, queries, N))
+            else:
+                print "[Warning] The pickles of the bundled data-set are not available. Skipping it."
+        for num_users, num_movies, num_ratings in (synthetic or []):
+            results['datasets'].append(benchmark_synthetic(num_users, num_movies, num_ratings, queries, N))
+    finally:
+        main.ASSOCIATION_MODE = previous_mode
+    if output is None:
+        output = data.generate_file_name("benchmark", "json")
+    with open(output, 'w') as jsonfile:
+        json.dump(results, jsonfile, indent=2, sort_keys=True)
+    return results
+
+
+def parse_size(size):
+    """
+    Parses the size of a synthetic data-set.
+    :param size: string "USERSxMOVIESxRATINGS" (e.g. "6000x3700x1000000")
+    :return: a tuple of three ints
+    """
+    try:
+        num_users, num_movies, num_ratings = [int(value) for value in size.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("[Error] Expected USERSxMOVIESxRATINGS but got '%s' instead" % size)
+    return num_users, num_movies, num_ratings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of the non-personalized recommenders.")
+    parser.add_argument('--synthetic', type=parse_size, action='append', default=[],
+                        help="size of a synthetic data-set, USERSxMOVIESxRATINGS (can be repeated)")
+    parser.add_argument('--no-bundled', action='store_true', help="do not benchmark the bundled data-set")
+    parser.add_argument('--queries', type=int, default=100, help="number of calls to every function")
+    parser.add_argument('--N', type=int, default=10, help="size of the top N lists")
+    parser.add_argument('--mode', choices=["matrix", "raters", "bitset", "minhash"], default=None,
+                        help="query mode of the association recommenders")
+    parser.add_argument('--output', default=None, help="path to the JSON file with the results")
+    arguments = parser.parse_args()
+    for dataset in run(arguments.synthetic, not arguments.no_bundled, arguments.queries, arguments.N, arguments.mode,
+                       arguments.output)['datasets']:
+        print dataset['dataset'], "(%s mode):" % dataset['mode']
+        for function_name in sorted(dataset['functions']):
+            function = dataset['functions'][function_name]
+            print "\t%-34s p50 = %8.3f ms :: p99 = %8.3f ms" % (function_name, function['p50_ms'], function['p99_ms'])
+        print "\tpeak memory = %.1f MB" % dataset['peak_memory_mb']
@@ -0,0 +1,106 @@
+"""
+This file holds a counting backend for the association recommenders based on bitsets.
+The users who rated a movie are stored as a packed bitset over the (dense) user indices: one bit per user, grouped in
+64-bit words. "How many users rated X and Y" is then a bitwise AND of two rows followed by a popcount, which is much
+cheaper than membership tests over lists. The same operation over more rows answers "rated X and Y and Z" queries.
+"""
+
+import numpy as np
+from scipy import sparse
+import cooccurrence
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+# Amount of bits set in every possible byte. Popcounts are computed with this table over the bytes of the words:
+POPCOUNT_TABLE = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """
+    Counts the bits set in every row of a 2D array of 64-bit words.
+    :param words: 2D array of uint64
+    :return: array of ints, one per row
+    """
+    words = np.ascontiguousarray(words)
+    return POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+class RaterBitsets(cooccurrence.CountingBackend):
+    """
+    Counting backend that keeps the raters of every movie as a packed bitset. It can be used instead of a
+    'cooccurrence.CoOccurrence' engine by the association recommenders.
+    """
+
+    def __init__(self, userids, movieids, block_size=1024):
+        """
+        Builds the bitsets out of two parallel arrays.
+        :param userids: array of ints, the user ID of every rating
+        :param movieids: array of ints, the movie ID of every rating
+        :param block_size: number of movies intersected at once (bounds the memory needed by 'cocounts_row')
+        """
+        user_index, movie_index = self.index_ratings(userids, movieids)
+        self.block_size = block_size
+        num_words = max(1, (len(self.userids) + 63) // 64)
+        # The bits of every movie are packed ('np.packbits' order: the first user is the highest bit of the first
+        # byte) and the bytes are then seen as 64-bit words:
+        bits = np.zeros((len(self.movieids), num_words * 8), dtype=np.uint8)
+        np.bitwise_or.at(bits, (movie_index, user_index // 8), (128 >> (user_index % 8)).astype(np.uint8))
+        self.bits = bits.view(np.uint64)
+
+    def how_many_X_and_Y(self, movieX_ID, movieY_ID):
+        """
+        Computes how many users rated movie X and movie Y as well.
+        :param movieX_ID: a movie ID
+        :param movieY_ID: another movie ID
+        :return: returns an integer.
+        """
+        return self.how_many_rated_all([movieX_ID, movieY_ID])
+
+    def how_many_rated_all(self, movieIDs):
+        """
+        Computes how many users rated ALL the movies provided by parameter (e.g. X and Y and Z).
+        :param movieIDs: list of movie IDs
+        :return: returns an integer.
+        """
+        columns = self.indices_of([int(movieID) for movieID in movieIDs])
+        if len(columns) == 0 or (columns == -1).any():
+            return 0
+        words = np.bitwise_and.reduce(self.bits[columns], axis=0)
+        return int(popcount(words[None, :])[0])
+
+    def cocounts_row(self, movieX_ID):
+        """
+        Retrieves how many users rated movie X together with every other movie.
+        :param movieX_ID: ID of movie X
+        :return: a dense array aligned with 'self.movieids'
+        """
+        x = self.index_of(movieX_ID)
+        counts = np.zeros(len(self.movieids), dtype=np.int64)
+        if x == -1:
+            return counts
+        for start in range(0, len(self.movieids), self.block_size):
+            block = self.bits[start:start + self.block_size]
+            counts[start:start + len(block)] = popcount(block & self.bits[x])
+        return counts
+
+    def cocounts_rows(self, columns):
+        """
+        Retrieves how many users rated every movie in 'columns' together with every other movie.
+        :param columns: array of column indices
+        :return: a sparse matrix with one row per column index
+        """
+        counts = np.zeros((len(columns), len(self.movieids)), dtype=np.int64)
+        for i, column in enumerate(columns):
+            counts[i] = self.cocounts_row(self.movieids[column])
+        return sparse.csr_matrix(counts)
+
+
+def build_rater_bitsets(ratings):
+    """
+    Builds the bitset counting backend from a collection of all ratings.
+    :param ratings: a collection of all ratings (list of dictionaries or dictionary of columns)
+    :return: a RaterBitsets object
+    """
+    userids, movieids = cooccurrence.extract_columns(ratings)
+    return RaterBitsets(userids, movieids)
@@ -0,0 +1,290 @@
+"""
+This file holds the co-occurrence engine used by the association recommenders.
+Instead of walking over every user for every single (X, Y) pair, the ratings are turned once into a sparse
+user x item incidence matrix and its item x item co-count product. Afterwards, the association values of a movie X
+with respect to ALL movies Y come out of one row lookup.
+When the co-count product is not built (e.g. it doesn't fit in memory), a query for movie X gathers the users who
+rated X and counts every other movie they rated in one pass, so its cost is proportional to their histories.
+"""
+
+import numpy as np
+from scipy import sparse
+import data
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+
+class CountingBackend:
+    """
+    Base class of the counting backends of the association recommenders (e.g. CoOccurrence or
+    'bitsets.RaterBitsets'). Movies are mapped to dense column indices (sorted by movie ID) and users to dense row
+    indices, so that every count can be looked up with plain array indexing. Subclasses only need to provide
+    'how_many_X_and_Y', 'cocounts_row' and 'cocounts_rows'; association values are computed here from those counts.
+    """
+
+    def index_ratings(self, userids, movieids):
+        """
+        Maps the users and movies of the ratings to dense indices and counts how many times every movie was rated.
+        :param userids: array of ints, the user ID of every rating
+        :param movieids: array of ints, the movie ID of every rating
+        :return: the user index AND the movie index of every rating
+        """
+        userids = np.asarray(userids, dtype=np.int64)
+        movieids = np.asarray(movieids, dtype=np.int64)
+        self.num_ratings = len(movieids)  # amount of ratings, used by the advanced association (not X)
+        # Dense indices for users and movies ('np.unique' also returns them sorted):
+        self.userids, user_index = np.unique(userids, return_inverse=True)
+        self.movieids, movie_index = np.unique(movieids, return_inverse=True)
+        # How many times every movie was rated (same as 'utils.how_many_Z' for every movie at once):
+        self.popularity = np.bincount(movie_index, minlength=len(self.movieids)).astype(np.int64)
+        return user_index, movie_index
+
+    def index_of(self, movieID):
+        """
+        Returns the column index of the movie ID provided by parameter or -1 if nobody rated that movie.
+        :param movieID: ID of the movie (int or str)
+        :return: int number
+        """
+        movieID = int(movieID)
+        position = np.searchsorted(self.movieids, movieID)
+        if position < len(self.movieids) and self.movieids[position] == movieID:
+            return int(position)
+        return -1
+
+    def indices_of(self, movieIDs):
+        """
+        Vectorized version of 'index_of'.
+        :param movieIDs: array of ints of movie IDs
+        :return: array of column indices, -1 for movies nobody rated
+        """
+        movieIDs = np.asarray(movieIDs, dtype=np.int64)
+        if len(self.movieids) == 0:
+            return np.full(len(movieIDs), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.movieids, movieIDs), len(self.movieids) - 1)
+        return np.where(self.movieids[positions] == movieIDs, positions, -1)
+
+    def how_many_Z(self, movieID):
+        """
+        Computes how many ratings were done for movieID.
+        :param movieID: ID of the movie
+        :return: returns an integer.
+        """
+        column = self.index_of(movieID)
+        if column == -1:
+            return 0
+        return int(self.popularity[column])
+
+    def simple_association(self, movieX_ID):
+        """
+        Calculates the simple association value of movie X with respect to every movie Y at once.
+        If nobody rated movie X all values are 0.
+        :param movieX_ID: ID of movie X
+        :return: a dense array of floats aligned with 'self.movieids'
+        """
+        X = self.how_many_Z(movieX_ID)
+        if X == 0:
+            return np.zeros(len(self.movieids))
+        return self.cocounts_row(movieX_ID) / float(X)
+
+    def advanced_association(self, movieX_ID):
+        """
+        Calculates the advanced association value of movie X with respect to every movie Y at once.
+        Whenever the formula divides by zero (e.g. nobody rated Y without rating X) the value is 0, as it is done by
+        'calculate_advanced_association'.
+        :param movieX_ID: ID of movie X
+        :return: a dense array of floats aligned with 'self.movieids'
+        """
+        X = self.how_many_Z(movieX_ID)
+        values = np.zeros(len(self.movieids))
+        notX = self.num_ratings - X
+        if X == 0 or notX == 0:
+            return values
+        XY = self.cocounts_row(movieX_ID)
+        notXY = self.popularity - XY
+        valid = notXY != 0
+        values[valid] = (XY[valid] / float(X)) / (notXY[valid] / float(notX))
+        return values
+
+
+class CoOccurrence(CountingBackend):
+    """
+    Sparse co-occurrence engine: a user x item incidence matrix and (optionally) its item x item co-count product.
+    """
+
+    def __init__(self, userids, movieids, full_matrix=True):
+        """
+        Builds the incidence matrix and (optionally) the co-count product out of two parallel arrays.
+        :param userids: array of ints, the user ID of every rating
+        :param movieids: array of ints, the movie ID of every rating
+        :param full_matrix: whether to build the item x item co-count product or to count from the raters at query time
+        """
+        user_index, movie_index = self.index_ratings(userids, movieids)
+        # User x item incidence matrix. A user rating the same movie twice still counts once:
+        incidence = sparse.csr_matrix((np.ones(len(movie_index), dtype=np.int32), (user_index, movie_index)),
+                                      shape=(len(self.userids), len(self.movieids)))
+        incidence.data[:] = 1
+        self.incidence = incidence
+        # Item x user matrix, every row holds the (dense) indices of the users who rated that movie:
+        self.raters = incidence.T.tocsr()
+        # Item x item co-count product: cocounts[x, y] = how many users rated both movie x and movie y:
+        self.cocounts = None
+        if full_matrix:
+            self.cocounts = (self.raters * incidence).tocsr()
+
+    def how_many_X_and_Y(self, movieX_ID, movieY_ID):
+        """
+        Computes how many users rated movie X and movie Y as well.
+        :param movieX_ID: a movie ID
+        :param movieY_ID: another movie ID
+        :return: returns an integer.
+        """
+        x = self.index_of(movieX_ID)
+        y = self.index_of(movieY_ID)
+        if x == -1 or y == -1:
+            return 0
+        if self.cocounts is None:
+            return len(np.intersect1d(self.raters_of(x), self.raters_of(y), assume_unique=True))
+        return int(self.cocounts[x, y])
+
+    def raters_of(self, column):
+        """
+        Retrieves the (dense) indices of the users who rated the movie in the column provided by parameter.
+        :param column: column index of the movie
+        :return: array of user indices
+        """
+        return self.raters.indices[self.raters.indptr[column]:self.raters.indptr[column + 1]]
+
+    def cocounts_row(self, movieX_ID):
+        """
+        Retrieves how many users rated movie X together with every other movie.
+        :param movieX_ID: ID of movie X
+        :return: a dense array aligned with 'self.movieids'
+        """
+        x = self.index_of(movieX_ID)
+        if x == -1:
+            return np.zeros(len(self.movieids), dtype=np.int64)
+        if self.cocounts is not None:
+            return self.cocounts.getrow(x).toarray().ravel().astype(np.int64)
+        # No co-count product: the raters of X are gathered once and every movie they rated is counted in one pass.
+        histories = self.incidence[self.raters_of(x)]
+        return np.bincount(histories.indices, minlength=len(self.movieids)).astype(np.int64)
+
+    def cocounts_rows(self, columns):
+        """
+        Retrieves how many users rated every movie in 'columns' together with every other movie.
+        :param columns: array of column indices
+        :return: a sparse matrix with one row per column index
+        """
+        if self.cocounts is not None:
+            return self.cocounts[columns]
+        return self.raters[columns] * self.incidence
+
+
+def extract_columns(ratings):
+    """
+    Extracts the user IDs and movie IDs of all ratings into two parallel arrays of ints.
+    :param ratings: a collection of all ratings (list of dictionaries or dictionary of columns)
+    :return: an array with the user IDs AND an array with the movie IDs
+    """
+    return data.ratings_column(ratings, 'userid', np.int64), data.ratings_column(ratings, 'movieid', np.int64)
+
+
+def build_cooccurrence(ratings, full_matrix=True):
+    """
+    Builds the co-occurrence engine from a collection of all ratings.
+    :param ratings: a collection of all ratings (list of dictionaries or dictionary of columns)
+    :param full_matrix: whether to build the item x item co-count product or to count from the raters at query time
+    :return: a CoOccurrence object
+    """
+    userids, movieids = extract_columns(ratings)
+    return CoOccurrence(userids, movieids, full_matrix)
+
+
+def top_positions(values, movieIDs, n):
+    """
+    Retrieves the positions of the n biggest values, sorted from BIG to SMALL value.
+    In case of a tie, the movie with the higher ID is ranked before the movie with lower ID.
+    A partial selection ('np.partition') is done first, so only the candidates that can make it into the top n
+    (ties with the n-th value included) are actually sorted.
+    :param values: array of values
+    :param movieIDs: array of movie IDs aligned with 'values', used to break the ties
+    :param n: number of positions to retrieve
+    :return: array of positions
+    """
+    if n <= 0:
+        return np.array([], dtype=np.int64)
+    if n >= len(values):
+        candidates = np.arange(len(values))
+    else:
+        kth_value = np.partition(values, len(values) - n)[len(values) - n]  # n-th biggest value
+        candidates = np.flatnonzero(values >= kth_value)
+    order = np.lexsort((movieIDs[candidates], values[candidates]))[::-1]  # from BIG to SMALL value (and ID)
+    return candidates[order[:n]]
+
+
+def build_association_index(engine, movieIDs, N=10, block_size=512):
+    """
+    Offline (batch) job that precomputes the top N simple and advanced association neighbours of every movie.
+    The co-counts are processed in blocks of rows, so the memory needed is bounded by 'block_size' x amount of movies.
+    Rankings are exactly the ones of 'topN_movies_simple_association' and 'topN_movies_advanced_association': all
+    movies are ranked and the first position (the query movie itself) is skipped.
+    :param engine: a CoOccurrence object
+    :param movieIDs: IDs of ALL movies (e.g. the keys of the movies collection)
+    :param N: number of neighbours to keep for every movie
+    :param block_size: number of movies processed at once
+    :return: a dictionary with the index. Rows are aligned with 'movieids' (sorted) and missing neighbours are -1.
+    """
+    movieIDs = np.sort(np.array([int(movieid) for movieid in movieIDs], dtype=np.int64))
+    columns = engine.indices_of(movieIDs)
+    rated = np.flatnonzero(columns != -1)  # positions (in 'movieIDs') of the movies that were rated at least once
+    amount_rated = np.zeros(len(movieIDs), dtype=np.int64)  # how many times every movie was rated
+    amount_rated[rated] = engine.popularity[columns[rated]]
+    index = {'movieids': movieIDs.astype(np.int32), 'N': N}
+    for kind in ["simple", "advanced"]:
+        index[kind + "_ids"] = np.full((len(movieIDs), N), -1, dtype=np.int32)
+        index[kind + "_values"] = np.zeros((len(movieIDs), N))
+    for start in range(0, len(movieIDs), block_size):
+        rows = np.arange(start, min(start + block_size, len(movieIDs)))
+        # Co-counts of the movies in the block with respect to ALL movies (0 for movies nobody rated):
+        XY = np.zeros((len(rows), len(movieIDs)))
+        rated_rows = np.flatnonzero(columns[rows] != -1)
+        if len(rated_rows) > 0 and len(rated) > 0:
+            XY[np.ix_(rated_rows, rated)] = engine.cocounts_rows(columns[rows[rated_rows]])[:, columns[rated]].toarray()
+        X = amount_rated[rows].astype(np.float64)[:, None]
+        notX = (engine.num_ratings - amount_rated[rows]).astype(np.float64)[:, None]
+        notXY = amount_rated[None, :] - XY
+        simple = np.zeros(XY.shape)
+        np.divide(XY, X, out=simple, where=X != 0)
+        advanced = np.zeros(XY.shape)
+        valid = (X != 0) & (notX != 0) & (notXY != 0)
+        np.divide(simple, notXY / np.where(notX != 0, notX, 1.0), out=advanced, where=valid)
+        for kind, values in [("simple", simple), ("advanced", advanced)]:
+            for i, row in enumerate(rows):
+                positions = top_positions(values[i], movieIDs, N + 1)[1:]  # skip the query movie itself
+                index[kind + "_ids"][row, :len(positions)] = movieIDs[positions]
+                index[kind + "_values"][row, :len(positions)] = values[i][positions]
+    return index
+
+
+def lookup_association_index(index, kind, movieX_ID, N):
+    """
+    Answers a top N association query from the precomputed index.
+    :param index: dictionary built by 'build_association_index'
+    :param kind: either "simple" or "advanced"
+    :param movieX_ID: ID of movie X
+    :param N: number of movies to retrieve
+    :return: a list of tuples with movie ID and association value. None if the index cannot answer the query.
+    """
+    if N > index['N']:
+        return None
+    movieX_ID = int(movieX_ID)
+    row = np.searchsorted(index['movieids'], movieX_ID)
+    if row == len(index['movieids']) or index['movieids'][row] != movieX_ID:
+        return None
+    neighbours = []
+    for movieid, value in zip(index[kind + "_ids"][row, :N], index[kind + "_values"][row, :N]):
+        if movieid == -1:
+            break
+        neighbours.append((int(movieid), float(value)))
+    return neighbours
@@ -10,21 +10,47 @@ except:
     import pickle
 import os
 import time
+import itertools
+import numpy as np
 
 __author__ = "Aitor De Blas Granja"
 __email__ = "aitor.deblas@ugent.be"
 
-def load_dat(path):
+RATINGS_DTYPES = {'userid': np.int32, 'movieid': np.int32, 'rating': np.int8, 'timestamp': np.int64}  # types of the rating columns
+MOVIES_DTYPES = {'id': np.int32, 'title': object, 'genre': object}  # types of the movie columns
+
+
+def file_type_of(path, file_type=None):
+    """
+    Decides the type of the data file: either "movies" or "ratings". If it's not provided explicitly, it is guessed
+    from the path (the file name should contain "movies" or "ratings").
+    :param path: the path to the file or just the file name
+    :param file_type: "movies", "ratings" or None
+    :return: "movies" or "ratings"
+    """
+    if file_type is None:
+        if "movies" in path:
+            file_type = "movies"
+        elif "ratings" in path:
+            file_type = "ratings"
+    if file_type not in ["movies", "ratings"]:
+        raise ValueError("[Error] The file type should either be 'movies' or 'ratings' but got %s instead" % file_type)
+    return file_type
+
+
+def load_dat(path, file_type=None):
     """
     Loads the data file provided by parameter.
     :param path: the path to the file or just the file name
+    :param file_type: "movies" or "ratings". If None, it is guessed from the path.
     :return: a list of dictionaries or a dictionary with the corresponding data type
     """
     # First, let's try reading the .dat file. Then we will parse it.
     try:
+        file_type = file_type_of(path, file_type)
         with open(path, 'r') as datfile:
             # We parse the data according to/depending on the data file read (it can either be movies or ratings):
-            if "movies" in path:
+            if file_type == "movies":
                 lmovies = {}  # A dictionary indexed by movie ID containing the movie object itself.
                 for line in datfile:
                     movie = {}
@@ -37,7 +63,7 @@ def load_dat(path):
                     # print movie['id'], "::", movie['title'], "::", movie['genre']
                     lmovies[attributes[0]] = movie
                 return lmovies
-            elif "ratings" in path:
+            elif file_type == "ratings":
                 lratings = []  # A collection of ratings with their corresponding fields.
                 for line in datfile:
                     rating = {}
@@ -57,6 +83,74 @@ def load_dat(path):
         print "[Error] An error occurred: ", err
 
 
+def iter_dat_chunks(path, file_type, chunk_size=100000, rating_dtype=np.int8):
+    """
+    Streams the data file provided by parameter in chunks of typed columnar arrays. Only one chunk is kept in memory
+    at a time, so huge files can be processed with bounded memory.
+    Ratings chunks are dictionaries with the columns 'userid' (int32), 'movieid' (int32), 'rating' (int8 by default)
+    and 'timestamp' (int64). Movies chunks have the columns 'id' (int32), 'title' and 'genre' (strings).
+    :param path: the path to the file or just the file name
+    :param file_type: "movies" or "ratings"
+    :param chunk_size: number of lines per chunk
+    :param rating_dtype: type of the 'rating' column (e.g. np.int8 for whole stars, np.float32 for half stars)
+    :return: a generator of dictionaries with "Key=name of the column" and "Value=array"
+    """
+    file_type = file_type_of(path, file_type)
+    with open(path, 'r') as datfile:
+        while True:
+            lines = list(itertools.islice(datfile, chunk_size))
+            if len(lines) == 0:
+                break
+            if file_type == "ratings":
+                # All fields are numbers: the whole chunk is parsed at once by numpy.
+                values = np.fromstring("".join(lines).replace("::", " "), dtype=np.float64, sep=" ").reshape(-1, 4)
+                yield {'userid': values[:, 0].astype(RATINGS_DTYPES['userid']),
+                       'movieid': values[:, 1].astype(RATINGS_DTYPES['movieid']),
+                       'rating': values[:, 2].astype(rating_dtype),
+                       'timestamp': values[:, 3].astype(RATINGS_DTYPES['timestamp'])}
+            else:
+                attributes = [line.rstrip().split('::') for line in lines]
+                yield {'id': np.array([int(attribute[0]) for attribute in attributes], dtype=MOVIES_DTYPES['id']),
+                       'title': np.array([attribute[1] for attribute in attributes], dtype=MOVIES_DTYPES['title']),
+                       'genre': np.array([attribute[2] for attribute in attributes], dtype=MOVIES_DTYPES['genre'])}
+
+
+def load_dat_columns(path, file_type, chunk_size=100000, rating_dtype=np.int8):
+    """
+    Loads the whole data file provided by parameter into typed columnar arrays (see 'iter_dat_chunks').
+    A ratings file takes roughly 10 times less memory this way than as a list of dictionaries.
+    :param path: the path to the file or just the file name
+    :param file_type: "movies" or "ratings"
+    :param chunk_size: number of lines parsed at once
+    :param rating_dtype: type of the 'rating' column (e.g. np.int8 for whole stars, np.float32 for half stars)
+    :return: a dictionary with "Key=name of the column" and "Value=array"
+    """
+    chunks = list(iter_dat_chunks(path, file_type, chunk_size, rating_dtype))
+    dtypes = RATINGS_DTYPES if file_type_of(path, file_type) == "ratings" else MOVIES_DTYPES
+    columns = {}
+    for name in dtypes:
+        if len(chunks) == 0:
+            columns[name] = np.array([], dtype=rating_dtype if name == 'rating' else dtypes[name])
+        else:
+            columns[name] = np.concatenate([chunk[name] for chunk in chunks])
+    return columns
+
+
+def ratings_column(ratings, name, dtype):
+    """
+    Retrieves one column of the ratings as an array, whatever the representation of the ratings is: a list of
+    dictionaries (see 'load_dat') or a dictionary of columns (see 'load_dat_columns').
+    :param ratings: a collection of all ratings
+    :param name: name of the column: 'userid', 'movieid', 'rating' or 'timestamp'
+    :param dtype: type of the returned array
+    :return: an array
+    """
+    if isinstance(ratings, dict):
+        return np.asarray(ratings[name], dtype=dtype)
+    return np.fromiter((float(rating[name]) if dtype == np.float64 else int(rating[name]) for rating in ratings),
+                       dtype=dtype, count=len(ratings))
+
+
 def dump_pickle(data, path):
     """
     Creates a pickle with the data provided by parameter and the name/path of the file.
@@ -106,3 +200,93 @@ def generate_file_name(name, file_ext):
     if name is "":
         raise ValueError("[Error] A path or file name should be provided, cannot be empty")
     return name + "_pickle_" + time.strftime("%d-%m-%Y--%H-%M-%S", time.localtime()) + "." + file_ext
+
+
+class Dataset:
+    """
+    In-process handle of the data-set: movies, ratings and every index derived from them (e.g. the co-occurrence
+    engine). The pickles are loaded just once and shared by all functions. Whenever the path or the modification time
+    of a pickle changes, it is loaded again and the derived indexes are dropped, so they get rebuilt on demand.
+    """
+
+    def __init__(self, movies_path, ratings_path):
+        """
+        :param movies_path: path to the pickle of the movies
+        :param ratings_path: path to the pickle of the ratings
+        """
+        self.movies_path = movies_path
+        self.ratings_path = ratings_path
+        self.__movies = None
+        self.__ratings = None
+        self.__movies_mtime = None  # modification time of the movies pickle when it was loaded
+        self.__ratings_mtime = None  # modification time of the ratings pickle when it was loaded
+        self.__derived = {}  # dictionary with "Key=name of the index" and "Value=the index itself"
+
+    def movies(self):
+        """
+        Retrieves the movies, loading the pickle only if it wasn't loaded yet or it changed on disk.
+        :return: a dictionary indexed by movie ID containing the movie object itself
+        """
+        mtime = os.path.getmtime(self.movies_path) if os.path.exists(self.movies_path) else None
+        if self.__movies is None or mtime != self.__movies_mtime:
+            self.__movies = load_pickle(self.movies_path)
+            self.__movies_mtime = mtime
+            self.__derived = {}
+        return self.__movies
+
+    def ratings(self):
+        """
+        Retrieves the ratings, loading the pickle only if it wasn't loaded yet or it changed on disk.
+        :return: a list of ratings
+        """
+        mtime = os.path.getmtime(self.ratings_path) if os.path.exists(self.ratings_path) else None
+        if self.__ratings is None or mtime != self.__ratings_mtime:
+            self.__ratings = load_pickle(self.ratings_path)
+            self.__ratings_mtime = mtime
+            self.__derived = {}
+        return self.__ratings
+
+    def derived(self, name, builder):
+        """
+        Retrieves an index derived from the data-set. It is built (just once) by calling 'builder' with this handle.
+        :param name: name of the index
+        :param builder: function that receives the handle and returns the index
+        :return: the index
+        """
+        self.ratings()  # drops the derived indexes if the ratings changed on disk
+        if name not in self.__derived:
+            self.__derived[name] = builder(self)
+        return self.__derived[name]
+
+    def ratings_signature(self):
+        """
+        Identifies the ratings the data-set holds, so indexes stored on disk can tell whether they were built from them.
+        :return: a tuple with the path and the modification time of the ratings pickle
+        """
+        self.ratings()
+        return self.ratings_path, self.__ratings_mtime
+
+    def invalidate(self):
+        """
+        Forgets everything, so the pickles are loaded again the next time they are needed.
+        :return: nothing
+        """
+        self.__movies = None
+        self.__ratings = None
+        self.__derived = {}
+
+
+DATASETS = {}  # dictionary with "Key=(movies path, ratings path)" and "Value=Dataset handle"
+
+
+def get_dataset(movies_path, ratings_path):
+    """
+    Retrieves the (shared) data-set handle of the pickles provided by parameter.
+    :param movies_path: path to the pickle of the movies
+    :param ratings_path: path to the pickle of the ratings
+    :return: a Dataset object
+    """
+    key = (movies_path, ratings_path)
+    if key not in DATASETS:
+        DATASETS[key] = Dataset(movies_path, ratings_path)
+    return DATASETS[key]
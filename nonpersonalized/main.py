@@ -6,13 +6,29 @@ This file is the main file. The non-personalized recommender system starts here.
 __author__ = "Aitor De Blas Granja"
 __email__ = "aitor.deblas@ugent.be"
 
+import numpy as np
 import data
 import utils
-import operator  # used to sort the (key,value) pairs of a dictionary
+import cooccurrence
+import bitsets
+import minhash
+import popularity
+import trending
 import globals  # a file to store global variables to use them across all Python files
 
 MOVIE_PICKLE_LOCATION = "movies_pickle_26-02-2018--20-19-52.pkl"
 RATINGS_PICKLE_LOCATION = "ratings_pickle_26-02-2018--17-55-35.pkl"
+ASSOCIATION_INDEX_LOCATION = None  # pickle of the precomputed association index (None if it hasn't been built yet)
+POPULARITY_PICKLE_LOCATION = None  # pickle of the popularity index (None if it hasn't been dumped yet)
+ASSOCIATION_INDEX_SIZE = 20  # number of neighbours stored for every movie in the association index
+# Query mode of the association recommenders. It can either be:
+# - "matrix": the item x item co-count product is built once and every query is a single row lookup.
+# - "raters": no co-count product. A query for movie X only counts the movies rated by the users who rated X.
+# - "bitset": the raters of every movie are packed bitsets and co-counts are popcounts of their intersections.
+# - "minhash": approximate. Candidates come from an LSH index and co-counts are estimated from MinHash signatures.
+ASSOCIATION_MODE = "matrix"
+MINHASH_HASHES = 128  # length of the MinHash signatures (the more hashes, the better the estimates)
+MINHASH_BANDS = 64  # number of LSH bands (the more bands, the more candidates and the slower the queries)
 
 
 def calculate_simple_association(movieX, movieY, ratings=None):
@@ -20,13 +36,15 @@ def calculate_simple_association(movieX, movieY, ratings=None):
     Calculates the simple association value for movieX with respect movieY.
     :param movieX: ID of movie X
     :param movieY: ID of movie Y
-    :param ratings: collection of all ratings. If available at calling time, then it can be used, otherwise it will be
-    locally retrieved.
+    :param ratings: collection of all ratings. If available at calling time, then it can be used, otherwise the counts
+    are retrieved from the co-occurrence engine of the data-set.
     :return: the value computed by the simple association
     """
-    # First get the data (preferably by parameter otherwise from pickles):
+    # If no ratings are provided, the counts are just looked up in the co-occurrence engine of the data-set:
     if ratings is None:
-        ratings = data.load_pickle(RATINGS_PICKLE_LOCATION)  # Movies data-set not needed, just ratings.
+        engine = get_cooccurrence()
+        XY = float(engine.how_many_X_and_Y(movieX, movieY))
+        return XY/engine.how_many_Z(movieX)
     XY = float(utils.how_many_X_and_Y(movieX, movieY, ratings))
     X = globals.AMOUNT_RATED_X
     if X is None:
@@ -39,19 +57,24 @@ def calculate_advanced_association(movieX, movieY, ratings=None):
     Calculates the advanced association value for movieX with respect movieY.
     :param movieX: ID of movie X
     :param movieY: ID of movie Y
-    :param ratings: collection of all ratings. If available at calling time, then it can be used, otherwise it will be
-    locally retrieved.
+    :param ratings: collection of all ratings. If available at calling time, then it can be used, otherwise the counts
+    are retrieved from the co-occurrence engine of the data-set.
     :return: the value computed by the advanced association
     """
-    # First get the data (preferably by parameter otherwise from pickles):
+    # If no ratings are provided, the counts are just looked up in the co-occurrence engine of the data-set:
     if ratings is None:
-        ratings = data.load_pickle(RATINGS_PICKLE_LOCATION)  # Movies data-set not needed, just ratings.
-    X = globals.AMOUNT_RATED_X
-    if X is None:
-        X = utils.how_many_Z(movieX, ratings)
-    Y = utils.how_many_Z(movieY, ratings)
-    XY = utils.how_many_X_and_Y(movieX, movieY, ratings)
-    notX = len(ratings) - X
+        engine = get_cooccurrence()
+        X = engine.how_many_Z(movieX)
+        Y = engine.how_many_Z(movieY)
+        XY = engine.how_many_X_and_Y(movieX, movieY)
+        notX = engine.num_ratings - X
+    else:
+        X = globals.AMOUNT_RATED_X
+        if X is None:
+            X = utils.how_many_Z(movieX, ratings)
+        Y = utils.how_many_Z(movieY, ratings)
+        XY = utils.how_many_X_and_Y(movieX, movieY, ratings)
+        notX = len(ratings) - X
     notXY = Y - XY
     try:
         value = (float(XY)/X)/(float(notXY)/notX)
@@ -65,6 +88,73 @@ def calculate_advanced_association(movieX, movieY, ratings=None):
         # print "notX = ", notX
         return 0.0
 
+
+def get_dataset():
+    """
+    Retrieves the handle of the data-set (see 'data.Dataset'). Movies, ratings and derived indexes are loaded just
+    once and shared by all functions. They are only loaded again when the pickles change.
+    :return: a Dataset object
+    """
+    return data.get_dataset(MOVIE_PICKLE_LOCATION, RATINGS_PICKLE_LOCATION)
+
+
+def get_cooccurrence():
+    """
+    Retrieves the counting backend of the association recommenders. It is built just once from the ratings of the
+    data-set. Depending on ASSOCIATION_MODE, it is the co-occurrence engine (see 'cooccurrence.py') with or without
+    the co-count product, the rater bitsets (see 'bitsets.py') or the approximate MinHash/LSH index (see 'minhash.py').
+    :return: a CoOccurrence, RaterBitsets or MinHashLSH object
+    """
+    if ASSOCIATION_MODE == "bitset":
+        return get_bitsets()
+    if ASSOCIATION_MODE == "minhash":
+        return get_dataset().derived("minhash-%d-%d" % (MINHASH_HASHES, MINHASH_BANDS),
+                                     lambda dataset: minhash.build_minhash(dataset.ratings(), MINHASH_HASHES, MINHASH_BANDS))
+
+    def build(dataset):
+        return cooccurrence.build_cooccurrence(dataset.ratings(), ASSOCIATION_MODE == "matrix")
+    return get_dataset().derived("cooccurrence-" + ASSOCIATION_MODE, build)
+
+
+def get_bitsets():
+    """
+    Retrieves the rater bitsets (see 'bitsets.py'). They are built just once from the ratings of the data-set.
+    :return: a RaterBitsets object
+    """
+    return get_dataset().derived("bitsets", lambda dataset: bitsets.build_rater_bitsets(dataset.ratings()))
+
+
+def how_many_rated_all(movieIDs):
+    """
+    Computes how many users rated ALL the movies provided by parameter (e.g. X and Y and Z).
+    :param movieIDs: list of movie IDs
+    :return: returns an integer.
+    """
+    return get_bitsets().how_many_rated_all(movieIDs)
+
+
+def rank_associations(engine, values, movies, N):
+    """
+    Sorts all movies from BIG to SMALL association value and keeps the top N of them.
+    In case of a tie, the movie with the higher ID is ranked before the movie with lower ID. Movies that nobody rated
+    get an association value of 0. The first position is skipped since it corresponds to the query movie itself.
+    :param engine: the counting backend the association values were computed with
+    :param values: array of association values aligned with the movies of the engine
+    :param movies: collection of all movies
+    :param N: number of movies to put in the returned list (topN)
+    :return: a list of tuples with movie ID, association value and title
+    """
+    movieIDs = np.array([int(movieid) for movieid in movies.keys()], dtype=np.int64)
+    columns = engine.indices_of(movieIDs)
+    movie_values = np.where(columns != -1, values[columns], 0.0)
+    # We are interested just in the top N movies, except the query movie itself (first position):
+    order = cooccurrence.top_positions(movie_values, movieIDs, N+1)[1:]
+    topN = []
+    for i in order:
+        topN.append((int(movieIDs[i]), float(movie_values[i]), movies[str(movieIDs[i])]['title']))
+    return topN
+
+
 def topN_movies_simple_association(movieX_ID, N=10):
     """
     Retrieves a list of movie IDs with the highest simple association value with respect movieX.
@@ -73,30 +163,19 @@ def topN_movies_simple_association(movieX_ID, N=10):
     :param N: number of movies to put in the returned list (topN)
     :return: a list of tuples with movie ID, association value and title
     """
-    # First get the data (preferably from pickles):
-    movies = data.load_pickle(MOVIE_PICKLE_LOCATION)
-    ratings = data.load_pickle(RATINGS_PICKLE_LOCATION)
-    # To SPEED UP the execution of the algorithm and avoid repetitive jobs/tasks, we will obtain/retrieve now:
-    # - How many times movie X was rated
-    # - A collection of all ratings indexed by user
-    # Normally you would obtain this info in another more appropriate (inner) methods, but since we are now iterating
-    # over all movies, there are some variables or data that is common to every iteration, thus we obtain it outside the
-    # loop. These are global variables that can be consulted from other modules or Python files.
-    globals.AMOUNT_RATED_X = utils.how_many_Z(movieX_ID, ratings)
-    globals.RATINGS_BY_USER = utils.extract_ratings_by_user(ratings)
-
-    # Now, we will iterate over all movies to calculate their respective simple association value given the movieX ID.
-    sa_values = []  # A list of tuples with the following form: "(movieID, association value)"
-
-    for i, movieY_ID in enumerate(movies.keys()):  # movies.keys()[:100]
-        sa_values.append((int(movieY_ID), calculate_simple_association(movieX_ID, movieY_ID, ratings)))
-        # print "(i=", i, ")Appended movie: ", movieY_ID
-    mysorted = sorted(sa_values, key=operator.itemgetter(1, 0), reverse=True)  # tuples sorted from BIG to SMALL association value
-    mysorted = mysorted[1:N+1]  # we are interested just in the top N tuples, except the query movie itself
-    topN = []
-    for elem in mysorted:
-        topN.append((elem[0], elem[1], movies[str(elem[0])]['title']))
-    return topN
+    # First get the data (loaded just once):
+    movies = get_dataset().movies()
+    # If the association index was precomputed (see 'cooccurrence.build_association_index'), the answer is just read:
+    index = get_association_index()
+    if index is not None:
+        neighbours = cooccurrence.lookup_association_index(index, "simple", movieX_ID, N)
+        if neighbours is not None:
+            return [(movieid, value, movies[str(movieid)]['title']) for movieid, value in neighbours]
+    # To SPEED UP the execution of the algorithm, the co-occurrence engine is built just once. Afterwards, the simple
+    # association values of movie X with respect to ALL movies come out of a single row lookup:
+    engine = get_cooccurrence()
+    sa_values = engine.simple_association(movieX_ID)
+    return rank_associations(engine, sa_values, movies, N)
 
 
 def topN_movies_advanced_association(movieX_ID, N=10):
@@ -107,78 +186,153 @@ def topN_movies_advanced_association(movieX_ID, N=10):
     :param N: number of movies to put in the returned list (topN)
     :return: a list of tuples with movie ID, association value and title
     """
-    # First get the data (preferably from pickles):
-    movies = data.load_pickle(MOVIE_PICKLE_LOCATION)  # Ratings data-set is not needed in this case.
-    ratings = data.load_pickle(RATINGS_PICKLE_LOCATION)
-    # To SPEED UP the execution of the algorithm and avoid repetitive jobs/tasks, we will obtain/retrieve now:
-    # - How many times movie X was rated
-    # - A collection of all ratings indexed by user
-    # Normally you would obtain this info in another more appropriate (inner) methods, but since we are now iterating
-    # over all movies, there are some variables or data that is common to every iteration, thus we obtain it outside the
-    # loop. These are global variables that can be consulted from other modules or Python files.
-    globals.AMOUNT_RATED_X = utils.how_many_Z(movieX_ID, ratings)
-    globals.RATINGS_BY_USER = utils.extract_ratings_by_user(ratings)
-
-    # Now, we will iterate over all movies to calculate their respective simple association value given the movieX ID.
-    aa_values = []  # A list of tuples with the following form: "(movieID, association value)"
-
-    for i, movieY_ID in enumerate(movies.keys()):  # movies.keys()[:100]
-        aa_values.append((int(movieY_ID), calculate_advanced_association(movieX_ID, movieY_ID, ratings)))
-        # print "(i=", i, ")Appended movie: ", movieY_ID
-    mysorted = sorted(aa_values, key=operator.itemgetter(1, 0), reverse=True)  # tuples sorted from BIG to SMALL association value
-    mysorted = mysorted[1:N + 1]  # we are interested just in the top N tuples, except the query movie itself
-    topN = []
-    for elem in mysorted:
-        topN.append((elem[0], elem[1], movies[str(elem[0])]['title']))
-    return topN
+    # First get the data (loaded just once):
+    movies = get_dataset().movies()  # Ratings data-set is not needed in this case.
+    # If the association index was precomputed (see 'cooccurrence.build_association_index'), the answer is just read:
+    index = get_association_index()
+    if index is not None:
+        neighbours = cooccurrence.lookup_association_index(index, "advanced", movieX_ID, N)
+        if neighbours is not None:
+            return [(movieid, value, movies[str(movieid)]['title']) for movieid, value in neighbours]
+    # To SPEED UP the execution of the algorithm, the co-occurrence engine is built just once. Afterwards, the advanced
+    # association values of movie X with respect to ALL movies come out of a single row lookup:
+    engine = get_cooccurrence()
+    aa_values = engine.advanced_association(movieX_ID)
+    return rank_associations(engine, aa_values, movies, N)
+
+
+def get_popularity():
+    """
+    Retrieves the popularity index (see 'popularity.py'). It is built just once from the ratings of the data-set (or
+    loaded from its pickle).
+    :return: a PopularityIndex object
+    """
+    def build(dataset):
+        if POPULARITY_PICKLE_LOCATION is not None:
+            return popularity.load_popularity_index(data.load_pickle(POPULARITY_PICKLE_LOCATION))
+        return popularity.build_popularity_index(dataset.ratings())
+    return get_dataset().derived("popularity", build)
+
+
+def get_association_index():
+    """
+    Retrieves the precomputed association index (see 'cooccurrence.build_association_index'). It is loaded just once
+    from its pickle and dropped along with the other indexes of the data-set. An index built from other ratings (i.e.
+    another path or modification time of the ratings pickle) is ignored.
+    :return: a dictionary with the index. None if there is no index or it is out of date.
+    """
+    def build(dataset):
+        if ASSOCIATION_INDEX_LOCATION is None:
+            return None
+        index = data.load_pickle(ASSOCIATION_INDEX_LOCATION)
+        if index.get('ratings') != dataset.ratings_signature():
+            return None
+        return index
+    return get_dataset().derived("association-index", build)
 
 
-def topN_most_rated_movies(N=10, stars=None):
+def topN_most_rated_movies(N=10, stars=None, at_least=False):
     """
     Retrieves a list of movie names and another list with their corresponding ratings which are the
     most rated movies.
+    In case of a tie, the movie with the higher ID is ranked before the movie with lower ID.
     :param N: number of movies to put in the returned list (topN)
-    :param stars: number of stars (integer) for which movies will be extracted for the topN
+    :param stars: number of stars (integer) for which movies will be extracted for the topN. Only ratings with less
+    stars are counted (unless 'at_least' is True)
+    :param at_least: if True, only ratings with at least 'stars' stars are counted
     :return: a list of (most rated) movie names AND a list of their ratings as well. Ordered from BIG to SMALL.
     """
-    aggregated_ratings = {}
     topN_movies = []
     topN_ratings = []
-    # First, let's load the data:
-    movies = data.load_pickle(MOVIE_PICKLE_LOCATION)
-    ratings = data.load_pickle(RATINGS_PICKLE_LOCATION)
-    # Now, we will iterate over all ratings and we will aggregate/count all ratings for every movie:
-    for elem in ratings:
-        if stars is not None and int(elem['rating']) >= stars:
-            continue
-        if not elem['movieid'] in aggregated_ratings:
-            aggregated_ratings[elem['movieid']] = 1
-        else:
-            aggregated_ratings[elem['movieid']] += 1
-    # print "Num elements (aggregated dictionary): ", len(aggregated_ratings)
-    # 'sorted' function sorts the dictionary from SMALL to BIG, returns a list:
-    mysorted = sorted(aggregated_ratings.items(), key=operator.itemgetter(1), reverse=True)
-    # We take the first N elements (Top N):
-    mysorted = mysorted[:N]
+    # First, let's get the data (loaded just once):
+    movies = get_dataset().movies()
+    index = get_popularity()
+    # The amount of ratings of every movie (with or without stars) comes out of the cumulative movie x star table:
+    if stars is None:
+        amounts = index.amount_ratings()
+    elif at_least:
+        amounts = index.amount_ratings_over(stars)
+    else:
+        amounts = index.amount_ratings_under(stars)
+    # Movies that didn't get any (matching) rating are not taken into account:
+    candidates = np.flatnonzero(amounts > 0)
+    positions = candidates[cooccurrence.top_positions(amounts[candidates], index.movieids[candidates], N)]
     # We collect the movie IDs:
-    topN_movieIDs = [elem[0] for elem in mysorted]
+    topN_movieIDs = [str(index.movieids[i]) for i in positions]
     # We are also interested in movie NAMES:
-    for elem in mysorted:
-        topN_movies.append(movies[elem[0]]['title'])
-        topN_ratings.append(elem[1])
+    for i in positions:
+        topN_movies.append(movies[str(index.movieids[i])]['title'])
+        topN_ratings.append(int(amounts[i]))
+    return topN_movies, topN_ratings, topN_movieIDs
+
+
+def topN_best_rated_movies(N=10, min_ratings=1):
+    """
+    Retrieves a list of movie names and another list with their corresponding mean ratings which are the
+    movies with the highest average rating.
+    In case of a tie, the movie with the higher ID is ranked before the movie with lower ID.
+    :param N: number of movies to put in the returned list (topN)
+    :param min_ratings: movies rated less times than this are not taken into account
+    :return: a list of (best rated) movie names AND a list of their mean ratings as well. Ordered from BIG to SMALL.
+    """
+    movies = get_dataset().movies()
+    index = get_popularity()
+    topN = index.top_movies(index.mean_ratings(), N, min_ratings)
+    topN_movies = [movies[str(movieid)]['title'] for movieid, mean in topN]
+    topN_means = [float(mean) for movieid, mean in topN]
+    topN_movieIDs = [str(movieid) for movieid, mean in topN]
+    return topN_movies, topN_means, topN_movieIDs
+
+
+def get_trending():
+    """
+    Retrieves the trending counter (see 'trending.py'). It is built just once from the ratings of the data-set.
+    New ratings are counted incrementally with 'get_trending().add_rating'.
+    :return: a TrendingCounter object
+    """
+    return get_dataset().derived("trending", lambda dataset: trending.build_trending_counter(dataset.ratings()))
+
+
+def topN_trending_movies(window="week", movies=None, N=10):
+    """
+    Retrieves a list of movie names and another list with their corresponding amount of ratings which are the
+    most rated movies within the last time window (with respect to the newest rating).
+    In case of a tie, the movie with the higher ID is ranked before the movie with lower ID.
+    :param window: name of the time window: "day", "week" or "month"
+    :param movies: collection of all movies. If None, the movies of the data-set are used.
+    :param N: number of movies to put in the returned list (topN)
+    :return: a list of (trending) movie names AND a list of their ratings as well. Ordered from BIG to SMALL.
+    """
+    if movies is None:
+        movies = get_dataset().movies()
+    topN = get_trending().top_movies(window, N)
+    topN_movies = [movies[str(movieid)]['title'] for movieid, amount in topN]
+    topN_ratings = [amount for movieid, amount in topN]
+    topN_movieIDs = [str(movieid) for movieid, amount in topN]
     return topN_movies, topN_ratings, topN_movieIDs
 
 
 def main():
     # Load data and parse it:
     # mymovies = data.load_dat("movies.dat")
-    # myratings = data.load_dat("ratings.dat")
+    # myratings = data.load_dat("ratings.dat")  # or data.load_dat_columns("ratings.dat", "ratings"), much lighter
     # Dump the parsed data to pickles into the file system:
     # data.dump_pickle(mymovies, generate_file_name("movies", "pkl"))
     # data.dump_pickle(myratings, generate_file_name("ratings", "pkl"))
-    # Load the pickles (much faster than loading and parsing again the raw data):
-    movies_pkl = data.load_pickle(MOVIE_PICKLE_LOCATION)
-    ratings_pkl = data.load_pickle(RATINGS_PICKLE_LOCATION)
+    # Load the pickles (much faster than loading and parsing again the raw data). They are loaded just once and shared:
+    movies_pkl = get_dataset().movies()
+    ratings_pkl = get_dataset().ratings()
+    # Build the co-occurrence engine once, every association value is looked up from it afterwards:
+    get_cooccurrence()
+    # Build the association index of all movies and dump it to a pickle into the file system (just for the first time):
+    # index = cooccurrence.build_association_index(get_cooccurrence(), movies_pkl.keys(), ASSOCIATION_INDEX_SIZE)
+    # index['ratings'] = get_dataset().ratings_signature()  # the index is ignored if the ratings change afterwards
+    # data.dump_pickle(index, data.generate_file_name("association-index", "pkl"))
+    # Build the popularity index once and dump it to a pickle next to the movies (just for the first time):
+    get_popularity()
+    # data.dump_pickle(get_popularity().to_dict(), data.generate_file_name("popularity", "pkl"))
+    # Load the association index, top N association queries are answered from it:
+    get_association_index()
 
     # Question 1:
     print "Question 1: simple product association 1 and 1064 = ", calculate_simple_association(1, 1064)
@@ -228,8 +382,8 @@ def test():
     # data.dump_pickle(mymovies, generate_file_name("movies", "pkl"))
     # data.dump_pickle(myratings, generate_file_name("ratings", "pkl"))
     # Load the pickles (much faster than loading and parsing again the raw data):
-    movies_pkl = data.load_pickle(MOVIE_PICKLE_LOCATION)
-    ratings_pkl = data.load_pickle(RATINGS_PICKLE_LOCATION)
+    movies_pkl = get_dataset().movies()
+    ratings_pkl = get_dataset().ratings()
     print "len(movies_pkl): ", len(movies_pkl)
     print "len(ratings_pkl): ", len(ratings_pkl)
     # print movies_pkl['3196']
@@ -266,6 +420,11 @@ def test():
     # for item in topn:
     #     print item
 
+    # Error of the approximate (MinHash/LSH) association with respect to the exact one over 100 query movies:
+    # approximate = minhash.build_minhash(ratings_pkl, MINHASH_HASHES, MINHASH_BANDS)
+    # exact = cooccurrence.build_cooccurrence(ratings_pkl)
+    # print minhash.error_report(approximate, exact, movies_pkl.keys()[:100])
+
     # Retrieve topN movies with highest advanced association value w.r.t ID 3941:
     # print "topN movies with highest advanced association value w.r.t ID 3941"
     # topn = topN_movies_advanced_association(3941)
@@ -0,0 +1,185 @@
+"""
+This file holds an approximate counting backend for the association recommenders, meant for very large catalogs.
+Every movie gets a MinHash signature of the set of users who rated it. Signatures are split in bands and an LSH index
+is built over the bands, so the candidate movies Y for a query movie X (those sharing at least one band with X) are
+retrieved without going over the whole catalog. Their overlap with X is estimated from the signatures:
+    jaccard(X, Y) ~ fraction of equal signature values
+    |X and Y|     ~ jaccard / (1 + jaccard) * (|X| + |Y|)
+More hashes mean better estimates, more bands (with less rows each) mean more candidates: both make queries slower.
+"""
+
+import time
+import numpy as np
+from scipy import sparse
+import cooccurrence
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+PRIME = 2147483647  # Mersenne prime (2^31 - 1) used by the universal hash functions
+
+
+class MinHashLSH(cooccurrence.CountingBackend):
+    """
+    Approximate counting backend. Movies that are not LSH candidates of movie X get a co-count of 0.
+    """
+
+    def __init__(self, userids, movieids, num_hashes=128, bands=64, seed=0):
+        """
+        Builds the MinHash signatures and the LSH band index out of two parallel arrays.
+        :param userids: array of ints, the user ID of every rating
+        :param movieids: array of ints, the movie ID of every rating
+        :param num_hashes: length of the signatures (accuracy of the estimates)
+        :param bands: number of LSH bands, it must divide 'num_hashes' (the more bands, the more candidates)
+        :param seed: seed of the random hash functions
+        """
+        if num_hashes % bands != 0:
+            raise ValueError("[Error] The number of bands (%d) must divide the number of hashes (%d)" % (bands, num_hashes))
+        user_index, movie_index = self.index_ratings(userids, movieids)
+        self.num_hashes = num_hashes
+        self.bands = bands
+        # Raters of every movie, grouped by movie (CSR-like: raters of movie m are users[indptr[m]:indptr[m+1]]):
+        order = np.argsort(movie_index, kind='mergesort')
+        users = user_index[order].astype(np.int64)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(movie_index, minlength=len(self.movieids)))])
+        # Universal hash functions h(u) = (a*u + b) mod PRIME. The signature of a movie is the minimum over its raters:
+        random = np.random.RandomState(seed)
+        a = random.randint(1, PRIME, size=num_hashes).astype(np.int64)
+        b = random.randint(0, PRIME, size=num_hashes).astype(np.int64)
+        self.signatures = np.zeros((num_hashes, len(self.movieids)), dtype=np.int64)
+        if len(users) > 0:
+            for k in range(num_hashes):
+                self.signatures[k] = np.minimum.reduceat((a[k] * users + b[k]) % PRIME, indptr[:-1])
+        # LSH index: every band of the signature is hashed into a single key. For every band, the movies are sorted by
+        # key, so the movies sharing the key of movie X are found with a binary search:
+        rows = num_hashes // bands
+        self.band_keys = np.zeros((bands, len(self.movieids)), dtype=np.uint64)
+        for band in range(bands):
+            key = np.zeros(len(self.movieids), dtype=np.uint64)
+            for row in range(band * rows, (band + 1) * rows):
+                key = key * np.uint64(1000003) ^ self.signatures[row].astype(np.uint64)
+            self.band_keys[band] = key
+        self.band_order = np.argsort(self.band_keys, axis=1)
+        self.sorted_band_keys = self.band_keys[np.arange(bands)[:, None], self.band_order]
+
+    def candidates(self, column):
+        """
+        Retrieves the LSH candidates of the movie in the column provided by parameter: the movies that share at least
+        one band of their signature with it (the movie itself included).
+        :param column: column index of the movie
+        :return: sorted array of column indices
+        """
+        found = []
+        for band in range(self.bands):
+            key = self.band_keys[band, column]
+            lo = np.searchsorted(self.sorted_band_keys[band], key, side='left')
+            hi = np.searchsorted(self.sorted_band_keys[band], key, side='right')
+            found.append(self.band_order[band, lo:hi])
+        return np.unique(np.concatenate(found))
+
+    def estimate_cocounts(self, column, columns):
+        """
+        Estimates how many users rated the movie in 'column' together with every movie in 'columns'.
+        :param column: column index of movie X
+        :param columns: array of column indices of the movies Y
+        :return: array of floats aligned with 'columns'
+        """
+        jaccard = (self.signatures[:, columns] == self.signatures[:, column][:, None]).mean(axis=0)
+        X = self.popularity[column]
+        Y = self.popularity[columns]
+        # An estimate can never be bigger than the smallest of both sets:
+        return np.minimum(jaccard / (1.0 + jaccard) * (X + Y), np.minimum(X, Y))
+
+    def how_many_X_and_Y(self, movieX_ID, movieY_ID):
+        """
+        Estimates how many users rated movie X and movie Y as well.
+        :param movieX_ID: a movie ID
+        :param movieY_ID: another movie ID
+        :return: returns a float.
+        """
+        x = self.index_of(movieX_ID)
+        y = self.index_of(movieY_ID)
+        if x == -1 or y == -1:
+            return 0.0
+        return float(self.estimate_cocounts(x, np.array([y]))[0])
+
+    def cocounts_row(self, movieX_ID):
+        """
+        Estimates how many users rated movie X together with every other movie. Movies that are not LSH candidates
+        get 0.
+        :param movieX_ID: ID of movie X
+        :return: a dense array of floats aligned with 'self.movieids'
+        """
+        x = self.index_of(movieX_ID)
+        counts = np.zeros(len(self.movieids))
+        if x == -1:
+            return counts
+        candidates = self.candidates(x)
+        counts[candidates] = self.estimate_cocounts(x, candidates)
+        return counts
+
+    def cocounts_rows(self, columns):
+        """
+        Estimates how many users rated every movie in 'columns' together with every other movie.
+        :param columns: array of column indices
+        :return: a sparse matrix with one row per column index
+        """
+        rows = [sparse.csr_matrix(self.cocounts_row(self.movieids[column])) for column in columns]
+        return sparse.vstack(rows, format='csr')
+
+
+def build_minhash(ratings, num_hashes=128, bands=64):
+    """
+    Builds the approximate (MinHash/LSH) counting backend from a collection of all ratings.
+    :param ratings: a collection of all ratings (list of dictionaries or dictionary of columns)
+    :param num_hashes: length of the signatures (accuracy of the estimates)
+    :param bands: number of LSH bands (the more bands, the more candidates)
+    :return: a MinHashLSH object
+    """
+    userids, movieids = cooccurrence.extract_columns(ratings)
+    return MinHashLSH(userids, movieids, num_hashes, bands)
+
+
+def error_report(approximate, exact, movieIDs, N=10):
+    """
+    Compares the simple association values of the approximate backend against the exact ones (the values of
+    'calculate_simple_association') for the query movies provided by parameter.
+    :param approximate: a MinHashLSH object
+    :param exact: an exact counting backend (e.g. a CoOccurrence object) built from the same ratings
+    :param movieIDs: list of IDs of the query movies
+    :param N: size of the top N lists compared by the recall
+    :return: a dictionary with the mean and max absolute error, the recall of the top N, the average number of LSH
+    candidates and the average query time (in ms) of both backends
+    """
+    errors = []
+    recalls = []
+    amount_candidates = []
+    time_approximate = 0.0
+    time_exact = 0.0
+    for movieID in movieIDs:
+        x = approximate.index_of(movieID)
+        if x == -1:
+            continue
+        start = time.time()
+        approximate_values = approximate.simple_association(movieID)
+        time_approximate += time.time() - start
+        start = time.time()
+        exact_values = exact.simple_association(movieID)
+        time_exact += time.time() - start
+        errors.append(np.abs(approximate_values - exact_values))
+        amount_candidates.append(len(approximate.candidates(x)))
+        # Recall of the top N (the query movie itself is skipped):
+        exact_top = set(cooccurrence.top_positions(exact_values, approximate.movieids, N + 1)[1:])
+        approximate_top = set(cooccurrence.top_positions(approximate_values, approximate.movieids, N + 1)[1:])
+        if len(exact_top) > 0:
+            recalls.append(len(exact_top & approximate_top) / float(len(exact_top)))
+    if len(errors) == 0:
+        raise ValueError("[Error] None of the provided movies was rated. Cannot compute the report!")
+    errors = np.concatenate(errors)
+    return {'queries': len(amount_candidates),
+            'mean_absolute_error': float(errors.mean()),
+            'max_absolute_error': float(errors.max()),
+            'recall_at_N': float(np.mean(recalls)) if len(recalls) > 0 else 0.0,
+            'mean_candidates': float(np.mean(amount_candidates)),
+            'ms_per_query_approximate': 1000.0 * time_approximate / len(amount_candidates),
+            'ms_per_query_exact': 1000.0 * time_exact / len(amount_candidates)}
@@ -0,0 +1,110 @@
+"""
+This file holds the popularity index used by the "most rated" recommenders.
+For every movie it stores how many ratings were given with every star value (a small movie x star count table). It is
+built once from the ratings, so any "most rated", "most rated under/over k stars" or mean rating ranking is answered with
+a cumulative sum over the stars and a partial selection over the movies, instead of aggregating all ratings again.
+"""
+
+import numpy as np
+import data
+import cooccurrence
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+
+class PopularityIndex:
+    """
+    Movie x star count table. Rows are aligned with 'movieids' (sorted) and columns with 'star_values' (sorted).
+    """
+
+    def __init__(self, movieids, star_values, counts):
+        """
+        :param movieids: sorted array of the IDs of the movies that were rated at least once
+        :param star_values: sorted array of the star values found in the ratings
+        :param counts: 2D array, counts[m, s] = how many times movie m was rated with star_values[s] stars
+        """
+        self.movieids = movieids
+        self.star_values = star_values
+        self.counts = counts
+        # cumulative[m, s] = how many times movie m was rated with star_values[s] stars or less:
+        self.cumulative = np.cumsum(counts, axis=1)
+
+    def amount_ratings(self):
+        """
+        Computes how many times every movie was rated.
+        :return: array of ints aligned with 'movieids'
+        """
+        return self.cumulative[:, -1]
+
+    def amount_ratings_under(self, stars):
+        """
+        Computes how many times every movie was rated with strictly less than 'stars' stars.
+        :param stars: number of stars
+        :return: array of ints aligned with 'movieids'
+        """
+        column = np.searchsorted(self.star_values, stars, side='left')  # amount of star values lower than 'stars'
+        if column == 0:
+            return np.zeros(len(self.movieids), dtype=self.counts.dtype)
+        return self.cumulative[:, column - 1]
+
+    def amount_ratings_over(self, stars):
+        """
+        Computes how many times every movie was rated with at least 'stars' stars.
+        :param stars: number of stars
+        :return: array of ints aligned with 'movieids'
+        """
+        return self.amount_ratings() - self.amount_ratings_under(stars)
+
+    def mean_ratings(self):
+        """
+        Computes the average rating (stars) of every movie.
+        :return: array of floats aligned with 'movieids'
+        """
+        totals = self.counts.dot(self.star_values.astype(np.float64))
+        return totals / self.amount_ratings()
+
+    def top_movies(self, values, N, min_ratings=1):
+        """
+        Retrieves the N movies with the biggest values, sorted from BIG to SMALL value.
+        In case of a tie, the movie with the higher ID is ranked before the movie with lower ID.
+        :param values: array of values aligned with 'movieids'
+        :param N: number of movies to retrieve
+        :param min_ratings: movies rated less times than this are not taken into account
+        :return: a list of tuples with movie ID and value
+        """
+        candidates = np.flatnonzero(self.amount_ratings() >= min_ratings)
+        positions = candidates[cooccurrence.top_positions(values[candidates], self.movieids[candidates], N)]
+        return [(int(self.movieids[i]), values[i]) for i in positions]
+
+    def to_dict(self):
+        """
+        Converts the index into a dictionary of plain arrays, so it can be dumped to a pickle.
+        :return: a dictionary
+        """
+        return {'movieids': self.movieids, 'star_values': self.star_values, 'counts': self.counts}
+
+
+def build_popularity_index(ratings):
+    """
+    Builds the popularity index from a collection of all ratings.
+    :param ratings: a collection of all ratings (list of dictionaries or dictionary of columns)
+    :return: a PopularityIndex object
+    """
+    movieids = data.ratings_column(ratings, 'movieid', np.int64)
+    stars = data.ratings_column(ratings, 'rating', np.float64)
+    unique_movieids, movie_index = np.unique(movieids, return_inverse=True)
+    star_values, star_index = np.unique(stars, return_inverse=True)
+    # Every (movie, star) pair is flattened to a single index, so the whole table is counted with one 'bincount':
+    counts = np.bincount(movie_index * len(star_values) + star_index,
+                         minlength=len(unique_movieids) * len(star_values)).astype(np.int32)
+    return PopularityIndex(unique_movieids, star_values, counts.reshape(len(unique_movieids), len(star_values)))
+
+
+def load_popularity_index(index):
+    """
+    Builds the popularity index back from the dictionary dumped to a pickle (see 'PopularityIndex.to_dict').
+    :param index: a dictionary with the arrays of the index
+    :return: a PopularityIndex object
+    """
+    return PopularityIndex(index['movieids'], index['star_values'], index['counts'])
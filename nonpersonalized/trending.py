@@ -0,0 +1,160 @@
+"""
+This file holds the trending subsystem: sliding-window (e.g. last day, week or month) rating counts for every movie.
+Ratings are counted in time buckets (one hour by default) stored in a ring buffer. Besides, a running total is kept for
+every window, so when time moves forward only the buckets leaving a window are subtracted from it. This way, the counts
+are updated incrementally as ratings are appended and a trending query never goes over all ratings again.
+NOTE: this file is duplicated in 'nonpersonalized' and 'personalizedrecommenders' and both copies MUST be kept
+identical. Every package is run as a standalone script with its own directory on the path, so one cannot import the
+other.
+"""
+
+import numpy as np
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+BUCKET_SECONDS = 3600  # width of every time bucket (in seconds)
+WINDOWS = {"day": 24 * 3600, "week": 7 * 24 * 3600, "month": 30 * 24 * 3600}  # length of every window (in seconds)
+
+
+class TrendingCounter:
+    """
+    Per-movie rating counts over sliding windows. The newest rating seen so far defines the current time, unless the
+    clock is moved forward explicitly with 'advance_to'. Windows cover whole buckets: the current bucket and as many
+    previous buckets as needed to cover the length of the window.
+    """
+
+    def __init__(self, windows=None, bucket_seconds=BUCKET_SECONDS):
+        """
+        :param windows: dictionary with "Key=name of the window" and "Value=length in seconds". WINDOWS by default.
+        :param bucket_seconds: width of every time bucket (in seconds)
+        """
+        if windows is None:
+            windows = WINDOWS
+        self.bucket_seconds = bucket_seconds
+        # Number of buckets covered by every window. The ring buffer is as long as the longest window:
+        self.window_buckets = {}
+        for name, length in windows.items():
+            self.window_buckets[name] = max(1, int(np.ceil(float(length) / bucket_seconds)))
+        self.num_buckets = max(self.window_buckets.values())
+        self.movieids = []  # movie IDs, in the order they were first seen (column of the movie)
+        self.columns = {}  # dictionary with "Key=movieID" and "Value=column of the movie"
+        self.ring = np.zeros((self.num_buckets, 0), dtype=np.int32)  # rating counts of every bucket and movie
+        self.totals = {}  # dictionary with "Key=name of the window" and "Value=rating counts of every movie"
+        for name in self.window_buckets:
+            self.totals[name] = np.zeros(0, dtype=np.int64)
+        self.current = None  # absolute index of the newest bucket (timestamp // bucket_seconds)
+
+    def __column(self, movieID):
+        """
+        Retrieves the column of the movie, adding it (and growing the arrays if needed) the first time it is seen.
+        :param movieID: int number of the movie
+        :return: int number
+        """
+        if movieID in self.columns:
+            return self.columns[movieID]
+        column = len(self.movieids)
+        if column == self.ring.shape[1]:
+            capacity = max(16, 2 * column)  # the arrays double their capacity, so growing is amortized
+            self.ring = np.hstack([self.ring, np.zeros((self.num_buckets, capacity - column), dtype=np.int32)])
+            for name in self.totals:
+                self.totals[name] = np.concatenate([self.totals[name], np.zeros(capacity - column, dtype=np.int64)])
+        self.movieids.append(movieID)
+        self.columns[movieID] = column
+        return column
+
+    def advance_to(self, timestamp):
+        """
+        Moves the clock forward to the bucket of the timestamp. Buckets leaving a window are subtracted from it and the
+        buckets leaving the longest window are cleared. Moving the clock backwards does nothing.
+        :param timestamp: int number, seconds since epoch
+        """
+        bucket = int(timestamp) // self.bucket_seconds
+        if self.current is None:
+            self.current = bucket
+            return
+        if bucket <= self.current:
+            return
+        if bucket - self.current >= self.num_buckets:
+            # Every bucket is too old now, so there is nothing to subtract, just clear everything:
+            self.ring[:] = 0
+            for name in self.totals:
+                self.totals[name][:] = 0
+        else:
+            for step in range(self.current + 1, bucket + 1):
+                for name, length in self.window_buckets.items():
+                    self.totals[name] -= self.ring[(step - length) % self.num_buckets]
+                self.ring[step % self.num_buckets] = 0
+        self.current = bucket
+
+    def add_rating(self, movieID, timestamp):
+        """
+        Counts one rating of the movie at the given time. Ratings older than the longest window are ignored.
+        :param movieID: int number of the movie
+        :param timestamp: int number, seconds since epoch
+        """
+        self.add_ratings([movieID], [timestamp])
+
+    def add_ratings(self, movieIDs, timestamps):
+        """
+        Counts a batch of ratings. The clock is first moved to the newest timestamp of the batch.
+        :param movieIDs: list of ints of the movies
+        :param timestamps: list of ints, seconds since epoch
+        """
+        if len(movieIDs) == 0:
+            return
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        columns = np.array([self.__column(int(movieID)) for movieID in movieIDs], dtype=np.int64)
+        self.advance_to(timestamps.max())
+        buckets = timestamps // self.bucket_seconds
+        age = self.current - buckets  # how many buckets ago every rating was done
+        for name, length in self.window_buckets.items():
+            in_window = age < length
+            self.totals[name] += np.bincount(columns[in_window], minlength=len(self.totals[name]))
+        stored = age < self.num_buckets
+        np.add.at(self.ring, (buckets[stored] % self.num_buckets, columns[stored]), 1)
+
+    def counts(self, window):
+        """
+        Retrieves the rating counts of every movie in the window.
+        :param window: name of the window (e.g. "day", "week", "month")
+        :return: a list of movie IDs AND an array with their rating counts
+        """
+        if window not in self.totals:
+            raise ValueError("[Error] Unknown window '%s'. Available windows: %s" % (window, sorted(self.totals.keys())))
+        return self.movieids, self.totals[window][:len(self.movieids)]
+
+    def top_movies(self, window, N=10):
+        """
+        Retrieves the N movies with the most ratings in the window, sorted from BIG to SMALL amount of ratings.
+        In case of a tie, the movie with the higher ID is ranked before the movie with lower ID.
+        Movies without ratings in the window are not taken into account.
+        :param window: name of the window (e.g. "day", "week", "month")
+        :param N: number of movies to retrieve
+        :return: a list of tuples with movie ID and amount of ratings
+        """
+        movieids, counts = self.counts(window)
+        movieids = np.array(movieids, dtype=np.int64)
+        candidates = np.flatnonzero(counts > 0)
+        if N < len(candidates):
+            # Partial selection: only the candidates tied with (or above) the N-th biggest count are sorted:
+            kth_count = np.partition(counts[candidates], len(candidates) - N)[len(candidates) - N]
+            candidates = candidates[counts[candidates] >= kth_count]
+        order = np.lexsort((movieids[candidates], counts[candidates]))[::-1][:N]
+        return [(int(movieids[i]), int(counts[i])) for i in candidates[order]]
+
+
+def build_trending_counter(ratings, windows=None, bucket_seconds=BUCKET_SECONDS):
+    """
+    Builds the trending counter from a collection of all ratings.
+    :param ratings: a collection of all ratings (list of dictionaries or dictionary of columns)
+    :param windows: dictionary with "Key=name of the window" and "Value=length in seconds". WINDOWS by default.
+    :param bucket_seconds: width of every time bucket (in seconds)
+    :return: a TrendingCounter object
+    """
+    counter = TrendingCounter(windows, bucket_seconds)
+    if isinstance(ratings, dict):
+        counter.add_ratings(ratings['movieid'], ratings['timestamp'])
+    else:
+        counter.add_ratings([int(rating['movieid']) for rating in ratings], [int(rating['timestamp']) for rating in ratings])
+    return counter
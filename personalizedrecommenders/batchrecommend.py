@@ -0,0 +1,233 @@
+"""
+This file holds the batch version of the UUCF and IICF top N recommenders: the top N lists of many users are computed
+at once, chunk by chunk of users, by sparse matrix products instead of one prediction at a time.
+    UUCF: for every user, the similarity profile (see 'usersimilarity.UserSimilarity.similarities') is computed once
+          and the ratings of all the users with a positive similarity are gathered at once, sorted by target item and
+          similarity, and cut to the users of the k (20) biggest distinct similarity values of every target item, like
+          'main.top_k_most_similar_neighbors':
+              prediction(a, i) = mean_a + sum over the top k u of sim(a, u) * (r_u,i - mean_u) / sum over the top k u of sim(a, u)
+    IICF: for every user, the columns of the similarity matrix (see 'itemmodel.SimilarityModel') of the items the
+          user rated are gathered at once (rows of the transposed matrix), sorted by target item and similarity, and
+          cut to the k (20) most similar rated items of every target item, like 'main.top_k_most_similar_items':
+              prediction(a, i) = sum over the top k j of sim(i, j) * r_a,j / sum over the top k j of |sim(i, j)|
+The sums are accumulated in the same order as 'main.rating_prediction_user' and 'main.rating_prediction_item', and the
+rules to break ties are kept, so the lists are the same as the ones of 'main.topN_recommendations_uucf' (with the
+exact similarity profiles, i.e. without the approximate user index) and 'main.topN_recommendations_iicf'.
+"""
+
+import numpy as np
+from scipy import sparse
+import itemmodel
+import topn
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+CHUNK_SIZE = 256  # number of users scored at once (bounds the memory of the dense chunk x item predictions)
+NEIGHBORS = 20  # number of neighbors (UUCF) or most similar rated items (IICF) of every prediction (like 'main.py')
+
+
+def rating_matrix(ratings_by_user_map, userIDs, itemids):
+    """
+    Builds the ratings of some users as a sparse matrix. Ratings of items that are not in 'itemids' are left out.
+    :param ratings_by_user_map: a dictionary with "Key=userID" and "Value=a Dictionary with 'Key=itemID' and 'Value=rating (stars)'"
+    :param userIDs: list of ints of the users (rows)
+    :param itemids: sorted array of item IDs (columns)
+    :return: the user x item matrix of stars (csr)
+    """
+    rows = []
+    items = []
+    stars = []
+    for row, userID in enumerate(userIDs):
+        ratings_user = ratings_by_user_map[userID]
+        rows.extend([row] * len(ratings_user))
+        items.extend(ratings_user.keys())
+        stars.extend(ratings_user.values())
+    items = np.asarray(items, dtype=np.int64)
+    columns = np.searchsorted(itemids, items)
+    known = columns < len(itemids)
+    known[known] = itemids[columns[known]] == items[known]
+    return sparse.csr_matrix((np.asarray(stars, dtype=np.float64)[known], (np.asarray(rows)[known], columns[known])),
+                             shape=(len(userIDs), len(itemids)))
+
+
+def uucf_predictions(engine, stars, userIDs, k=NEIGHBORS):
+    """
+    Calculates the UUCF rating predictions of a chunk of users for all the items of the similarity engine, with the
+    users of the k biggest distinct similarity values among the raters of every item (in case of a tie, the lowest ID
+    is kept), like 'main.top_k_most_similar_neighbors'. If no neighbor rated an item, the prediction is the mean rating
+    of the user (like 'main.rating_prediction_user').
+    :param engine: a UserSimilarity object (see 'usersimilarity.py')
+    :param stars: the ratings of all the users of the engine (see 'rating_matrix', rows aligned with 'engine.userids'
+    and columns with 'engine.itemids')
+    :param userIDs: list of ints of the users
+    :param k: number of neighbors of every prediction
+    :return: an array (user x item, aligned with 'engine.itemids') of predictions AND an array with the mean rating
+    of every user
+    """
+    rows = np.array([engine.index_of(userID) for userID in userIDs], dtype=np.int64)
+    if (rows == -1).any():
+        raise ValueError("[Error] User %s has no ratings! Cannot continue with the method!" % userIDs[np.flatnonzero(rows == -1)[0]])
+    means = engine.means[rows]
+    predictions = np.repeat(means[:, np.newaxis], len(engine.itemids), axis=1)
+    for position, userID in enumerate(userIDs):
+        # Users with a positive similarity (and not the user her/himself), see 'UserSimilarity.neighbor_candidates':
+        similarities = engine.similarities(userID)
+        neighbors = np.flatnonzero((similarities > 0.0) & (engine.userids != userID))
+        ratings = stars[neighbors]
+        amounts = np.diff(ratings.indptr)
+        users = np.repeat(neighbors, amounts)
+        targets = ratings.indices
+        values = similarities[users]
+        # For every target item, from BIG to SMALL similarity and, in case of a tie, the lowest ID first. Only the first
+        # user of every similarity value is kept:
+        order = np.lexsort((engine.userids[users], -values, targets))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (targets[order][1:] != targets[order][:-1]) | (values[order][1:] != values[order][:-1])
+        order = order[first]
+        targets = targets[order]
+        ranks = np.arange(len(targets)) - np.searchsorted(targets, targets, side='left')
+        numerators = np.zeros(len(engine.itemids))
+        denominators = np.zeros(len(engine.itemids))
+        # Rank by rank, so the sums of every item are accumulated in the order of 'main.rating_prediction_user':
+        for rank in range(min(k, len(targets))):
+            selected = ranks == rank
+            at = order[selected]
+            numerators[targets[selected]] += (ratings.data[at] - engine.means[users[at]]) * values[at]
+            denominators[targets[selected]] += values[at]
+        predicted = np.bincount(targets, minlength=len(engine.itemids)) > 0
+        predictions[position, predicted] += numerators[predicted] / denominators[predicted]
+    return predictions, means
+
+
+def transposed_similarities(model, similarity_type):
+    """
+    Prepares the similarity matrix of the IICF model for the batch predictions.
+    :param model: a SimilarityModel object (see 'itemmodel.py')
+    :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities
+    :return: the transposed similarity matrix (csr, item j x item i) with the similarities of the given type only
+    """
+    values = np.asarray(model.values, dtype=np.float64) * itemmodel.sign_mask(model.values, similarity_type)
+    # Copies of the arrays of the model, since 'eliminate_zeros' compacts them in place:
+    similarities = sparse.csr_matrix((values, model.indices, model.indptr), shape=(len(model.itemids),) * 2, copy=True)
+    similarities.eliminate_zeros()
+    return similarities.T.tocsr()
+
+
+def iicf_predictions(model, transposed, ratings_by_user_map, userIDs, k=NEIGHBORS):
+    """
+    Calculates the IICF rating predictions of a chunk of users for all the items of the model, with the k most similar
+    items rated by every user (in case of a tie, the higher ID first). If the user didn't rate any similar item, there
+    is no prediction (nan).
+    :param model: a SimilarityModel object (see 'itemmodel.py')
+    :param transposed: the transposed similarity matrix (see 'transposed_similarities')
+    :param ratings_by_user_map: a dictionary with "Key=userID" and "Value=a Dictionary with 'Key=itemID' and 'Value=rating (stars)'"
+    :param userIDs: list of ints of the users
+    :param k: number of most similar rated items of every prediction
+    :return: an array (user x item, aligned with 'model.itemids') of predictions
+    """
+    ratings = rating_matrix(ratings_by_user_map, userIDs, model.itemids)
+    predictions = np.full((len(userIDs), len(model.itemids)), np.nan)
+    for row in range(len(userIDs)):
+        rated = ratings.indices[ratings.indptr[row]:ratings.indptr[row + 1]]
+        if len(rated) == 0:
+            continue
+        # sim(i, j) of every item i with every item j rated by the user:
+        columns = transposed[rated]
+        amounts = np.diff(columns.indptr)
+        targets = columns.indices
+        values = columns.data
+        neighbors = np.repeat(rated, amounts)
+        stars = np.repeat(ratings.data[ratings.indptr[row]:ratings.indptr[row + 1]], amounts)
+        # For every target item, from BIG to SMALL similarity and, in case of a tie, the higher ID first:
+        order = np.lexsort((-model.itemids[neighbors], -values, targets))
+        targets = targets[order]
+        ranks = np.arange(len(targets)) - np.searchsorted(targets, targets, side='left')
+        numerators = np.zeros(len(model.itemids))
+        denominators = np.zeros(len(model.itemids))
+        # Rank by rank, so the sums of every item are accumulated in the order of 'main.rating_prediction_item':
+        for rank in range(min(k, len(targets))):
+            selected = ranks == rank
+            at = order[selected]
+            numerators[targets[selected]] += values[at] * stars[at]
+            denominators[targets[selected]] += np.abs(values[at])
+        predicted = np.bincount(targets, minlength=len(model.itemids)) > 0
+        predictions[row, predicted] = numerators[predicted] / denominators[predicted]
+    return predictions
+
+
+def select_top(predictions, itemids, N, distinct):
+    """
+    Selects the top N predictions of a user.
+    :param predictions: array of predictions (nan means no prediction)
+    :param itemids: array of item IDs aligned with the predictions
+    :param N: number of recommended items
+    :param distinct: if True, only one item per prediction value is kept (the lowest ID, like UUCF). Otherwise, in case
+    of a tie, the item with the higher ID is ranked first (like IICF).
+    :return: a list of tuples with the form ("item id", "prediction value")
+    """
+    valid = ~np.isnan(predictions)
+    predictions = predictions[valid]
+    itemids = itemids[valid]
+    if distinct:
+        selected = topn.top_distinct_positions(predictions, itemids, N)
+    else:
+        selected = topn.top_positions(predictions, itemids, N)
+    return [(int(itemid), float(prediction)) for itemid, prediction in zip(itemids[selected], predictions[selected])]
+
+
+def top_n_uucf(engine, ratings_by_user_map, userIDs, itemIDs, N=10, chunk_size=CHUNK_SIZE):
+    """
+    Top N lists of UUCF recommendations of many users, excluding the items already rated by every user.
+    :param engine: a UserSimilarity object (see 'usersimilarity.py')
+    :param ratings_by_user_map: a dictionary with "Key=userID" and "Value=a Dictionary with 'Key=itemID' and 'Value=rating (stars)'"
+    :param userIDs: list of ints of the users
+    :param itemIDs: list of ints of the items that can be recommended
+    :param N: number of recommended items
+    :param chunk_size: number of users scored at once
+    :return: a dictionary with "Key=userID" and "Value=a list of tuples with the form ('item id', 'prediction value')"
+    """
+    itemids = np.unique(np.asarray(itemIDs, dtype=np.int64))
+    columns = np.searchsorted(engine.itemids, itemids)
+    known = columns < len(engine.itemids)
+    known[known] = engine.itemids[columns[known]] == itemids[known]
+    stars = rating_matrix(ratings_by_user_map, engine.userids.tolist(), engine.itemids)
+    topN = {}
+    for start in range(0, len(userIDs), chunk_size):
+        chunk = list(userIDs[start:start + chunk_size])
+        engine_predictions, means = uucf_predictions(engine, stars, chunk)
+        # Items nobody rated get the mean rating of the user:
+        predictions = np.repeat(means[:, np.newaxis], len(itemids), axis=1)
+        predictions[:, known] = engine_predictions[:, columns[known]]
+        rated = rating_matrix(ratings_by_user_map, chunk, itemids)
+        for row, userID in enumerate(chunk):
+            predictions[row, rated.indices[rated.indptr[row]:rated.indptr[row + 1]]] = np.nan
+            topN[userID] = select_top(predictions[row], itemids, N, True)
+    return topN
+
+
+def top_n_iicf(model, ratings_by_user_map, userIDs, itemIDs, N=10, similarity_type="POSITIVE", chunk_size=CHUNK_SIZE):
+    """
+    Top N lists of IICF recommendations of many users, excluding the items already rated by every user.
+    :param model: a SimilarityModel object (see 'itemmodel.py')
+    :param ratings_by_user_map: a dictionary with "Key=userID" and "Value=a Dictionary with 'Key=itemID' and 'Value=rating (stars)'"
+    :param userIDs: list of ints of the users
+    :param itemIDs: list of ints of the items that can be recommended
+    :param N: number of recommended items
+    :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities
+    :param chunk_size: number of users scored at once
+    :return: a dictionary with "Key=userID" and "Value=a list of tuples with the form ('item id', 'prediction value')"
+    """
+    transposed = transposed_similarities(model, similarity_type)
+    # Only the items of the model can have a prediction:
+    candidates = np.in1d(model.itemids, np.asarray(list(itemIDs), dtype=np.int64))
+    topN = {}
+    for start in range(0, len(userIDs), chunk_size):
+        chunk = list(userIDs[start:start + chunk_size])
+        predictions = iicf_predictions(model, transposed, ratings_by_user_map, chunk)
+        predictions[:, ~candidates] = np.nan
+        rated = rating_matrix(ratings_by_user_map, chunk, model.itemids)
+        for row, userID in enumerate(chunk):
+            predictions[row, rated.indices[rated.indptr[row]:rated.indptr[row + 1]]] = np.nan
+            topN[userID] = select_top(predictions[row], model.itemids, N, False)
+    return topN
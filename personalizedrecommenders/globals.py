@@ -11,9 +11,13 @@ __email__ = "aitor.deblas@ugent.be"
 LOG_STATUS = False  # bool to indicate whether we want verbose output or not
 RATINGS_BY_USER = None  # dictionary with "Key=userID" and "Value=list of ratings by user". A dictionary that hols the ratings by all users
 RATINGS_BY_USER_MAP = None  # dictionary with "Key=userID" and "Value=a Dictionary with 'Key=itemID' and 'Value=rating (stars)'"
+USER_STATISTICS = None  # user statistics store (see 'userstats.py'): amount of ratings, mean rating and centered norm of every user
+USER_SIMILARITY = None  # user-user similarity engine (see 'usersimilarity.py'): Pearson correlations of a user against all users at once
+USER_INDEX = None  # optional approximate nearest neighbor index of the users (see 'userindex.py'): only its candidates are scored by UUCF
+ITEM_RATERS = None  # item -> raters inverted index (see 'itemindex.py'): users who rated every item, their ratings and the mean rating of every item
 RATINGS_X_BY_USERS = None  # dictionary with "Key=itemID" and "Value=list of ratings for that item by all users who rated it"
 MEAN_RATINGS_ITEM = None  # dictionary with "Key=itemID" and "Value=average of the ratings of all users who rated this item"
-IICF_MODEL = None  # this is the model built corresponding to IICF. It's a dictionary with "Key={-1,1}" depending on positive or negative values. "Value=a dictionary with 'Key=itemID' and 'Value=a dictionary with 'Key=itemID' and 'Value=similarity value''"
+IICF_MODEL = None  # this is the model built corresponding to IICF. Either a compact model (see 'itemmodel.SimilarityModel') or a dictionary with "Key={-1,1}" depending on positive or negative values. "Value=a dictionary with 'Key=itemID' and 'Value=a dictionary with 'Key=itemID' and 'Value=similarity value''"
 #                    ____________________IICF_MODEL____________________
 #                   |                                                  |
 #             -1 (negatives)                                     1 (positives)
@@ -29,6 +33,9 @@ IICF_MODEL = None  # this is the model built corresponding to IICF. It's a dicti
 #    item#1   item#2 ...  item#N                        item#1   item#2 ...  item#N
 #               |                                                  |
 #        similarity value                                   similarity value
+MOVIE_IDS = None  # tuple with the dictionary of movies and the sorted array of its movie IDs (see 'main.movie_ids')
+IICF_UPDATES = None  # incremental IICF model (see 'itemupdates.py'): dot products and norms of the items, updated with new ratings
+HYBRID_POOL = None  # workers of the hybrid recommender (see 'main.hybrid_pool'): a tuple with the concurrency, the data the workers were created with and the pool
 
 class SimilarityType:
     def __init__(self):
@@ -57,3 +64,4 @@ class SimilarityType:
 
 
 SIMILARITY_TYPE = None  # this class object defines the similarity type desired. It can either be positive, negative or both.
+TRENDING = None  # trending counter (see 'trending.py'): rating counts of every item over sliding time windows. New ratings are counted incrementally with 'add_rating'
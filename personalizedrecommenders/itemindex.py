@@ -0,0 +1,142 @@
+"""
+This file holds the inverted index of the ratings by item: for every item, the users who rated it and their ratings.
+It is stored CSR-style: the raters of the item in row 'i' are 'userids[indptr[i]:indptr[i+1]]' and their ratings are
+'stars[indptr[i]:indptr[i+1]]'. It is built in a single pass over the ratings (plus a stable sort by item), and the
+mean rating of every item comes out of the same pass, instead of going over all ratings once per item.
+New ratings are added to the index as they arrive (see 'ItemRaters.add_ratings'), without building it again.
+"""
+
+import numpy as np
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+
+class ItemRaters:
+    """
+    Item -> (raters, ratings) inverted index. Rows are aligned with 'itemids' (sorted). Within a row, the raters keep
+    the order in which their ratings were given.
+    """
+
+    def __init__(self, userids, itemids, stars):
+        """
+        Builds the index out of three parallel arrays.
+        :param userids: array of ints, the user ID of every rating
+        :param itemids: array of ints, the item ID of every rating
+        :param stars: array of floats, the rating (stars) of every rating
+        """
+        self.itemids, item_index = np.unique(itemids, return_inverse=True)
+        order = np.argsort(item_index, kind='mergesort')  # stable: the ratings keep their order within an item
+        self.userids = np.asarray(userids, dtype=np.int64)[order]
+        self.stars = np.asarray(stars, dtype=np.float64)[order]
+        self.amounts = np.bincount(item_index, minlength=len(self.itemids))
+        self.indptr = np.concatenate([[0], np.cumsum(self.amounts)])
+        self.means = np.bincount(item_index, weights=stars, minlength=len(self.itemids)) / np.maximum(self.amounts, 1)
+
+    def add_ratings(self, userIDs, itemIDs, stars):
+        """
+        Adds a batch of ratings to the index. A rating of an item the user already rated replaces the old one (in its
+        place), the other ones go after the raters the item already had. Only the means of the rated items are
+        computed again.
+        :param userIDs: list of ints, the user of every rating
+        :param itemIDs: list of ints, the item of every rating
+        :param stars: list of floats, the rating (stars) of every rating
+        :return: sorted array with the IDs of the items whose raters changed
+        """
+        if len(userIDs) == 0:
+            return np.zeros(0, dtype=np.int64)
+        itemIDs = np.asarray(itemIDs, dtype=np.int64)
+        # New items get an empty row in their sorted place:
+        itemids = np.union1d(self.itemids, itemIDs)
+        if len(itemids) > len(self.itemids):
+            old_rows = np.searchsorted(itemids, self.itemids)
+            amounts = np.zeros(len(itemids), dtype=self.amounts.dtype)
+            amounts[old_rows] = self.amounts
+            means = np.zeros(len(itemids))
+            means[old_rows] = self.means
+            self.itemids = itemids
+            self.amounts = amounts
+            self.means = means
+            self.indptr = np.concatenate([[0], np.cumsum(self.amounts)])
+        rows = np.searchsorted(self.itemids, itemIDs)
+        new_rows = []
+        new_userids = []
+        new_stars = []
+        new_raters = {}  # dictionary with "Key=(row, userID)" and "Value=position in the new lists", new raters only
+        for row, userid, star in zip(rows.tolist(), userIDs, stars):
+            if (row, userid) in new_raters:
+                new_stars[new_raters[(row, userid)]] = star
+                continue
+            positions = np.flatnonzero(self.userids[self.indptr[row]:self.indptr[row + 1]] == userid)
+            if len(positions) > 0:
+                self.stars[self.indptr[row] + positions[0]] = star
+                continue
+            new_raters[(row, userid)] = len(new_rows)
+            new_rows.append(row)
+            new_userids.append(userid)
+            new_stars.append(star)
+        if len(new_rows) > 0:
+            # Stable sort by item: the new raters go after the old ones of the same item
+            entry_rows = np.repeat(np.arange(len(self.itemids)), self.amounts)
+            order = np.argsort(np.concatenate([entry_rows, new_rows]), kind='mergesort')
+            self.userids = np.concatenate([self.userids, np.asarray(new_userids, dtype=np.int64)])[order]
+            self.stars = np.concatenate([self.stars, np.asarray(new_stars, dtype=np.float64)])[order]
+            self.amounts += np.bincount(new_rows, minlength=len(self.itemids))
+            self.indptr = np.concatenate([[0], np.cumsum(self.amounts)])
+        touched = np.unique(rows)
+        self.means[touched] = [self.stars[self.indptr[row]:self.indptr[row + 1]].mean() for row in touched]
+        return self.itemids[touched]
+
+    def row_of(self, itemID):
+        """
+        Retrieves the row of an item.
+        :param itemID: int number of the item
+        :return: int number, -1 if nobody rated the item
+        """
+        row = np.searchsorted(self.itemids, itemID)
+        if row < len(self.itemids) and self.itemids[row] == itemID:
+            return int(row)
+        return -1
+
+    def raters_of(self, itemID):
+        """
+        Retrieves the users who rated the item and their ratings.
+        :param itemID: int number of the item
+        :return: an array with the user IDs AND an array with their ratings (stars)
+        """
+        row = self.row_of(itemID)
+        if row == -1:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        return self.userids[self.indptr[row]:self.indptr[row + 1]], self.stars[self.indptr[row]:self.indptr[row + 1]]
+
+    def mean(self, itemID):
+        """
+        :param itemID: int number of the item
+        :return: float number, average of the ratings of all users who rated this item (nan if nobody rated it)
+        """
+        row = self.row_of(itemID)
+        if row == -1:
+            return np.nan
+        return float(self.means[row])
+
+    def mean_ratings(self, itemIDs=None):
+        """
+        Collects the mean rating of the items, like 'utils.extract_mean_ratings'. Items that nobody rated get nan.
+        :param itemIDs: list of ints of the items. If None, all rated items.
+        :return: a dictionary with "Key=itemID" and "Value=average of the ratings of all users who rated this item"
+        """
+        if itemIDs is None:
+            itemIDs = self.itemids
+        return dict((int(itemid), self.mean(itemid)) for itemid in itemIDs)
+
+
+def build_item_raters(ratings):
+    """
+    Builds the item -> raters inverted index from a collection of all ratings.
+    :param ratings: a list of ALL ratings
+    :return: an ItemRaters object
+    """
+    userids = np.fromiter((rating['userid'] for rating in ratings), dtype=np.int64, count=len(ratings))
+    itemids = np.fromiter((rating['movieid'] for rating in ratings), dtype=np.int64, count=len(ratings))
+    stars = np.fromiter((rating['rating'] for rating in ratings), dtype=np.float64, count=len(ratings))
+    return ItemRaters(userids, itemids, stars)
@@ -0,0 +1,650 @@
+"""
+This file holds the builder of the IICF (Item-Item Collaborative Filtering) model: the similarities between all items.
+Every item is represented by the ratings of its raters, centered by the mean rating of the item. The similarity of two
+items is the cosine of both vectors (like 'main.compute_cosine_similarity'):
+    sim(i, j) = sum over the users who rated both items of (r_u,i - mean_i) * (r_u,j - mean_j) / (norm_i * norm_j)
+    norm_i    = sqrt(sum over ALL the users who rated item i of (r_u,i - mean_i)^2)
+Instead of looping over all pairs of items and, for every pair, over all users, the mean-centered item x user matrix is
+multiplied by its transpose in blocks of rows (sparse matrix products). Since sim(i, j) = sim(j, i), a block of rows is
+only multiplied by the items from the block onwards (upper triangle) and the result is mirrored afterwards. The memory
+needed by a block is bounded by the block size.
+The model can either be stored in the nested dictionaries of 'globals.IICF_MODEL' or in a compact CSR format (see
+'SimilarityModel'), which takes about 12 bytes per similarity instead of 100+ (also on disk, see 'SimilarityModel.save')
+and can be memory-mapped from disk.
+Since predictions only use a few neighbors, the model can also be pruned while it's built: only the k most similar
+positive and the k most similar negative neighbors of every item are kept (see 'build_pruned_similarity_matrix').
+The blocks are independent, so they can be computed by a pool of worker processes (see 'build_blocks'). Every finished
+block can be written to a checkpoint directory, so a build that crashed resumes from the blocks already computed.
+"""
+
+import os
+import multiprocessing
+import numpy as np
+from scipy import sparse
+import topn
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+BLOCK_SIZE = 512  # number of item rows multiplied at once
+ARRAYS = ['itemids', 'indptr', 'indices', 'values']  # arrays of a compact model, saved as '<name>.npy' files
+WORKER_STATE = {}  # the matrix, norms, k and checkpoint directory of the blocks computed by the current process
+
+
+def centered_item_matrix(item_raters, itemIDs=None):
+    """
+    Builds the mean-centered item x user matrix out of the item -> raters index.
+    :param item_raters: an ItemRaters object (see 'itemindex.py')
+    :param itemIDs: list of ints of the items of the model. If None, all rated items.
+    :return: sorted array of item IDs (rows), the mean-centered item x user matrix (csr) AND the norm of every row
+    """
+    rows = np.repeat(np.arange(len(item_raters.itemids)), item_raters.amounts)
+    centered = item_raters.stars - item_raters.means[rows]
+    userids, user_index = np.unique(item_raters.userids, return_inverse=True)
+    matrix = sparse.csr_matrix((centered, (rows, user_index)), shape=(len(item_raters.itemids), len(userids)))
+    norms = np.sqrt(np.bincount(rows, weights=centered ** 2, minlength=len(item_raters.itemids)))
+    if itemIDs is None:
+        return item_raters.itemids, matrix, norms
+    keep = np.in1d(item_raters.itemids, np.asarray(list(itemIDs), dtype=np.int64))
+    return item_raters.itemids[keep], matrix[keep], norms[keep]
+
+
+def similarity_block(matrix, norms, start, end):
+    """
+    Computes the similarities of the rows [start, end) with the rows from 'start' onwards. Only the pairs (i, j) with
+    i < j and a non-zero similarity are returned. Pairs with a zero denominator get a zero similarity.
+    :param matrix: the mean-centered item x user matrix (csr)
+    :param norms: the norm of every row
+    :param start: first row of the block
+    :param end: last row of the block (excluded)
+    :return: an array of rows, an array of columns AND an array of similarity values
+    """
+    products = matrix[start:end].dot(matrix[start:].T).tocoo()
+    rows = products.row.astype(np.int64) + start
+    columns = products.col.astype(np.int64) + start
+    denominators = norms[rows] * norms[columns]
+    keep = (columns > rows) & (denominators != 0.0) & (products.data != 0.0)
+    return rows[keep], columns[keep], products.data[keep] / denominators[keep]
+
+
+def build_similarity_matrix(item_raters, itemIDs=None, block_size=BLOCK_SIZE, processes=1, checkpoint_directory=None):
+    """
+    Computes the (symmetric) item x item similarity matrix, block by block.
+    :param item_raters: an ItemRaters object (see 'itemindex.py')
+    :param itemIDs: list of ints of the items of the model. If None, all rated items.
+    :param block_size: number of item rows multiplied at once (bounds the memory needed by every block)
+    :param processes: number of worker processes (see 'build_blocks')
+    :param checkpoint_directory: directory of the checkpoints of the blocks (see 'build_blocks'). None means no checkpoints.
+    :return: sorted array of item IDs AND the similarity matrix (csr, aligned with the item IDs, no diagonal)
+    """
+    itemids, matrix, norms = centered_item_matrix(item_raters, itemIDs)
+    blocks = build_blocks(matrix, norms, block_size, None, processes, checkpoint_directory)
+    return itemids, mirror_blocks(blocks, len(itemids))
+
+
+def mirror_blocks(blocks, size):
+    """
+    Assembles the upper triangle blocks (see 'similarity_block') into the whole symmetric similarity matrix.
+    :param blocks: list of tuples (rows, columns, values)
+    :param size: number of items
+    :return: the similarity matrix (csr)
+    """
+    if len(blocks) == 0:
+        return sparse.csr_matrix((size, size))
+    rows = np.concatenate([block[0] for block in blocks])
+    columns = np.concatenate([block[1] for block in blocks])
+    values = np.concatenate([block[2] for block in blocks])
+    similarities = sparse.csr_matrix((np.concatenate([values, values]),
+                                      (np.concatenate([rows, columns]), np.concatenate([columns, rows]))),
+                                     shape=(size, size))
+    similarities.sort_indices()
+    return similarities
+
+
+def pruned_similarity_block(matrix, norms, start, end, k):
+    """
+    Computes the similarities of the rows [start, end) with ALL rows, and keeps just the k biggest positive and the k
+    smallest negative similarities of every row.
+    :param matrix: the mean-centered item x user matrix (csr)
+    :param norms: the norm of every row
+    :param start: first row of the block
+    :param end: last row of the block (excluded)
+    :param k: number of positive (and negative) neighbors kept per item
+    :return: an array of rows, an array of columns AND an array of similarity values
+    """
+    products = matrix[start:end].dot(matrix.T).tocsr()
+    rows = []
+    columns = []
+    values = []
+    for offset in range(end - start):
+        row = start + offset
+        columns_row = products.indices[products.indptr[offset]:products.indptr[offset + 1]]
+        numerators = products.data[products.indptr[offset]:products.indptr[offset + 1]]
+        denominators = norms[row] * norms[columns_row]
+        keep = (columns_row != row) & (denominators != 0.0) & (numerators != 0.0)
+        columns_row = columns_row[keep]
+        values_row = numerators[keep] / denominators[keep]
+        for sign in [1, -1]:
+            mask = sign * values_row > 0.0
+            selected = topn.top_positions(sign * values_row[mask], columns_row[mask], k)
+            rows.append(np.repeat(row, len(selected)))
+            columns.append(columns_row[mask][selected])
+            values.append(values_row[mask][selected])
+    return np.concatenate(rows), np.concatenate(columns), np.concatenate(values)
+
+
+def build_pruned_similarity_matrix(item_raters, itemIDs=None, k=50, block_size=BLOCK_SIZE, processes=1,
+                                   checkpoint_directory=None):
+    """
+    Computes the item x item similarity matrix keeping only the k most similar positive and the k most similar negative
+    neighbors of every item. Every block is pruned right after it's computed, so the memory needed is bounded by the
+    block size and by k (instead of by the amount of non-zero similarities). The matrix is not symmetric anymore.
+    :param item_raters: an ItemRaters object (see 'itemindex.py')
+    :param itemIDs: list of ints of the items of the model. If None, all rated items.
+    :param k: number of positive (and negative) neighbors kept per item
+    :param block_size: number of item rows multiplied at once
+    :param processes: number of worker processes (see 'build_blocks')
+    :param checkpoint_directory: directory of the checkpoints of the blocks (see 'build_blocks'). None means no checkpoints.
+    :return: sorted array of item IDs AND the similarity matrix (csr, aligned with the item IDs, no diagonal)
+    """
+    itemids, matrix, norms = centered_item_matrix(item_raters, itemIDs)
+    blocks = build_blocks(matrix, norms, block_size, k, processes, checkpoint_directory)
+    if len(blocks) == 0:
+        return itemids, sparse.csr_matrix((len(itemids), len(itemids)))
+    similarities = sparse.csr_matrix((np.concatenate([block[2] for block in blocks]),
+                                      (np.concatenate([block[0] for block in blocks]),
+                                       np.concatenate([block[1] for block in blocks]))),
+                                     shape=(len(itemids), len(itemids)))
+    similarities.sort_indices()
+    return itemids, similarities
+
+
+def init_worker(matrix, norms, k, checkpoint_directory):
+    """
+    Stores what every block needs in the current (worker) process, so it's not sent along with every block.
+    :param matrix: the mean-centered item x user matrix (csr)
+    :param norms: the norm of every row
+    :param k: if not None, only the k most similar positive (and negative) neighbors of every item are kept
+    :param checkpoint_directory: directory of the checkpoints of the blocks. None means no checkpoints.
+    :return: nothing
+    """
+    WORKER_STATE['matrix'] = matrix
+    WORKER_STATE['norms'] = norms
+    WORKER_STATE['k'] = k
+    WORKER_STATE['checkpoint_directory'] = checkpoint_directory
+
+
+def compute_block(block):
+    """
+    Computes a block of rows (see 'init_worker'). If there is a checkpoint directory, the block is written to it and
+    not returned, so big blocks don't go through the pipe of the pool.
+    :param block: tuple (start, end) of rows
+    :return: a tuple (start, end, (rows, columns, values)), the last element is None if the block was checkpointed
+    """
+    start, end = block
+    if WORKER_STATE['k'] is None:
+        result = similarity_block(WORKER_STATE['matrix'], WORKER_STATE['norms'], start, end)
+    else:
+        result = pruned_similarity_block(WORKER_STATE['matrix'], WORKER_STATE['norms'], start, end, WORKER_STATE['k'])
+    if WORKER_STATE['checkpoint_directory'] is None:
+        return start, end, result
+    save_block(WORKER_STATE['checkpoint_directory'], start, end, result)
+    return start, end, None
+
+
+def block_path(directory, start, end):
+    """
+    :param directory: checkpoint directory
+    :param start: first row of the block
+    :param end: last row of the block (excluded)
+    :return: the path of the checkpoint of the block
+    """
+    return os.path.join(directory, "block-%08d-%08d.npz" % (start, end))
+
+
+def save_block(directory, start, end, result):
+    """
+    Writes a block to the checkpoint directory. It's written to a temporary file first and then renamed, so a crash in
+    the middle of the writing never leaves a truncated checkpoint behind.
+    :param directory: checkpoint directory
+    :param start: first row of the block
+    :param end: last row of the block (excluded)
+    :param result: tuple (rows, columns, values)
+    :return: nothing
+    """
+    path = block_path(directory, start, end)
+    with open(path + ".tmp", 'wb') as checkpoint:
+        np.savez(checkpoint, rows=result[0], columns=result[1], values=result[2])
+    os.rename(path + ".tmp", path)
+
+
+def load_block(directory, start, end):
+    """
+    :param directory: checkpoint directory
+    :param start: first row of the block
+    :param end: last row of the block (excluded)
+    :return: a tuple (rows, columns, values)
+    """
+    with np.load(block_path(directory, start, end)) as checkpoint:
+        return checkpoint['rows'], checkpoint['columns'], checkpoint['values']
+
+
+def check_manifest(directory, matrix, norms, block_size, k):
+    """
+    Makes sure that the checkpoints of the directory belong to the same build: same items, same ratings (amount and
+    norms), same block size and same k. The manifest is written if the directory has none yet.
+    :param directory: checkpoint directory
+    :param matrix: the mean-centered item x user matrix (csr)
+    :param norms: the norm of every row
+    :param block_size: number of item rows multiplied at once
+    :param k: number of neighbors kept per item, None if the model is not pruned
+    :return: nothing
+    """
+    manifest = np.array([matrix.shape[0], matrix.shape[1], matrix.nnz, block_size, -1 if k is None else k, norms.sum()])
+    path = os.path.join(directory, "manifest.npy")
+    if not os.path.exists(path):
+        np.save(path, manifest)
+    elif not np.array_equal(np.load(path), manifest):
+        raise ValueError("[Error] The checkpoints in '%s' belong to another build. Remove them first. "
+                         "Cannot continue with the method!" % directory)
+
+
+def remove_checkpoints(directory, blocks):
+    """
+    Removes the checkpoints of a finished build (and the directory, if it ends up empty).
+    :param directory: checkpoint directory
+    :param blocks: list of tuples (start, end)
+    :return: nothing
+    """
+    for start, end in blocks:
+        os.remove(block_path(directory, start, end))
+    os.remove(os.path.join(directory, "manifest.npy"))
+    if len(os.listdir(directory)) == 0:
+        os.rmdir(directory)
+
+
+def build_blocks(matrix, norms, block_size=BLOCK_SIZE, k=None, processes=1, checkpoint_directory=None):
+    """
+    Computes all the blocks of rows of the similarity matrix (see 'similarity_block' and 'pruned_similarity_block').
+    With more than one process, the blocks are handed out to a pool of worker processes one at a time, so the blocks
+    of the upper triangle (the first ones are bigger) balance themselves out among the workers. On Linux, the workers
+    are forked, so they share the matrix with the parent instead of receiving a copy of it.
+    With a checkpoint directory, every finished block is written to it, the blocks already there are not computed
+    again (resuming a build that crashed) and all checkpoints are removed once the whole matrix is assembled.
+    :param matrix: the mean-centered item x user matrix (csr)
+    :param norms: the norm of every row
+    :param block_size: number of item rows multiplied at once
+    :param k: if not None, only the k most similar positive (and negative) neighbors of every item are kept
+    :param processes: number of worker processes. If None, one per CPU.
+    :param checkpoint_directory: directory of the checkpoints of the blocks. None means no checkpoints.
+    :return: list of tuples (rows, columns, values), sorted by block
+    """
+    blocks = [(start, min(start + block_size, matrix.shape[0])) for start in range(0, matrix.shape[0], block_size)]
+    pending = blocks
+    if checkpoint_directory is not None:
+        if not os.path.isdir(checkpoint_directory):
+            os.makedirs(checkpoint_directory)
+        check_manifest(checkpoint_directory, matrix, norms, block_size, k)
+        pending = [block for block in blocks if not os.path.exists(block_path(checkpoint_directory, *block))]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    results = {}
+    if processes > 1 and len(pending) > 1:
+        pool = multiprocessing.Pool(min(processes, len(pending)), init_worker, (matrix, norms, k, checkpoint_directory))
+        try:
+            for start, end, result in pool.imap_unordered(compute_block, pending):
+                results[start] = result
+        finally:
+            pool.terminate()
+    else:
+        init_worker(matrix, norms, k, checkpoint_directory)
+        try:
+            for block in pending:
+                start, end, result = compute_block(block)
+                results[start] = result
+        finally:
+            WORKER_STATE.clear()
+    if checkpoint_directory is None:
+        return [results[start] for start, end in blocks]
+    computed = [load_block(checkpoint_directory, start, end) for start, end in blocks]
+    remove_checkpoints(checkpoint_directory, blocks)
+    return computed
+
+
+def to_nested_model(itemids, similarities):
+    """
+    Converts the similarity matrix into the nested dictionaries of 'globals.IICF_MODEL': "Key={-1,1}" depending on
+    negative or positive values and "Value=a dictionary with 'Key=itemID' and 'Value=a dictionary with 'Key=itemID' and
+    'Value=similarity value''". Items without any positive (negative) similarity are not in the positive (negative)
+    branch.
+    :param itemids: sorted array of item IDs aligned with the similarity matrix
+    :param similarities: the similarity matrix (csr)
+    :return: a dictionary
+    """
+    model = {1: {}, -1: {}}
+    for row, itemid in enumerate(itemids.tolist()):
+        start, end = similarities.indptr[row], similarities.indptr[row + 1]
+        neighbors = itemids[similarities.indices[start:end]]
+        values = similarities.data[start:end]
+        for sign, mask in [(1, values > 0.0), (-1, values < 0.0)]:
+            if mask.any():
+                model[sign][itemid] = dict(zip(neighbors[mask].tolist(), values[mask].tolist()))
+    return model
+
+
+def build_model(item_raters, itemIDs=None, block_size=BLOCK_SIZE, k=None, processes=1, checkpoint_directory=None):
+    """
+    Builds the IICF model with the same structure (and values) as 'main.build_model_iicf_pairwise'.
+    :param item_raters: an ItemRaters object (see 'itemindex.py')
+    :param itemIDs: list of ints of the items of the model. If None, all rated items.
+    :param block_size: number of item rows multiplied at once
+    :param k: if not None, only the k most similar positive (and negative) neighbors of every item are kept
+    :param processes: number of worker processes (see 'build_blocks')
+    :param checkpoint_directory: directory of the checkpoints of the blocks (see 'build_blocks'). None means no checkpoints.
+    :return: a dictionary (see 'globals.IICF_MODEL')
+    """
+    if k is None:
+        itemids, similarities = build_similarity_matrix(item_raters, itemIDs, block_size, processes,
+                                                        checkpoint_directory)
+    else:
+        itemids, similarities = build_pruned_similarity_matrix(item_raters, itemIDs, k, block_size, processes,
+                                                               checkpoint_directory)
+    return to_nested_model(itemids, similarities)
+
+
+def sign_mask(values, similarity_type):
+    """
+    Selects the similarities of the given type.
+    :param values: array of similarity values
+    :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" (see 'globals.SimilarityType')
+    :return: an array of bools
+    """
+    if similarity_type == "POSITIVE":
+        return values > 0.0
+    if similarity_type == "NEGATIVE":
+        return values < 0.0
+    if similarity_type == "BOTH":
+        return values != 0.0
+    raise ValueError("[Error] Unknown similarity type '%s'. Cannot continue with the method!" % similarity_type)
+
+
+class SimilarityModel:
+    """
+    Compact IICF model. The similar items of every item are stored CSR-style: the neighbors of the item in row 'r' are
+    'itemids[indices[indptr[r]:indptr[r+1]]]' (sorted by item ID) and their similarities are
+    'values[indptr[r]:indptr[r+1]]' (float64 by default, so the rankings are the same as with the nested dictionaries).
+    Positive and negative similarities are stored together and split by masks at query time.
+    """
+
+    def __init__(self, itemids, indptr, indices, values):
+        """
+        :param itemids: sorted array of the item IDs of the model
+        :param indptr: array of ints, start of the neighbors of every item (plus the end of the last one)
+        :param indices: array of ints, rows of the neighbors
+        :param values: array of floats, similarity with every neighbor
+        """
+        self.itemids = itemids
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.transposed_model = None  # built the first time it's needed (see 'transposed')
+
+    def row_of(self, itemID):
+        """
+        Retrieves the row of an item.
+        :param itemID: int number of the item
+        :return: int number, -1 if the item is not in the model
+        """
+        row = np.searchsorted(self.itemids, itemID)
+        if row < len(self.itemids) and self.itemids[row] == itemID:
+            return int(row)
+        return -1
+
+    def neighbors(self, itemID, similarity_type="BOTH"):
+        """
+        Retrieves the items similar to the item.
+        :param itemID: int number of the item
+        :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities
+        :return: an array with the item IDs (sorted) AND an array with their similarity values
+        """
+        row = self.row_of(itemID)
+        if row == -1:
+            return np.zeros(0, dtype=self.itemids.dtype), np.zeros(0, dtype=self.values.dtype)
+        values = self.values[self.indptr[row]:self.indptr[row + 1]]
+        mask = sign_mask(values, similarity_type)
+        return self.itemids[self.indices[self.indptr[row]:self.indptr[row + 1]][mask]], values[mask]
+
+    def similarity(self, itemID_i, itemID_j, similarity_type="BOTH"):
+        """
+        Retrieves the similarity between item i and item j.
+        :param itemID_i: int number of item i
+        :param itemID_j: int number of item j
+        :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities
+        :return: float number, 0.0 if the similarity is not in the model (or is not of the given type)
+        """
+        row = self.row_of(itemID_i)
+        column = self.row_of(itemID_j)
+        if row == -1 or column == -1:
+            return 0.0
+        indices = self.indices[self.indptr[row]:self.indptr[row + 1]]
+        position = np.searchsorted(indices, column)
+        if position == len(indices) or indices[position] != column:
+            return 0.0
+        value = self.values[self.indptr[row] + position]
+        if not sign_mask(value, similarity_type):
+            return 0.0
+        return float(value)
+
+    def transposed(self):
+        """
+        Retrieves the transposed model: the row of item j holds the similarities sim(i, j) of all items i with j, that
+        is, the column of item j. A full model is symmetric, but a pruned one (see 'build_pruned_similarity_matrix')
+        isn't, since item j may be among the k most similar items of item i but not the other way around.
+        The transposed model is built the first time and kept in memory (as much memory as the model itself, also if
+        the model is memory-mapped).
+        :return: a SimilarityModel object
+        """
+        if self.transposed_model is None:
+            similarities = sparse.csr_matrix((self.values, self.indices, self.indptr), shape=(len(self.itemids),) * 2)
+            transposed = similarities.T.tocsr()
+            transposed.sort_indices()
+            self.transposed_model = to_compact_model(self.itemids, transposed, self.values.dtype)
+        return self.transposed_model
+
+    def basket_scores(self, itemIDs, weights=None, similarity_type="BOTH"):
+        """
+        Scores all items of the model against a basket of items: the (weighted) sum of the columns of the basket items,
+        keeping only the similarities of the given type. The score of item i is the sum over the basket items j of
+        weight_j * sim(i, j), like in 'main.topN_recommendations_basket' with the nested model. The columns are the
+        rows of the transposed model (see 'transposed'), so pruned models give the same scores as well. Basket items
+        that are not in the model are ignored.
+        :param itemIDs: list of ints of the items in the basket
+        :param weights: list of floats, the weight of every basket item. If None, all weigh 1.
+        :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities
+        :return: an array of floats aligned with 'itemids'
+        """
+        itemIDs = np.asarray(itemIDs, dtype=np.int64)
+        weights = np.ones(len(itemIDs)) if weights is None else np.asarray(weights, dtype=np.float64)
+        rows = np.searchsorted(self.itemids, itemIDs)
+        found = rows < len(self.itemids)
+        found[found] = self.itemids[rows[found]] == itemIDs[found]
+        rows = rows[found]
+        columns = self.transposed()
+        starts = columns.indptr[rows]
+        lengths = columns.indptr[rows + 1] - starts
+        # Positions of all the similarities of the basket columns, one column after the other:
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+        values = columns.values[positions].astype(np.float64)
+        values = values * sign_mask(values, similarity_type) * np.repeat(weights[found], lengths)
+        return np.bincount(columns.indices[positions], weights=values, minlength=len(self.itemids))
+
+    def amount_items(self, similarity_type="BOTH"):
+        """
+        Computes how many items have at least one similar item of the given type.
+        :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities
+        :return: int number
+        """
+        rows = np.repeat(np.arange(len(self.itemids)), np.diff(self.indptr))
+        return len(np.unique(rows[sign_mask(self.values, similarity_type)]))
+
+    def save(self, directory, dtype=None):
+        """
+        Saves the arrays of the model as plain binary files ('<name>.npy') into a directory. By default the values keep
+        their type, so a loaded model gives the very same output as the saved one.
+        Watch out! With float32 values (4 bytes less per similarity), similarities that only differ beyond float32
+        precision become ties, which are broken by the higher item ID. Hence a model loaded from float32 files may rank
+        some neighbors (and so some recommendations) differently than the model that was saved.
+        :param directory: path to the directory (created if it doesn't exist)
+        :param dtype: type of the similarity values on disk (e.g. np.float32). None means the type of the model.
+        :return: nothing
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in ARRAYS:
+            array = getattr(self, name)
+            if name == 'values' and dtype is not None:
+                array = array.astype(dtype)
+            np.save(os.path.join(directory, name + ".npy"), array)
+
+
+def load_model(directory, mmap_mode='r'):
+    """
+    Loads a compact model saved with 'SimilarityModel.save'. By default the arrays are memory-mapped, so loading is
+    instantaneous and only the rows that are used are read from disk.
+    :param directory: path to the directory
+    :param mmap_mode: memory-map mode (see 'np.load'). None to read the arrays into memory.
+    :return: a SimilarityModel object
+    """
+    arrays = [np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode) for name in ARRAYS]
+    return SimilarityModel(*arrays)
+
+
+def to_compact_model(itemids, similarities, dtype=np.float64):
+    """
+    Converts the similarity matrix into a compact model.
+    :param itemids: sorted array of item IDs aligned with the similarity matrix
+    :param similarities: the similarity matrix (csr, sorted indices)
+    :param dtype: type of the similarity values
+    :return: a SimilarityModel object
+    """
+    # The arrays of the matrix are not copied if they already have the right type:
+    return SimilarityModel(np.asarray(itemids, dtype=np.int64), similarities.indptr.astype(np.int64, copy=False),
+                           similarities.indices.astype(np.int32, copy=False),
+                           similarities.data.astype(dtype, copy=False))
+
+
+def from_nested_model(model, dtype=np.float64):
+    """
+    Converts a model in nested dictionaries (see 'globals.IICF_MODEL') into a compact model.
+    :param model: a dictionary with "Key={-1,1}"
+    :param dtype: type of the similarity values
+    :return: a SimilarityModel object
+    """
+    rows = []
+    columns = []
+    values = []
+    for sign in [1, -1]:
+        for itemid, neighbors in model[sign].items():
+            rows.extend([itemid] * len(neighbors))
+            columns.extend(neighbors.keys())
+            values.extend(neighbors.values())
+    itemids = np.unique(np.array(rows + columns, dtype=np.int64))
+    similarities = sparse.csr_matrix((np.array(values, dtype=np.float64),
+                                      (np.searchsorted(itemids, rows), np.searchsorted(itemids, columns))),
+                                     shape=(len(itemids), len(itemids)))
+    similarities.sort_indices()
+    return to_compact_model(itemids, similarities, dtype)
+
+
+def build_compact_model(item_raters, itemIDs=None, block_size=BLOCK_SIZE, dtype=np.float64, k=None, processes=1,
+                        checkpoint_directory=None):
+    """
+    Builds the IICF model in the compact format.
+    :param item_raters: an ItemRaters object (see 'itemindex.py')
+    :param itemIDs: list of ints of the items of the model. If None, all rated items.
+    :param block_size: number of item rows multiplied at once
+    :param dtype: type of the similarity values
+    :param k: if not None, only the k most similar positive (and negative) neighbors of every item are kept
+    :param processes: number of worker processes (see 'build_blocks')
+    :param checkpoint_directory: directory of the checkpoints of the blocks (see 'build_blocks'). None means no checkpoints.
+    :return: a SimilarityModel object
+    """
+    if k is None:
+        itemids, similarities = build_similarity_matrix(item_raters, itemIDs, block_size, processes,
+                                                        checkpoint_directory)
+    else:
+        itemids, similarities = build_pruned_similarity_matrix(item_raters, itemIDs, k, block_size, processes,
+                                                               checkpoint_directory)
+    return to_compact_model(itemids, similarities, dtype)
+
+
+def predict(model, ratings_user, itemID, similarity_type="POSITIVE", k=20):
+    """
+    Calculates the rating prediction of a user for an item like 'main.rating_prediction_item': the weighted average of
+    the ratings of the user for the k most similar items (that the user rated).
+    :param model: a SimilarityModel object
+    :param ratings_user: a dictionary with "Key=itemID" and "Value=rating (stars)" of the user
+    :param itemID: int number of the target item
+    :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities
+    :param k: number of neighbors
+    :return: float number, None if no similar item was rated by the user
+    """
+    itemids, values = model.neighbors(itemID, similarity_type)
+    rated = np.array([itemid in ratings_user for itemid in itemids.tolist()], dtype=bool)
+    if not rated.any():
+        return None
+    itemids = itemids[rated]
+    values = values[rated].astype(np.float64)
+    selected = topn.top_positions(values, itemids, k)
+    stars = np.array([ratings_user[itemid] for itemid in itemids[selected].tolist()])
+    return float((values[selected] * stars).sum() / np.abs(values[selected]).sum())
+
+
+def model_size(model):
+    """
+    :param model: a SimilarityModel object
+    :return: the amount of stored similarities AND the amount of bytes of the model
+    """
+    return len(model.values), sum(getattr(model, name).nbytes for name in ARRAYS)
+
+
+def pruning_report(full, pruned, ratings_by_user_map, pairs, similarity_type="POSITIVE", k=20):
+    """
+    Compares a pruned model against the full model: size and drift of the rating predictions.
+    :param full: the full model (a SimilarityModel object)
+    :param pruned: the pruned model (a SimilarityModel object)
+    :param ratings_by_user_map: a dictionary with "Key=userID" and "Value=a Dictionary with 'Key=itemID' and 'Value=rating (stars)'"
+    :param pairs: list of tuples (userID, itemID) whose predictions are compared
+    :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities
+    :param k: number of neighbors of the predictions
+    :return: a dictionary with the sizes of both models, the mean and max absolute drift of the predictions, the
+    fraction of predictions that changed and the fraction of predictions lost (no similar item rated by the user)
+    """
+    drifts = []
+    lost = 0
+    compared = 0
+    for userID, itemID in pairs:
+        expected = predict(full, ratings_by_user_map[userID], itemID, similarity_type, k)
+        if expected is None:
+            continue
+        compared += 1
+        obtained = predict(pruned, ratings_by_user_map[userID], itemID, similarity_type, k)
+        if obtained is None:
+            lost += 1
+        else:
+            drifts.append(abs(obtained - expected))
+    if compared == 0:
+        raise ValueError("[Error] None of the pairs has a prediction in the full model. Cannot compute the report!")
+    drifts = np.array(drifts)
+    full_similarities, full_bytes = model_size(full)
+    pruned_similarities, pruned_bytes = model_size(pruned)
+    return {'full_similarities': full_similarities,
+            'full_bytes': full_bytes,
+            'pruned_similarities': pruned_similarities,
+            'pruned_bytes': pruned_bytes,
+            'compression': float(full_bytes) / pruned_bytes,
+            'predictions': compared,
+            'mean_absolute_drift': float(drifts.mean()) if len(drifts) > 0 else 0.0,
+            'max_absolute_drift': float(drifts.max()) if len(drifts) > 0 else 0.0,
+            'changed_predictions': float((drifts > 1e-6).sum()) / compared,
+            'lost_predictions': float(lost) / compared}
@@ -0,0 +1,280 @@
+"""
+This file holds the incremental version of the IICF (Item-Item Collaborative Filtering) model, so new ratings are
+reflected in the item similarities without building the whole model again.
+The model keeps the sufficient statistics of the cosine similarity (see 'itemmodel.py'): the dot product of every pair
+of mean-centered items and the norm of every mean-centered item. The items are centered by REFERENCE means (the item
+means at the last full build) instead of by the current ones, so a new rating only changes the dot products of the
+items rated by the same user. With X the centered item x user matrix and D the change brought by a batch of ratings
+(one row per rated item, one column per rating user), the new dot products are:
+    (X + D)(X + D)^T = X X^T + B + B^T - D D^T,  where B = D (X + D)^T
+so only the rows of the items in the batch are multiplied. The current item means (MEAN_RATINGS_ITEM) are kept exactly.
+Only the dot products and the norms of the items in the batch change, so the similarities sim(i, j) = dots(i, j) /
+(norm_i * norm_j) are kept between batches and only the rows (and, by symmetry, the columns) of those items are
+divided again, as long as the batch doesn't add new pairs of items (see 'IncrementalItemModel.model').
+As more ratings arrive, the reference means drift away from the current ones, so the model is fully rebuilt (and the
+reference means reset) every so many ratings, or as soon as the mean of an item drifted too far from its reference mean
+(items with few ratings drift the most: a single new rating can move their mean by stars).
+"""
+
+import numpy as np
+from scipy import sparse
+import itemmodel
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+
+def reindex(matrix, old_rows, new_rows, old_columns, new_columns):
+    """
+    Moves the entries of a csr matrix to bigger (sorted) sets of row and column IDs. Since both sets are sorted, the
+    entries keep their order: the new rows are just empty and the column indices are shifted, nothing is sorted again.
+    :param matrix: a csr matrix aligned with 'old_rows' and 'old_columns'
+    :param old_rows: sorted array of the IDs of the rows
+    :param new_rows: sorted array of the IDs of the rows, a superset of 'old_rows'
+    :param old_columns: sorted array of the IDs of the columns
+    :param new_columns: sorted array of the IDs of the columns, a superset of 'old_columns'
+    :return: the matrix (csr) aligned with 'new_rows' and 'new_columns'
+    """
+    amounts = np.zeros(len(new_rows), dtype=np.int64)
+    amounts[np.searchsorted(new_rows, old_rows)] = np.diff(matrix.indptr)
+    columns = np.searchsorted(new_columns, old_columns)[matrix.indices]
+    return sparse.csr_matrix((matrix.data, columns, np.concatenate([[0], np.cumsum(amounts)])),
+                             shape=(len(new_rows), len(new_columns)))
+
+
+class IncrementalItemModel:
+    """
+    Item-item cosine similarities that can be updated with batches of new ratings. Rows are aligned with 'itemids'
+    (sorted) and the columns of the rating matrix with 'userids' (sorted).
+    """
+
+    def __init__(self, userids, itemids, stars, rebuild_every=100000, block_size=itemmodel.BLOCK_SIZE, processes=1,
+                 max_mean_drift=None):
+        """
+        Builds the model out of three parallel arrays (a full build).
+        :param userids: array of ints, the user ID of every rating
+        :param itemids: array of ints, the item ID of every rating
+        :param stars: array of floats, the rating (stars) of every rating
+        :param rebuild_every: number of new ratings after which the model is fully rebuilt (None means never)
+        :param block_size: number of item rows multiplied at once in a full build
+        :param processes: number of worker processes of a full build (see 'itemmodel.build_blocks')
+        :param max_mean_drift: biggest difference (stars) allowed between the current and the reference mean of an
+        item, beyond it the model is fully rebuilt (None means no limit, see 'mean_drift')
+        """
+        self.rebuild_every = rebuild_every
+        self.max_mean_drift = max_mean_drift
+        self.block_size = block_size
+        self.processes = processes
+        self.itemids, item_index = np.unique(itemids, return_inverse=True)
+        self.userids, user_index = np.unique(userids, return_inverse=True)
+        # A user rates an item at most once, the last rating wins (like 'globals.RATINGS_BY_USER_MAP'):
+        keys = item_index.astype(np.int64) * len(self.userids) + user_index
+        keys, last = np.unique(keys[::-1], return_index=True)
+        self.stars = sparse.csr_matrix((np.asarray(stars, dtype=np.float64)[::-1][last],
+                                        (keys // len(self.userids), keys % len(self.userids))),
+                                       shape=(len(self.itemids), len(self.userids)))
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Computes all the dot products again, centering the items by their current means (full build).
+        :return: nothing
+        """
+        self.counts = np.diff(self.stars.indptr)
+        self.sums = np.asarray(self.stars.sum(axis=1)).ravel()
+        self.means = self.sums / np.maximum(self.counts, 1)
+        self.reference_means = self.means.copy()
+        centered = self.centered()
+        self.norms = np.sqrt(np.asarray(centered.multiply(centered).sum(axis=1)).ravel())
+        blocks = itemmodel.build_blocks(centered, self.norms, self.block_size, None, self.processes)
+        similarities = itemmodel.mirror_blocks(blocks, len(self.itemids))
+        # The dot products are recovered from the similarities (pairs with a zero dot product are not stored):
+        rows = np.repeat(np.arange(len(self.itemids)), np.diff(similarities.indptr))
+        self.dots = sparse.csr_matrix((similarities.data * self.norms[rows] * self.norms[similarities.indices],
+                                       similarities.indices, similarities.indptr), shape=similarities.shape)
+        self.pending = 0  # new ratings since the last full build
+        self.matrix = None  # similarity matrix (csr) of the last model, None until the model is asked for
+        self.new_entries = True  # whether pairs of items were added or removed since the last model
+        self.stale = np.zeros(0, dtype=np.int64)  # IDs of the items whose similarities changed since the last model
+
+    def centered(self):
+        """
+        :return: the item x user matrix (csr) of the ratings centered by the reference means
+        """
+        rows = np.repeat(np.arange(len(self.itemids)), np.diff(self.stars.indptr))
+        return sparse.csr_matrix((self.stars.data - self.reference_means[rows], self.stars.indices,
+                                  self.stars.indptr), shape=self.stars.shape)
+
+    def __grow(self, userIDs, itemIDs):
+        """
+        Adds the rows of the new items and the columns of the new users. New items get their reference mean once
+        their first ratings are in.
+        :param userIDs: array of ints, the users of the new ratings
+        :param itemIDs: array of ints, the items of the new ratings
+        :return: array with the rows of the new items
+        """
+        itemids = np.union1d(self.itemids, itemIDs)
+        userids = np.union1d(self.userids, userIDs)
+        if len(itemids) == len(self.itemids) and len(userids) == len(self.userids):
+            return np.zeros(0, dtype=np.int64)
+        old_rows = np.searchsorted(itemids, self.itemids)
+        self.stars = reindex(self.stars, self.itemids, itemids, self.userids, userids)
+        if len(itemids) > len(self.itemids):
+            self.dots = reindex(self.dots, self.itemids, itemids, self.itemids, itemids)
+            self.new_entries = True
+        for name in ['counts', 'sums', 'means', 'reference_means', 'norms']:
+            values = np.zeros(len(itemids), dtype=getattr(self, name).dtype)
+            values[old_rows] = getattr(self, name)
+            setattr(self, name, values)
+        new_rows = np.setdiff1d(np.arange(len(itemids)), old_rows)
+        self.itemids = itemids
+        self.userids = userids
+        return new_rows
+
+    def add_ratings(self, userIDs, itemIDs, stars):
+        """
+        Adds a batch of ratings to the model. A rating of an item the user already rated replaces the old one. Only the
+        dot products and norms of the rated items are computed again, unless it's time for a full build.
+        :param userIDs: list of ints, the user of every rating
+        :param itemIDs: list of ints, the item of every rating
+        :param stars: list of floats, the rating (stars) of every rating
+        :return: sorted array with the IDs of the items whose similarities and means changed (all items after a full
+        build)
+        """
+        if len(userIDs) == 0:
+            return np.zeros(0, dtype=np.int64)
+        userIDs = np.asarray(userIDs, dtype=np.int64)
+        itemIDs = np.asarray(itemIDs, dtype=np.int64)
+        new_rows = self.__grow(userIDs, itemIDs)
+        rows = np.searchsorted(self.itemids, itemIDs)
+        columns = np.searchsorted(self.userids, userIDs)
+        # Within the batch, the last rating of a user for an item wins:
+        keys, last = np.unique((rows.astype(np.int64) * len(self.userids) + columns)[::-1], return_index=True)
+        rows = keys // len(self.userids)
+        columns = keys % len(self.userids)
+        stars = np.asarray(stars, dtype=np.float64)[::-1][last]
+        old_stars = np.asarray(self.stars[rows, columns]).ravel()
+        rated = old_stars != 0.0
+        # Exact current means:
+        touched = np.unique(rows)
+        self.sums += np.bincount(rows, weights=stars - old_stars, minlength=len(self.itemids))
+        self.counts += np.bincount(rows[~rated], minlength=len(self.itemids))
+        self.means[touched] = self.sums[touched] / self.counts[touched]
+        self.reference_means[new_rows] = self.means[new_rows]
+        self.stars = self.stars + sparse.csr_matrix((stars - old_stars, (rows, columns)), shape=self.stars.shape)
+        self.pending += len(stars)
+        # Too many ratings since the last full build, or the reference means drifted too far from the current ones:
+        if (self.rebuild_every is not None and self.pending >= self.rebuild_every) or \
+                (self.max_mean_drift is not None and self.mean_drift() > self.max_mean_drift):
+            self.rebuild()
+            return self.itemids.copy()
+        # Change of the centered matrix: new - old rating if it was already rated, new rating - reference mean if not:
+        changes = np.where(rated, stars - old_stars, stars - self.reference_means[rows])
+        D = sparse.csr_matrix((changes, (rows, columns)), shape=self.stars.shape)
+        centered = self.centered()
+        B = D.dot(centered.T).tocsr()
+        changes = (B + B.T - D.dot(D.T)).tocoo()
+        off_diagonal = changes.row != changes.col
+        dots = self.dots + sparse.csr_matrix((changes.data[off_diagonal],
+                                              (changes.row[off_diagonal], changes.col[off_diagonal])),
+                                             shape=self.dots.shape)
+        dots.eliminate_zeros()
+        if not (np.array_equal(dots.indptr, self.dots.indptr) and np.array_equal(dots.indices, self.dots.indices)):
+            self.new_entries = True
+        self.dots = dots
+        touched_centered = centered[touched]
+        self.norms[touched] = np.sqrt(np.asarray(touched_centered.multiply(touched_centered).sum(axis=1)).ravel())
+        self.stale = np.union1d(self.stale, self.itemids[touched])
+        return self.itemids[touched]
+
+    def mean_ratings(self, itemIDs=None):
+        """
+        Collects the current mean rating of the items, like 'itemindex.ItemRaters.mean_ratings'.
+        :param itemIDs: list of ints of the items. If None, all rated items.
+        :return: a dictionary with "Key=itemID" and "Value=average of the ratings of all users who rated this item"
+        """
+        if itemIDs is None:
+            itemIDs = self.itemids
+        rows = np.searchsorted(self.itemids, itemIDs)
+        means = {}
+        for itemid, row in zip(np.asarray(itemIDs).tolist(), rows.tolist()):
+            rated = row < len(self.itemids) and self.itemids[row] == itemid and self.counts[row] > 0
+            means[int(itemid)] = float(self.means[row]) if rated else np.nan
+        return means
+
+    def mean_drift(self):
+        """
+        :return: float number, the biggest difference between the current and the reference mean of an item
+        """
+        if len(self.itemids) == 0:
+            return 0.0
+        return float(np.abs(self.means - self.reference_means).max())
+
+    def similarities(self):
+        """
+        Divides the dot products by the norms of both items. Pairs with a zero denominator are left out.
+        :return: the similarity matrix (csr, aligned with the item IDs, no diagonal)
+        """
+        self.dots.sort_indices()
+        rows = np.repeat(np.arange(len(self.itemids)), np.diff(self.dots.indptr))
+        denominators = self.norms[rows] * self.norms[self.dots.indices]
+        keep = denominators != 0.0
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[keep], minlength=len(self.itemids)))])
+        return sparse.csr_matrix((self.dots.data[keep] / denominators[keep], self.dots.indices[keep], indptr),
+                                 shape=self.dots.shape)
+
+    def model(self, dtype=np.float64):
+        """
+        The similarities of the last model share the entries (indices and indptr) of the dot products, pairs with a
+        zero denominator being stored as 0. While the batches don't add or remove pairs of items, only the rows and
+        columns of the items rated since the last model are divided again. Otherwise all dot products are divided
+        again, in place of the entries (none is dropped, so the matrix isn't built again).
+        :param dtype: type of the similarity values
+        :return: the current model in the compact format (see 'itemmodel.SimilarityModel')
+        """
+        self.dots.sort_indices()
+        lengths = np.diff(self.dots.indptr)
+        if self.new_entries:
+            denominators = np.repeat(self.norms, lengths) * self.norms[self.dots.indices]
+            denominators[denominators == 0.0] = np.inf
+            data = self.dots.data / denominators
+        elif len(self.stale) > 0:
+            stale = np.searchsorted(self.itemids, self.stale)
+            changed = np.zeros(len(self.itemids), dtype=bool)
+            changed[stale] = True
+            # Entries in the columns of the changed items, plus the entries of their rows:
+            dividing = changed[self.dots.indices]
+            amounts = lengths[stale]
+            dividing[np.arange(amounts.sum()) - np.repeat(np.cumsum(amounts) - amounts - self.dots.indptr[stale],
+                                                          amounts)] = True
+            entries = np.flatnonzero(dividing)
+            rows = np.searchsorted(self.dots.indptr, entries, side='right') - 1
+            # The last model may still be in use, so its values are not overwritten:
+            data = self.matrix.data.copy()
+            denominators = self.norms[rows] * self.norms[self.dots.indices[entries]]
+            denominators[denominators == 0.0] = np.inf
+            data[entries] = self.dots.data[entries] / denominators
+        else:
+            return itemmodel.to_compact_model(self.itemids, self.matrix, dtype)
+        self.matrix = sparse.csr_matrix((data, self.dots.indices, self.dots.indptr), shape=self.dots.shape)
+        self.new_entries = False
+        self.stale = np.zeros(0, dtype=np.int64)
+        return itemmodel.to_compact_model(self.itemids, self.matrix, dtype)
+
+
+def build_incremental_model(ratings, rebuild_every=100000, block_size=itemmodel.BLOCK_SIZE, processes=1,
+                            max_mean_drift=None):
+    """
+    Builds the incremental IICF model from a collection of all ratings.
+    :param ratings: a list of ALL ratings
+    :param rebuild_every: number of new ratings after which the model is fully rebuilt (None means never)
+    :param block_size: number of item rows multiplied at once in a full build
+    :param processes: number of worker processes of a full build (see 'itemmodel.build_blocks')
+    :param max_mean_drift: biggest difference (stars) allowed between the current and the reference mean of an item,
+    beyond it the model is fully rebuilt (None means no limit)
+    :return: an IncrementalItemModel object
+    """
+    userids = np.fromiter((rating['userid'] for rating in ratings), dtype=np.int64, count=len(ratings))
+    itemids = np.fromiter((rating['movieid'] for rating in ratings), dtype=np.int64, count=len(ratings))
+    stars = np.fromiter((rating['rating'] for rating in ratings), dtype=np.float64, count=len(ratings))
+    return IncrementalItemModel(userids, itemids, stars, rebuild_every, block_size, processes, max_mean_drift)
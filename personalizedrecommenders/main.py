@@ -6,18 +6,40 @@ This file is the main file. Main methods for personalized recommender system can
 __author__ = "Aitor De Blas Granja"
 __email__ = "aitor.deblas@ugent.be"
 
+import atexit
+import multiprocessing
+import multiprocessing.pool
 import numpy as np
 import data
 import utils
-import operator  # used to sort the (key,value) pairs of a dictionary
+import trending
+import usersimilarity
+import userindex
+import userstats
+import itemindex
+import itemmodel
+import itemupdates
+import batchrecommend
+import topn  # selection of the top N (or top k) elements without sorting all the candidates
 import globals  # a file to store global variables to use them across all Python files
 
 MOVIE_PICKLE_LOCATION = "movies_pickle_06-05-2018--23-43-45.pkl"
 RATINGS_PICKLE_LOCATION = "ratings_pickle_06-05-2018--23-43-45.pkl"
 IICF_MODEL_NAME = "IICF-model_pickle_12-05-2018--01-18-59.pkl"
+IICF_MODEL_DIRECTORY = "IICF-model"  # directory of the compact IICF model (see 'itemmodel.SimilarityModel.save')
+IICF_NEIGHBORS = None  # if not None, the IICF model only keeps the k most similar positive (and negative) neighbors of every item
+IICF_PROCESSES = None  # number of processes that build the IICF model (None means one per CPU)
+IICF_CHECKPOINT_DIRECTORY = "IICF-checkpoints"  # directory of the blocks of an IICF model being built (None means no checkpoints)
+USER_INDEX_TABLES = 8  # number of hash tables of the approximate user index (see 'userindex.recall_report' to choose them)
+USER_INDEX_BITS = 6  # number of bits of every hash table of the approximate user index
+USER_INDEX_PROBE = True  # whether the approximate user index also probes the buckets at one bit of distance
+HYBRID_CONCURRENCY = None  # how UUCF and IICF run side by side in the hybrid recommender: "process", "thread" or None (one after the other, until the speed-up of the workers is measured on a multi-core machine)
+IICF_REBUILD_EVERY = 100000  # number of new ratings after which the incremental IICF model is fully rebuilt (see 'itemupdates.py'). It doesn't bound the drift of the means the items are centered on: IICF_MAX_MEAN_DRIFT does
+IICF_MAX_MEAN_DRIFT = 0.5  # the incremental IICF model is also fully rebuilt as soon as an item mean drifts further (stars) from its reference mean, so items are always centered on means at most this far from the current ones
 RATINGS_X_BY_USERS_PATH = "RATINGS_X_BY_USERS_pickle_10-05-2018--07-00-01.pkl"
 MEAN_RATINGS_ITEM_PATH = "MEAN_RATINGS_ITEM_pickle_10-05-2018--07-00-02.pkl"
 CUT_OFF = 10  # gamma corresponds to the cut-off value of the significance weighting
+SIMILARITY_CACHE_SIZE = 100  # number of user similarity profiles cached across UUCF requests (0 means no cache)
 
 
 def calculate_pearson_correlation(common_ratings, userAid, userUid):
@@ -38,8 +60,13 @@ def calculate_pearson_correlation(common_ratings, userAid, userUid):
     ratings_by_user_U = globals.RATINGS_BY_USER[userUid]
     mean_ratings_A = calculate_mean_ratings(userAid, ratings_by_user_A)
     mean_ratings_U = calculate_mean_ratings(userUid, ratings_by_user_U)
-    d_a = calculate_user_mean_centered_rating(ratings_by_user_A, mean_ratings_A) # this is the calculation of one part of the formula
-    d_u = calculate_user_mean_centered_rating(ratings_by_user_U, mean_ratings_U) # this is the calculation of one part of the formula
+    if globals.USER_STATISTICS is not None:
+        # Precomputed in the user statistics store, no need to go over the ratings of both users again:
+        d_a = globals.USER_STATISTICS.centered_sum_of_squares(userAid)
+        d_u = globals.USER_STATISTICS.centered_sum_of_squares(userUid)
+    else:
+        d_a = calculate_user_mean_centered_rating(ratings_by_user_A, mean_ratings_A) # this is the calculation of one part of the formula
+        d_u = calculate_user_mean_centered_rating(ratings_by_user_U, mean_ratings_U) # this is the calculation of one part of the formula
     # Calculation of denominator:
     denominator = float(np.sqrt(d_a) * np.sqrt(d_u))
     if denominator == 0.0:
@@ -58,6 +85,9 @@ def calculate_mean_ratings(userID, ratings_by_user=None):
     :param ratings_by_user: list of ratings by the user. It's provided to speed-up execution in run-time
     :return: float number, average of the ratings
     """
+    # If the user statistics store is available, the mean is just looked up:
+    if globals.USER_STATISTICS is not None:
+        return globals.USER_STATISTICS.mean(userID)
     # To avoid excessive computation during run-time, the user ratings are provided by parameter.
     # If it's not none, then it can be used, otherwise we need to calculate it.
     if ratings_by_user is not None:
@@ -140,7 +170,7 @@ def rating_prediction_user(userAid, itemID, neighborsIDs, neighbors_data):
     return mean_ratings_A + (float(numerator)/float(denominator))
 
 
-def top_k_most_similar_neighbors(userID, itemID, k=20):
+def top_k_most_similar_neighbors(userID, itemID, k=20, similarities=None):
     """
     Retrieves the most similar neighbors of user 'userID' with respect to item 'itemID'.
     Target item must be rated by both users.
@@ -150,30 +180,26 @@ def top_k_most_similar_neighbors(userID, itemID, k=20):
     :param userID: int number of the target user
     :param itemID: int number of the target item
     :param k: int number ideal number of neighbors to find
+    :param similarities: similarity profile of the target user (see 'usersimilarity.UserSimilarity.profile'). It's
+    provided to speed-up execution in run-time, only used together with the similarity engine.
     :return: list of ints of neighbors IDs AND a dictionary with relevant data of the user
     """
-    # A list of ints containing the user IDs of all approved/valid neighbors
-    neighborsIDs = []
-    # This dictionary holds data (relevant values) for each neighbor to avoid re-calculating them again later on.
-    # It contains: "Key=userID" and "Value=a Dictionary with 'Key=name of the property' and 'Value=the value of the property'":
-    # e.g. Pearson correlation value, common ratings etc.
-    neighbors_data = {}
-    # List of tuples with the form: ("userID", "Pearson correlation value"). This list is used to find the k neighbors:
-    user_pearson_tuples = []
-    # This dictionary is a helper to sort and eliminate duplicates throughout this method:
-    pearson_userids_dict = {}
-
+    if globals.USER_SIMILARITY is not None:
+        return top_k_most_similar_neighbors_vectorized(userID, itemID, k, similarities)
     if globals.RATINGS_BY_USER is None:
         raise ValueError("[Error] RATINGS_BY_USER is none! Cannot continue with the method!")
-    for userUid in globals.RATINGS_BY_USER.keys():
+    # The target item must be rated by the neighbors, so only the users who rated it are considered. They are retrieved
+    # from the item -> raters index if available, otherwise every user is checked:
+    if globals.ITEM_RATERS is not None:
+        candidatesIDs = [int(userUid) for userUid in globals.ITEM_RATERS.raters_of(itemID)[0]]
+    else:
+        candidatesIDs = [userUid for userUid in globals.RATINGS_BY_USER.keys() if itemID in globals.RATINGS_BY_USER_MAP[userUid]]
+    # Dictionary with "Key=userID" and "Value=Pearson correlation value" of all approved/valid neighbors:
+    pearson_values = {}
+    for userUid in candidatesIDs:
         # Skip user if we are comparing the user with her/himself:
         if userUid == userID:
             continue
-        # The target item must be rated by current user, otherwise we will not consider current user as a neighbor:
-        ratings_by_user_U = globals.RATINGS_BY_USER[userUid]
-        itemids_userU = globals.RATINGS_BY_USER_MAP[userUid].keys()
-        if itemID not in itemids_userU:
-            continue
         common_ratings, amount = utils.find_common_ratings(userID, userUid, None)  # common ratings
         pearson_value = calculate_pearson_correlation(common_ratings, userID, userUid)  # calculation of Pearson correlation
         # We are only interested in positive similarity value. If it's negative, we skip it:
@@ -181,49 +207,94 @@ def top_k_most_similar_neighbors(userID, itemID, k=20):
             continue
         # Pearson correlation value needs to be multiplied by significance weighting factor:
         pearson_value = pearson_value * calculate_significance_weighing_factor(userID, userUid, None, amount)
-        # Relevant data of this user will be added to a dictionary for later use outside this method:
-        neighbors_data[userUid] = {}
-        neighbors_data[userUid]['pearson'] = pearson_value
-        neighbors_data[userUid]['ratings_by_user'] = ratings_by_user_U
-        user_pearson_tuples.append((userUid, pearson_value))
-        if pearson_value in pearson_userids_dict:
-            pearson_userids_dict[pearson_value].append(userUid)
-        else:
-            pearson_userids_dict[pearson_value] = []
-            pearson_userids_dict[pearson_value].append(userUid)
+        pearson_values[userUid] = pearson_value
     # Watch out! If none of the possible neighbors or users have rated the target item or by any reason no neighbors were found,
     # then, 'neighbors_data' will take the value None indicating that no neighbors were found.
-    if len(user_pearson_tuples) == 0:
-        neighbors_data = None
-    else:
-        mysorted = sorted(user_pearson_tuples, key=operator.itemgetter(1, 0), reverse=True)  # tuples sorted from BIG to SMALL Pearson value
-        if globals.LOG_STATUS is True:
-            print "Len(mysorted) # similar users found = ", len(mysorted)
-        # Now we should delete duplicate Pearson values. In case of draw, keep the one corresponding to the user with lowest ID:
-        tmp = []  # temporal list to keep track of which Pearson values we have already used
-        for tuple in mysorted:
-            current_pearson_value = tuple[1]
-            if current_pearson_value in tmp:
-                continue
-            amount_users_with_same_pearson_value = len(pearson_userids_dict[current_pearson_value])
-            if amount_users_with_same_pearson_value > 1:
-                neighborsIDs.append(min(pearson_userids_dict[current_pearson_value]))
-            else:
-                neighborsIDs.append(tuple[0])
-            tmp.append(current_pearson_value)
-            if len(neighborsIDs) == k:
-                break
-        if globals.LOG_STATUS is True:
-            print "Len(neighbors_data) before = ", len(neighbors_data)
-        # Delete all superfluous data from neighbors/users who are not in neighborsIDs:
-        for key in neighbors_data.keys():
-            if key not in neighborsIDs:
-                del neighbors_data[key]
-        if globals.LOG_STATUS is True:
-            print "Len(neighbors_data) after = ", len(neighbors_data)
+    if len(pearson_values) == 0:
+        return [], None
+    if globals.LOG_STATUS is True:
+        print "Len(pearson_values) # similar users found = ", len(pearson_values)
+    # The k biggest distinct Pearson values, from BIG to SMALL Pearson value. In case of draw, the user with lowest ID
+    # is kept:
+    neighborsIDs = [userUid for userUid, pearson_value in topn.top_n_distinct(pearson_values.items(), k)]
+    # This dictionary holds data (relevant values) for each neighbor to avoid re-calculating them again later on.
+    # It contains: "Key=userID" and "Value=a Dictionary with 'Key=name of the property' and 'Value=the value of the property'":
+    # e.g. Pearson correlation value, common ratings etc.
+    neighbors_data = {}
+    for userUid in neighborsIDs:
+        neighbors_data[userUid] = {}
+        neighbors_data[userUid]['pearson'] = pearson_values[userUid]
+        neighbors_data[userUid]['ratings_by_user'] = globals.RATINGS_BY_USER[userUid]
     return neighborsIDs, neighbors_data
 
 
+def similarity_profile(userID):
+    """
+    Retrieves the similarity profile of the user (see 'usersimilarity.UserSimilarity.profile'). If the approximate
+    user index is available (see 'userindex.py'), only the candidates it finds are scored (exactly) and the rest of the
+    users get 0.
+    :param userID: int number of the target user
+    :return: an array of floats aligned with the users of the similarity engine
+    """
+    if globals.USER_SIMILARITY is None:
+        raise ValueError("[Error] USER_SIMILARITY is none! Cannot continue with the method!")
+    if globals.USER_INDEX is not None:
+        return globals.USER_INDEX.profile(userID)
+    return globals.USER_SIMILARITY.profile(userID)
+
+
+def top_k_most_similar_neighbors_vectorized(userID, itemID, k=20, similarities=None):
+    """
+    Same as 'top_k_most_similar_neighbors' but the Pearson correlations (with significance weighting) of the target
+    user against ALL users are computed at once by the similarity engine (see 'usersimilarity.py'), instead of one
+    pair of users at a time.
+    :param userID: int number of the target user
+    :param itemID: int number of the target item
+    :param k: int number ideal number of neighbors to find
+    :param similarities: similarity profile of the target user. Retrieved if not provided (see 'similarity_profile').
+    :return: list of ints of neighbors IDs AND a dictionary with relevant data of the user
+    """
+    if globals.RATINGS_BY_USER is None:
+        raise ValueError("[Error] RATINGS_BY_USER is none! Cannot continue with the method!")
+    if similarities is None:
+        similarities = similarity_profile(userID)
+    neighborsIDs = []
+    neighbors_data = {}
+    # Users who rated the target item with a positive similarity value:
+    userIDs, pearson_values = globals.USER_SIMILARITY.neighbor_candidates(userID, itemID, similarities)
+    if len(userIDs) == 0:
+        return neighborsIDs, None
+    # The k biggest distinct Pearson values, from BIG to SMALL. In case of draw, keep the user with lowest ID:
+    selected = topn.top_distinct_positions(pearson_values, userIDs, k)
+    for userUid, pearson_value in zip(userIDs[selected], pearson_values[selected]):
+        userUid = int(userUid)
+        neighborsIDs.append(userUid)
+        neighbors_data[userUid] = {}
+        neighbors_data[userUid]['pearson'] = float(pearson_value)
+        neighbors_data[userUid]['ratings_by_user'] = globals.RATINGS_BY_USER[userUid]
+    return neighborsIDs, neighbors_data
+
+
+def uucf_predictions(userID, movieIDs):
+    """
+    Calculates the UUCF rating predictions of a user for some items (see 'rating_prediction_user').
+    :param userID: int number of the user
+    :param movieIDs: list of ints of the items
+    :return: a list of floats aligned with the items
+    """
+    # The similarities of the user against all users are the same for every item, so they are computed just once:
+    similarities = None
+    if globals.USER_SIMILARITY is not None:
+        similarities = similarity_profile(userID)
+    predictions = []
+    for movieid in movieIDs:
+        neighborsIDs, neighbors_data = top_k_most_similar_neighbors(userID, movieid, similarities=similarities)
+        if globals.LOG_STATUS is True:
+            print "neighbors IDs (item:{0}) = {1}".format(movieid, neighborsIDs)
+        predictions.append(rating_prediction_user(userID, movieid, neighborsIDs, neighbors_data))
+    return predictions
+
+
 def topN_recommendations_uucf(userID, movies, N=10):
     """
     Top N list of recommendations for a certain user given by parameter over all the ratings.
@@ -233,55 +304,77 @@ def topN_recommendations_uucf(userID, movies, N=10):
     :param N: number of recommended items
     :return: a list containing tuples corresponding to the TOP-N recommended items with the form ("item id, title, prediction value")
     """
-    # This dictionary is a helper to sort and eliminate duplicates throughout this method:
-    prediction_itemids_dict = {}
-
     if globals.RATINGS_BY_USER is None:
         raise ValueError("[Error] RATINGS_BY_USER is none! Cannot continue with the method!")
     if globals.RATINGS_BY_USER_MAP is None:
         raise ValueError("[Error] RATINGS_BY_USER_MAP is none! Cannot continue with the method!")
-    itemids_user = globals.RATINGS_BY_USER_MAP[userID].keys()  # item IDs of those items rated by user
-    # A list for all rating predictions from all those items that the user has not rated yet:
-    # The list contains tuples with the form: ("itemid", "rating prediction")
-    rating_predictions = []
+    itemids_user = set(globals.RATINGS_BY_USER_MAP[userID].keys())  # item IDs of those items rated by user
+    # Rating predictions for all those items that the user has not rated yet:
     allItems = [int(movie['id']) for movie in movies.values()]  # we retrieve all item IDs
-    for movieid in allItems:
-        # Skip item if the user has already consumed that item!
-        if movieid in itemids_user:
-            continue
-        neighborsIDs, neighbors_data = top_k_most_similar_neighbors(userID, movieid)
-        if globals.LOG_STATUS is True:
-            print "neighbors IDs (item:{0}) = {1}".format(movieid, neighborsIDs)
-        prediction = rating_prediction_user(userID, movieid, neighborsIDs, neighbors_data)
-        rating_predictions.append((movieid, prediction))
-        if prediction in prediction_itemids_dict:
-            prediction_itemids_dict[prediction].append(movieid)
-        else:
-            prediction_itemids_dict[prediction] = []
-            prediction_itemids_dict[prediction].append(movieid)
-    mysorted = sorted(rating_predictions, key=operator.itemgetter(1, 0), reverse=True)  # tuples sorted from BIG to SMALL prediction value
-    # Now we should delete duplicate Pearson values. In case of draw, keep the one corresponding to the item with lowest ID:
-    tmp = []  # temporal list to keep track of which Pearson values we have already used
+    movieIDs = [movieid for movieid in allItems if movieid not in itemids_user]
+    # A list of tuples with the form: ("itemid", "rating prediction")
+    rating_predictions = zip(movieIDs, uucf_predictions(userID, movieIDs))
+    # The N biggest distinct prediction values, from BIG to SMALL. In case of draw, keep the item with lowest ID:
     topN = []
-    for tuple in mysorted:
-        current_prediction_value = tuple[1]
-        if current_prediction_value in tmp:
-            continue
-        amount_items_with_same_prediction_value = len(prediction_itemids_dict[current_prediction_value])
-        if amount_items_with_same_prediction_value > 1:
-            lowest_id = min(prediction_itemids_dict[current_prediction_value])
-            topN.append((lowest_id, movies[str(lowest_id)]['title'], tuple[1]))
-        else:
-            topN.append((tuple[0], movies[str(tuple[0])]['title'], tuple[1]))
-        tmp.append(current_prediction_value)
-        if len(topN) == N:
-            break
+    for movieid, prediction in topn.top_n_distinct(rating_predictions, N):
+        topN.append((movieid, movies[str(movieid)]['title'], prediction))
     return topN
 
 
-def build_model_iicf(movies, ratings):
+def build_model_iicf(movies, ratings, block_size=itemmodel.BLOCK_SIZE, compact=True, k=IICF_NEIGHBORS,
+                     processes=IICF_PROCESSES, checkpoint_directory=IICF_CHECKPOINT_DIRECTORY):
     """
-    Builds the IICF model using cosine similarity
+    Builds the IICF model using cosine similarity.
+    All similarities are computed at once by sparse matrix products over blocks of items (see 'itemmodel.py'). The
+    model holds the same similarities as the one built by 'build_model_iicf_pairwise', just much faster. The blocks are
+    spread over a pool of processes and checkpointed, so an interrupted build resumes where it stopped when it's run
+    again with the same ratings.
+    :param movies: list of ALL movies
+    :param ratings: list of ALL ratings
+    :param block_size: number of items whose similarities are computed at once (bounds the memory needed)
+    :param compact: if True, the model is a compact 'itemmodel.SimilarityModel' (float64 similarities). Otherwise,
+    nested dictionaries like 'build_model_iicf_pairwise'.
+    :param k: if not None, only the k most similar positive (and negative) neighbors of every item are kept. Predictions
+    use 20 neighbors at most, so a small k shrinks the model by orders of magnitude (see 'itemmodel.pruning_report').
+    :param processes: number of worker processes. If None, one per CPU.
+    :param checkpoint_directory: directory of the checkpoints of the blocks, removed once the model is built. None means
+    no checkpoints.
+    :return: nothing
+    """
+    # The item -> raters index is built from the ratings if it's not available yet:
+    item_raters = globals.ITEM_RATERS
+    if item_raters is None:
+        item_raters = itemindex.build_item_raters(ratings)
+    itemIDs = [int(movie['id']) for movie in movies.values()]
+    if compact:
+        globals.IICF_MODEL = itemmodel.build_compact_model(item_raters, itemIDs, block_size, k=k, processes=processes,
+                                                           checkpoint_directory=checkpoint_directory)
+    else:
+        globals.IICF_MODEL = itemmodel.build_model(item_raters, itemIDs, block_size, k, processes, checkpoint_directory)
+    print "IICF model build!"
+
+
+def build_incremental_model_iicf(ratings, rebuild_every=IICF_REBUILD_EVERY, processes=IICF_PROCESSES,
+                                 max_mean_drift=IICF_MAX_MEAN_DRIFT):
+    """
+    Builds the IICF model (compact format) keeping the dot products and norms of the items, so new ratings only update
+    the similarities of the rated items (see 'add_ratings' and 'itemupdates.py').
+    :param ratings: list of ALL ratings
+    :param rebuild_every: number of new ratings after which the model is fully rebuilt, to reset the reference means
+    :param processes: number of worker processes of a full build. If None, one per CPU.
+    :param max_mean_drift: biggest difference (stars) allowed between the current and the reference mean of an item,
+    beyond it the model is fully rebuilt. None means no limit.
+    :return: nothing
+    """
+    globals.IICF_UPDATES = itemupdates.build_incremental_model(ratings, rebuild_every, processes=processes,
+                                                               max_mean_drift=max_mean_drift)
+    globals.IICF_MODEL = globals.IICF_UPDATES.model()
+    print "IICF model build!"
+
+
+def build_model_iicf_pairwise(movies, ratings):
+    """
+    Builds the IICF model using cosine similarity, one pair of items at a time (see 'compute_cosine_similarity').
     :param movies: list of ALL movies
     :param ratings: list of ALL ratings
     :return: nothing
@@ -422,6 +515,68 @@ def calculate_item_mean_centered_rating(ratings_by_users, avgRatingItem):
     return sum
 
 
+def iicf_similar_items(itemID, similarity_type=None):
+    """
+    Retrieves the items similar to 'itemID' in the IICF model, whatever the format of the model is: nested dictionaries
+    or compact (see 'itemmodel.SimilarityModel').
+    :param itemID: int number of the item
+    :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities. If None, the one in SIMILARITY_TYPE.
+    :return: list of tuples with the form: ("itemJid", "similarity value")
+    """
+    if globals.IICF_MODEL is None:
+        raise ValueError("[Error] IICF_MODEL is none! Cannot continue with the method!")
+    if similarity_type is None:
+        similarity_type = globals.SIMILARITY_TYPE.type()
+    if isinstance(globals.IICF_MODEL, itemmodel.SimilarityModel):
+        itemids, values = globals.IICF_MODEL.neighbors(itemID, similarity_type)
+        return zip(itemids.tolist(), values.tolist())
+    item_similarity_tuples = []
+    for sign, types in [(1, ["POSITIVE", "BOTH"]), (-1, ["NEGATIVE", "BOTH"])]:
+        if similarity_type in types and itemID in globals.IICF_MODEL[sign]:
+            item_similarity_tuples.extend(globals.IICF_MODEL[sign][itemID].items())
+    return item_similarity_tuples
+
+
+def iicf_similarity(itemID_i, itemID_j, similarity_type=None):
+    """
+    Retrieves the similarity between item i and item j in the IICF model, whatever the format of the model is.
+    :param itemID_i: int number of item i
+    :param itemID_j: int number of item j
+    :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities. If None, the one in SIMILARITY_TYPE.
+    :return: float number, 0.0 if the similarity is not in the model (or is not of the given type)
+    """
+    if globals.IICF_MODEL is None:
+        raise ValueError("[Error] IICF_MODEL is none! Cannot continue with the method!")
+    if similarity_type is None:
+        similarity_type = globals.SIMILARITY_TYPE.type()
+    if isinstance(globals.IICF_MODEL, itemmodel.SimilarityModel):
+        return globals.IICF_MODEL.similarity(itemID_i, itemID_j, similarity_type)
+    for sign, types in [(1, ["POSITIVE", "BOTH"]), (-1, ["NEGATIVE", "BOTH"])]:
+        if similarity_type in types and itemID_i in globals.IICF_MODEL[sign]:
+            if itemID_j in globals.IICF_MODEL[sign][itemID_i]:
+                return globals.IICF_MODEL[sign][itemID_i][itemID_j]
+    return 0.0
+
+
+def iicf_amount_items(similarity_type=None):
+    """
+    Computes how many items of the IICF model have at least one similar item of the given type.
+    :param similarity_type: "POSITIVE", "NEGATIVE" or "BOTH" similarities. If None, the one in SIMILARITY_TYPE.
+    :return: int number
+    """
+    if globals.IICF_MODEL is None:
+        raise ValueError("[Error] IICF_MODEL is none! Cannot continue with the method!")
+    if similarity_type is None:
+        similarity_type = globals.SIMILARITY_TYPE.type()
+    if isinstance(globals.IICF_MODEL, itemmodel.SimilarityModel):
+        return globals.IICF_MODEL.amount_items(similarity_type)
+    if similarity_type == "POSITIVE":
+        return len(globals.IICF_MODEL[1])
+    if similarity_type == "NEGATIVE":
+        return len(globals.IICF_MODEL[-1])
+    return len(set(globals.IICF_MODEL[1].keys()) | set(globals.IICF_MODEL[-1].keys()))
+
+
 def rating_prediction_item(itemID_i, userID, neighborsIDs=None):
     """
     Calculates the rating prediction for target user 'userID' and target item 'itemID_i'
@@ -469,26 +624,34 @@ def top_k_most_similar_items(userID, itemID, k=20):
     item_similarity_tuples = []
     # Firstly, we retrieve the item IDs of the items that the user rated. Top-k most similar items ensures that similar
     # items are actually rated by the user:
-    itemIDs_rated_by_user = globals.RATINGS_BY_USER_MAP[userID].keys()
-    # The model only contains positive similarity values, let's check if current itemID is in the model:
-    if itemID not in globals.IICF_MODEL[1] and itemID not in globals.IICF_MODEL[-1]:
-        return item_similarity_tuples
+    itemIDs_rated_by_user = globals.RATINGS_BY_USER_MAP[userID]
     # Secondly, we iterate over all positive AND/OR negative similar items of 'itemID' making sure the item was rated by current user:
     # The goal is to find the 'k' most similar items:
-    if globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.positive() or globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.both():
-        for itemid in globals.IICF_MODEL[1][itemID].keys():
-            if itemid in itemIDs_rated_by_user:
-                item_similarity_tuples.append((itemid, globals.IICF_MODEL[1][itemID][itemid]))
-    if globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.negative() or globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.both():
-        for itemid in globals.IICF_MODEL[-1][itemID].keys():
-            if itemid in itemIDs_rated_by_user:
-                item_similarity_tuples.append((itemid, globals.IICF_MODEL[-1][itemID][itemid]))
+    for itemid, similarity in iicf_similar_items(itemID):
+        if itemid in itemIDs_rated_by_user:
+            item_similarity_tuples.append((itemid, similarity))
     if len(item_similarity_tuples) == 0:
         return item_similarity_tuples
-    mysorted = sorted(item_similarity_tuples, key=operator.itemgetter(1, 0), reverse=True)  # tuples sorted from BIG to SMALL similarity value
     if globals.LOG_STATUS is True:
-        print "Len(mysorted) (# similar items found) = ", len(mysorted)
-    return mysorted[0:k]
+        print "Len(item_similarity_tuples) (# similar items found) = ", len(item_similarity_tuples)
+    return topn.top_n(item_similarity_tuples, k)  # tuples sorted from BIG to SMALL similarity value
+
+
+def iicf_predictions(userID, movieIDs):
+    """
+    Calculates the IICF rating predictions of a user for some items (see 'rating_prediction_item').
+    :param userID: int number of the user
+    :param movieIDs: list of ints of the items
+    :return: a list of floats aligned with the items, None if the user didn't rate any item similar to the item
+    """
+    predictions = []
+    for movieid in movieIDs:
+        most_similar_items_tuples = top_k_most_similar_items(userID, movieid)  # search for top k most similar items with current movie ID
+        if len(most_similar_items_tuples) != 0:
+            predictions.append(rating_prediction_item(movieid, userID, most_similar_items_tuples))  # perform the prediction
+        else:
+            predictions.append(None)
+    return predictions
 
 
 def topN_recommendations_iicf(userID, movies, N=10):
@@ -501,98 +664,339 @@ def topN_recommendations_iicf(userID, movies, N=10):
     """
     if globals.RATINGS_BY_USER_MAP is None:
         raise ValueError("[Error] RATINGS_BY_USER_MAP is none! Cannot continue with the method!")
-    # List of tuples with the form: ("itemJid", "similarity value"):
-    item_prediction_tuples = []
     # Firstly, we retrieve the item IDs of the items that the user rated. Top-N recommendations cannot recommend items
     # that have already been consumed.
-    itemIDs_rated_by_user = globals.RATINGS_BY_USER_MAP[userID].keys()
+    itemIDs_rated_by_user = globals.RATINGS_BY_USER_MAP[userID]
     allItems = [int(movie['id']) for movie in movies.values()]
-    for movieid in allItems:
-        # Skip item if already rated by user:
-        if movieid in itemIDs_rated_by_user:
-            continue
-        # print "movie id = ", movieid
-        most_similar_items_tuples = top_k_most_similar_items(userID, movieid)  # search for top k most similar items with current movie ID
-        if len(most_similar_items_tuples) != 0:
-            prediction = rating_prediction_item(movieid, userID, most_similar_items_tuples)  # perform the prediction
-            # print "\t| prediction = ", prediction
-            item_prediction_tuples.append((movieid, prediction))  # append the prediction to the final list (before sorting)
-    mysorted = sorted(item_prediction_tuples, key=operator.itemgetter(1, 0), reverse=True)  # tuples sorted from BIG to SMALL prediction value
+    movieIDs = [movieid for movieid in allItems if movieid not in itemIDs_rated_by_user]
+    # List of tuples with the form: ("itemJid", "prediction value"), only the items with a prediction:
+    item_prediction_tuples = [(movieid, prediction) for movieid, prediction in zip(movieIDs, iicf_predictions(userID, movieIDs))
+                              if prediction is not None]
     topN = []  # final TOP N list
-    for tuple in mysorted[0:N]:
+    for tuple in topn.top_n(item_prediction_tuples, N):  # tuples sorted from BIG to SMALL prediction value
         topN.append((tuple[0],movies[str(tuple[0])]['title'],tuple[1]))
     return topN
 
 
-def topN_recommendations_basket(basket, movies, N=10):
+def movie_ids(movies):
+    """
+    Retrieves the IDs of all movies as a sorted array. It's built once per dictionary of movies and kept in MOVIE_IDS.
+    :param movies: a list of ALL movies
+    :return: an array of ints
+    """
+    if globals.MOVIE_IDS is None or globals.MOVIE_IDS[0] is not movies or len(globals.MOVIE_IDS[1]) != len(movies):
+        movieids = np.fromiter((int(movie['id']) for movie in movies.values()), dtype=np.int64, count=len(movies))
+        globals.MOVIE_IDS = (movies, np.sort(movieids))
+    return globals.MOVIE_IDS[1]
+
+
+def topN_recommendations_basket(basket, movies, N=10, weights=None):
     """
     Top N list of recommendations based on the item(s) in the basket.
     If shopping basket contains only 1 item, the recommendations are the most similar items.
     If multiple items in the basket, score for target item is calculated as the sum of similarities between
     target item and all items in the basket.
+    With a compact model (see 'itemmodel.SimilarityModel'), the scores of all items come out of the sum of the columns
+    of the basket items in the similarity matrix at once (see 'itemmodel.SimilarityModel.basket_scores').
     :param basket: list of ints of item IDs in the basket
     :param movies: list of ALL movies
     :param N: int number of items to recommend
+    :param weights: list of floats, the weight of every item in the basket (multiplies its similarities). If None, all
+    items weigh 1.
     :return: a list containing tuples corresponding to the TOP-N recommended items with the form ("item id, title, prediction value")
     """
     if globals.SIMILARITY_TYPE is None:
         raise ValueError("[Error] SIMILARITY_TYPE is none! Cannot continue with the method!")
     if globals.IICF_MODEL is None:
         raise ValueError("[Error] IICF_MODEL is none! Cannot continue with the method!")
+    if weights is not None and len(weights) != len(basket):
+        raise ValueError("[Error] The basket has %d items but %d weights! Cannot continue with the method!" % (len(basket), len(weights)))
+    if weights is None:
+        weights = [1.0] * len(basket)
+    similarity_type = globals.SIMILARITY_TYPE.type()
+    if isinstance(globals.IICF_MODEL, itemmodel.SimilarityModel):
+        if len(basket) == 1:
+            # POSITIVE AND/OR NEGATIVE similar items (the model holds no similarity of an item with itself):
+            movieids, scores = globals.IICF_MODEL.neighbors(basket[0], similarity_type)
+            scores = scores.astype(np.float64) * weights[0]
+        elif len(basket) > 1:
+            # Every movie is a candidate, the ones outside of the model score 0:
+            movieids = movie_ids(movies)
+            scores = np.zeros(len(movieids))
+            rows = np.searchsorted(movieids, globals.IICF_MODEL.itemids)
+            inside = rows < len(movieids)
+            inside[inside] = movieids[rows[inside]] == globals.IICF_MODEL.itemids[inside]
+            scores[rows[inside]] = globals.IICF_MODEL.basket_scores(basket, weights, similarity_type)[inside]
+        else:
+            return []
+        topN = []  # final TOP N list
+        for position in topn.top_positions(scores, movieids, N):  # sorted from BIG to SMALL score value
+            topN.append((int(movieids[position]), movies[str(movieids[position])]['title'], float(scores[position])))
+        return topN
     score_target_items = []  # a list of tuples with the form ('itemID', 'score')
     if len(basket) == 1:
-        if globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.positive() or globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.both():  # POSITIVE similarities (or BOTH)
-            for movieid in globals.IICF_MODEL[1][basket[0]].keys():
-                # Skip cosine similarity with itself:
-                if movieid == basket[0]:
-                    continue
-                score_target_items.append((movieid, globals.IICF_MODEL[1][basket[0]][movieid]))
-        if globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.negative() or globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.both():  # NEGATIVE similarities (or BOTH)
-            for movieid in globals.IICF_MODEL[-1][basket[0]].keys():
-                # Skip cosine similarity with itself:
-                if movieid == basket[0]:
-                    continue
-                score_target_items.append((movieid, globals.IICF_MODEL[-1][basket[0]][movieid]))
+        # POSITIVE AND/OR NEGATIVE similarities (depending on SIMILARITY_TYPE):
+        for movieid, similarity in iicf_similar_items(basket[0], similarity_type):
+            # Skip cosine similarity with itself:
+            if movieid == basket[0]:
+                continue
+            score_target_items.append((movieid, similarity * weights[0]))
     elif len(basket) > 1:
         allItems = [int(movie['id']) for movie in movies.values()]
         for movieid in allItems:
             score = 0.0
-            for j in basket:
-                if globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.positive() or globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.both():  # POSITIVE similarities (or BOTH)
-                    if movieid != j and movieid in globals.IICF_MODEL[1]:  # Skip cosine similarity with itself
-                        if j in globals.IICF_MODEL[1][movieid]:
-                            score = score + globals.IICF_MODEL[1][movieid][j]
-                if globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.negative() or globals.SIMILARITY_TYPE.type() == globals.SIMILARITY_TYPE.both():  # NEGATIVE similarities (or BOTH)
-                    if movieid != j and movieid in globals.IICF_MODEL[-1]:  # Skip cosine similarity with itself
-                        if j in globals.IICF_MODEL[-1][movieid]:
-                            score = score + globals.IICF_MODEL[-1][movieid][j]
+            for j, weight in zip(basket, weights):
+                if movieid != j:  # Skip cosine similarity with itself
+                    score = score + weight * iicf_similarity(movieid, j, similarity_type)
             score_target_items.append((movieid, score))
-    mysorted = sorted(score_target_items, key=operator.itemgetter(1, 0), reverse=True)  # tuples sorted from BIG to SMALL score value
     topN = []  # final TOP N list
-    for tuple in mysorted[0:N]:
+    for tuple in topn.top_n(score_target_items, N):  # tuples sorted from BIG to SMALL score value
         topN.append((tuple[0], movies[str(tuple[0])]['title'], tuple[1]))
     return topN
 
 
-def topN_recommendations_hybrid(userID, movies, weight_uucf=0.5, weight_iicf=0.5, N=10):
+def topN_recommendations_batch(userIDs, movies, recommender="uucf", N=10, chunk_size=batchrecommend.CHUNK_SIZE):
+    """
+    Top N lists of recommendations for many users at once (e.g. for all users). The predictions of a chunk of users are
+    computed by sparse matrix products (see 'batchrecommend.py'). The lists are the same as the ones of
+    'topN_recommendations_uucf' (with the exact similarity profiles, see 'similarity_profile') and
+    'topN_recommendations_iicf'.
+    :param userIDs: list of ints of the users
+    :param movies: a list of ALL movies
+    :param recommender: "uucf" or "iicf"
+    :param N: number of recommended items
+    :param chunk_size: number of users scored at once
+    :return: a dictionary with "Key=userID" and "Value=a list containing tuples corresponding to the TOP-N recommended
+    items with the form ('item id, title, prediction value')"
+    """
+    if globals.RATINGS_BY_USER_MAP is None:
+        raise ValueError("[Error] RATINGS_BY_USER_MAP is none! Cannot continue with the method!")
+    allItems = [int(movie['id']) for movie in movies.values()]
+    if recommender == "uucf":
+        if globals.USER_SIMILARITY is None:
+            raise ValueError("[Error] USER_SIMILARITY is none! Cannot continue with the method!")
+        recommendations = batchrecommend.top_n_uucf(globals.USER_SIMILARITY, globals.RATINGS_BY_USER_MAP, userIDs,
+                                                    allItems, N, chunk_size)
+    elif recommender == "iicf":
+        if globals.IICF_MODEL is None:
+            raise ValueError("[Error] IICF_MODEL is none! Cannot continue with the method!")
+        if globals.SIMILARITY_TYPE is None:
+            raise ValueError("[Error] SIMILARITY_TYPE is none! Cannot continue with the method!")
+        model = globals.IICF_MODEL
+        if not isinstance(model, itemmodel.SimilarityModel):
+            model = itemmodel.from_nested_model(model)
+        recommendations = batchrecommend.top_n_iicf(model, globals.RATINGS_BY_USER_MAP, userIDs, allItems, N,
+                                                    globals.SIMILARITY_TYPE.type(), chunk_size)
+    else:
+        raise ValueError("[Error] Unknown recommender '%s' (expected 'uucf' or 'iicf')! Cannot continue with the method!" % recommender)
+    topN = {}
+    for userID, items in recommendations.items():
+        topN[userID] = [(movieid, movies[str(movieid)]['title'], prediction) for movieid, prediction in items]
+    return topN
+
+
+def batch_report(userIDs, movies, recommender="iicf", N=10):
+    """
+    Compares the batch top N lists (see 'topN_recommendations_batch') against the per-user ones for a sample of users.
+    :param userIDs: list of ints of the users of the sample
+    :param movies: a list of ALL movies
+    :param recommender: "uucf" or "iicf"
+    :param N: number of recommended items
+    :return: a dictionary with the amount of users ('users'), the amount of users with the very same list ('identical'),
+    the mean fraction of items both lists share ('overlap') and the users whose lists differ ('different')
+    """
+    if recommender not in ["uucf", "iicf"]:
+        raise ValueError("[Error] Unknown recommender '%s' (expected 'uucf' or 'iicf')! Cannot continue with the method!" % recommender)
+    batch = topN_recommendations_batch(userIDs, movies, recommender, N)
+    different = []
+    overlaps = []
+    for userID in userIDs:
+        if recommender == "uucf":
+            per_user = topN_recommendations_uucf(userID, movies, N)
+        else:
+            per_user = topN_recommendations_iicf(userID, movies, N)
+        if batch[userID] != per_user:
+            different.append(userID)
+        shared = set(item[0] for item in batch[userID]) & set(item[0] for item in per_user)
+        overlaps.append(len(shared) / float(max(len(per_user), 1)))
+    return {'users': len(userIDs), 'identical': len(userIDs) - len(different),
+            'overlap': float(np.mean(overlaps)) if len(overlaps) > 0 else 0.0, 'different': different}
+
+
+def hybrid_data():
+    """
+    Collects the data read by the UUCF and IICF predictions. Forked workers keep the data they were forked with, so
+    the objects themselves are kept to tell whether the workers are up to date (see 'hybrid_pool').
+    :return: a tuple with the objects AND a tuple with the settings
+    """
+    similarity_type = None if globals.SIMILARITY_TYPE is None else globals.SIMILARITY_TYPE.type()
+    return ((globals.RATINGS_BY_USER, globals.RATINGS_BY_USER_MAP, globals.USER_STATISTICS, globals.USER_SIMILARITY,
+             globals.USER_INDEX, globals.ITEM_RATERS, globals.MEAN_RATINGS_ITEM, globals.IICF_MODEL),
+            (similarity_type, globals.LOG_STATUS))
+
+
+def hybrid_pool(concurrency):
+    """
+    Retrieves the two workers of the hybrid recommender. The pool is created the first time and reused across
+    requests, so are the similarity profiles cached by the workers. A pool of processes is created again when the
+    data changed since its workers were forked: another object or setting (see 'hybrid_data') or new ratings (see
+    'add_ratings'). The pool is stopped at exit.
+    :param concurrency: "process" (forked workers, which see the loaded data) or "thread"
+    :return: a multiprocessing pool
+    """
+    objects, settings = hybrid_data()
+    if globals.HYBRID_POOL is not None:
+        pool_concurrency, (pool_objects, pool_settings), pool = globals.HYBRID_POOL
+        if pool_concurrency == concurrency and (concurrency == "thread" or (
+                pool_settings == settings and all(old is new for old, new in zip(pool_objects, objects)))):
+            return pool
+        close_hybrid_pool()
+    pool = multiprocessing.Pool(2) if concurrency == "process" else multiprocessing.pool.ThreadPool(2)
+    globals.HYBRID_POOL = (concurrency, (objects, settings), pool)
+    return pool
+
+
+def close_hybrid_pool():
+    """
+    Stops the workers of the hybrid recommender, if any (see 'hybrid_pool').
+    :return: nothing
+    """
+    if globals.HYBRID_POOL is not None:
+        globals.HYBRID_POOL[2].terminate()
+        globals.HYBRID_POOL = None
+
+
+atexit.register(close_hybrid_pool)
+
+
+def topN_recommendations_hybrid(userID, movies, weight_uucf=0.5, weight_iicf=0.5, N=10, concurrency=HYBRID_CONCURRENCY):
     """
     Combines two recommenders: UUCF and IICF. Both with equal weights by default: 50%
+    Both recommenders predict the ratings of the same candidates (all items the user didn't rate) at the same time, in
+    two worker processes (or threads, see 'hybrid_pool'), and the hybrid score of every candidate is the weighted sum of both predictions.
+    Items without an IICF prediction (the user didn't rate any similar item) have no hybrid score and are left out. In
+    case of a tie, the item with the higher ID is ranked first.
     :param userID: int number of the user to whom the recommendations are calculated
+    :param movies: a list of ALL movies
     :param weight_uucf: float number of the weight for this recommender
     :param weight_iicf: float number of the weight for this recommender
     :param N: int number of items to recommend
+    :param concurrency: "process" (forked workers, which see the loaded data), "thread" or None (one after the other)
     :return: a list containing tuples corresponding to the TOP-N recommended items with the form ("item id, title, prediction value")
     """
-    topn_uucf = topN_recommendations_uucf(userID, movies, 1000) # returns top-N recommended items with the form ("item id, title, prediction value")
-    topn_iicf = topN_recommendations_iicf(userID, movies, 1000) # returns top-N recommended items with the form ("item id, title, prediction value")
-    # List of tuples with the form: ("item id, title, prediction value for iicf, prediction value for uucf"):
-    merge = [(tuple1[0], tuple1[1], tuple1[2], tuple2[2]) for tuple1 in topn_iicf for tuple2 in topn_uucf if tuple1[0]==tuple2[0]]
+    if globals.RATINGS_BY_USER_MAP is None:
+        raise ValueError("[Error] RATINGS_BY_USER_MAP is none! Cannot continue with the method!")
+    itemids_user = globals.RATINGS_BY_USER_MAP[userID]
+    candidates = [movieid for movieid in movie_ids(movies).tolist() if movieid not in itemids_user]
+    if concurrency is None:
+        predictions_uucf = uucf_predictions(userID, candidates)
+        predictions_iicf = iicf_predictions(userID, candidates)
+    elif concurrency in ["process", "thread"]:
+        pool = hybrid_pool(concurrency)
+        result_uucf = pool.apply_async(uucf_predictions, (userID, candidates))
+        result_iicf = pool.apply_async(iicf_predictions, (userID, candidates))
+        predictions_uucf = result_uucf.get()
+        predictions_iicf = result_iicf.get()
+    else:
+        raise ValueError("[Error] Unknown concurrency '%s' (expected 'process', 'thread' or None)! Cannot continue with the method!" % concurrency)
+    # Score vectors aligned with the candidates:
+    predictions_uucf = np.array(predictions_uucf, dtype=np.float64)
+    predictions_iicf = np.array([np.nan if prediction is None else prediction for prediction in predictions_iicf], dtype=np.float64)
+    scored = ~np.isnan(predictions_iicf)
+    scores = weight_uucf * predictions_uucf[scored] + weight_iicf * predictions_iicf[scored]
+    candidates = np.array(candidates, dtype=np.int64)[scored]
     topn_hybrid = []
-    for tuple in merge:
-        prediction_hybrid = tuple[2]*weight_iicf + tuple[3]*weight_uucf
-        topn_hybrid.append((tuple[0], tuple[1], prediction_hybrid))
-    topn_hybrid = sorted(topn_hybrid, key=operator.itemgetter(2), reverse=True)
-    return topn_hybrid[0:N]
+    for position in topn.top_positions(scores, candidates, N):  # sorted from BIG to SMALL hybrid score
+        topn_hybrid.append((int(candidates[position]), movies[str(candidates[position])]['title'], float(scores[position])))
+    return topn_hybrid
+
+
+def topN_trending_movies(window="week", movies=None, N=10):
+    """
+    Top N list of the most rated items within the last time window (with respect to the newest rating).
+    In case of a tie, the item with the higher ID is ranked before the item with lower ID.
+    :param window: name of the time window: "day", "week" or "month"
+    :param movies: a list of ALL movies
+    :param N: int number of items to recommend
+    :return: a list containing tuples corresponding to the TOP-N trending items with the form ("item id, title, amount of ratings")
+    """
+    if movies is None:
+        raise ValueError("[Error] movies is none! Cannot continue with the method!")
+    if globals.TRENDING is None:
+        raise ValueError("[Error] TRENDING is none! Cannot continue with the method!")
+    topN = []  # final TOP N list
+    for movieid, amount in globals.TRENDING.top_movies(window, N):
+        topN.append((movieid, movies[str(movieid)]['title'], amount))
+    return topN
+
+
+def add_ratings(new_ratings):
+    """
+    Adds new ratings to the data structures of UUCF and IICF, so they stay consistent with each other: the ratings by
+    user, the user statistics store, the trending counter, the item -> raters index, the similarity engine (only the
+    rows of the users who rated) and, if it's incremental, the IICF model and the mean ratings of the rated items.
+    A rating of an item the user already rated replaces the old one everywhere.
+    :param new_ratings: list of rating objects (dictionaries with 'userid', 'movieid', 'rating' and 'timestamp')
+    :return: nothing
+    """
+    if globals.RATINGS_BY_USER is None:
+        raise ValueError("[Error] RATINGS_BY_USER is none! Cannot continue with the method!")
+    replaced_users = []  # users of the replaced ratings
+    replaced_stars = []  # old rating (stars) of the replaced ratings
+    for rating in new_ratings:
+        if rating['userid'] not in globals.RATINGS_BY_USER:
+            globals.RATINGS_BY_USER[rating['userid']] = []
+        ratings_user = globals.RATINGS_BY_USER[rating['userid']]
+        position = None
+        if globals.RATINGS_BY_USER_MAP is None or rating['movieid'] in globals.RATINGS_BY_USER_MAP.get(rating['userid'], {}):
+            position = next((position for position, old_rating in enumerate(ratings_user)
+                             if old_rating['movieid'] == rating['movieid']), None)
+        if position is None:
+            ratings_user.append(rating)
+        else:
+            replaced_users.append(rating['userid'])
+            replaced_stars.append(ratings_user[position]['rating'])
+            ratings_user[position] = rating
+        if globals.RATINGS_BY_USER_MAP is not None:
+            if rating['userid'] not in globals.RATINGS_BY_USER_MAP:
+                globals.RATINGS_BY_USER_MAP[rating['userid']] = {}
+            globals.RATINGS_BY_USER_MAP[rating['userid']][rating['movieid']] = rating['rating']
+    # The similarity engine reads the means and norms of the users from its statistics store:
+    stores = [store for store in [globals.USER_STATISTICS] if store is not None]
+    if globals.USER_SIMILARITY is not None and globals.USER_SIMILARITY.statistics is not globals.USER_STATISTICS:
+        stores.append(globals.USER_SIMILARITY.statistics)
+    for store in stores:
+        # All new ratings are added, then the replaced ones are taken out:
+        store.add_ratings([rating['userid'] for rating in new_ratings], [rating['rating'] for rating in new_ratings])
+        store.remove_ratings(replaced_users, replaced_stars)
+    if globals.TRENDING is not None:
+        globals.TRENDING.add_ratings([rating['movieid'] for rating in new_ratings],
+                                     [rating['timestamp'] for rating in new_ratings])
+    if globals.ITEM_RATERS is not None:
+        changed = globals.ITEM_RATERS.add_ratings([rating['userid'] for rating in new_ratings],
+                                                  [rating['movieid'] for rating in new_ratings],
+                                                  [rating['rating'] for rating in new_ratings])
+        if globals.MEAN_RATINGS_ITEM is not None:
+            globals.MEAN_RATINGS_ITEM.update(globals.ITEM_RATERS.mean_ratings(changed))
+    if globals.USER_SIMILARITY is not None:
+        # The means of the users who rated changed, so their mean-centered rows are built again (cached profiles are
+        # dropped):
+        userIDs = set(rating['userid'] for rating in new_ratings)
+        globals.USER_SIMILARITY.update_users(dict((userID, globals.RATINGS_BY_USER[userID]) for userID in userIDs))
+        if globals.USER_INDEX is not None:
+            # Only the same users are hashed again:
+            globals.USER_INDEX.update_rows([globals.USER_SIMILARITY.index_of(userID) for userID in userIDs])
+    if globals.IICF_UPDATES is not None:
+        # Only the dot products and norms of the rated items are updated (see 'itemupdates.py'):
+        changed = globals.IICF_UPDATES.add_ratings([rating['userid'] for rating in new_ratings],
+                                                   [rating['movieid'] for rating in new_ratings],
+                                                   [rating['rating'] for rating in new_ratings])
+        globals.IICF_MODEL = globals.IICF_UPDATES.model()
+        if globals.MEAN_RATINGS_ITEM is not None:
+            globals.MEAN_RATINGS_ITEM.update(globals.IICF_UPDATES.mean_ratings(changed))
+    # The workers of the hybrid recommender were forked with the old ratings (see 'hybrid_pool'):
+    close_hybrid_pool()
+
 
 def main():
     # Load data and parse it:
@@ -610,11 +1014,18 @@ def main():
     # Setting some global variables and general information:
     globals.RATINGS_BY_USER = utils.extract_ratings_by_users(ratings_pkl)
     globals.RATINGS_BY_USER_MAP = utils.extract_ratings_by_users_map(ratings_pkl)
+    globals.USER_STATISTICS = userstats.build_user_statistics(ratings_pkl)
+    # The item -> raters index and the mean rating of every item are built in a single pass over the ratings:
+    globals.ITEM_RATERS = itemindex.build_item_raters(ratings_pkl)
     globals.RATINGS_X_BY_USERS = utils.extract_ratings_x_by_users(movies_pkl, ratings_pkl)
-    globals.MEAN_RATINGS_ITEM = utils.extract_mean_ratings(movies_pkl)
-    # globals.RATINGS_X_BY_USERS = data.load_pickle(RATINGS_X_BY_USERS_PATH)  # Loading the pickle is faster than calculating it in run-time
-    # globals.MEAN_RATINGS_ITEM = data.load_pickle(MEAN_RATINGS_ITEM_PATH)  # Loading the pickle is faster than calculating it in run-time
+    globals.MEAN_RATINGS_ITEM = globals.ITEM_RATERS.mean_ratings([int(movie['id']) for movie in movies_pkl.values()])
     globals.SIMILARITY_TYPE = globals.SimilarityType()
+    globals.TRENDING = trending.build_trending_counter(ratings_pkl)
+    # The similarity engine reads the means and norms of the users from the statistics store:
+    globals.USER_SIMILARITY = usersimilarity.build_user_similarity(ratings_pkl, CUT_OFF, SIMILARITY_CACHE_SIZE,
+                                                                   globals.USER_STATISTICS)
+    # Approximate UUCF neighbors (check the recall first, see 'userindex.recall_report'):
+    # globals.USER_INDEX = userindex.build_user_index(globals.USER_SIMILARITY, USER_INDEX_TABLES, USER_INDEX_BITS, USER_INDEX_PROBE)
     print "len(RATINGS_BY_USER): ", len(globals.RATINGS_BY_USER)
     print "len(RATINGS_BY_USER_MAP): ", len(globals.RATINGS_BY_USER_MAP)
     print "len(RATINGS_X_BY_USERS): ", len(globals.RATINGS_X_BY_USERS)
@@ -625,8 +1036,8 @@ def main():
     # data.dump_pickle(globals.MEAN_RATINGS_ITEM, data.generate_file_name("MEAN_RATINGS_ITEM", "pkl"))
     # Build IICF model:
     # build_model_iicf(movies_pkl, ratings_pkl)
-    # Dump the IICF model to pickle into file system (just for the first time):
-    # data.dump_pickle(globals.IICF_MODEL, data.generate_file_name("IICF-model", "pkl"))
+    # Save the (compact) IICF model into file system (just for the first time):
+    # globals.IICF_MODEL.save(IICF_MODEL_DIRECTORY)
 
     # Question 1:
     print "Question 1: Pearson correlation (without significance weighting) user 1 and 4."
@@ -691,11 +1102,13 @@ def main():
         print "\t| ({0},{1},{2})".format(item[0], item[1], item[2])
     # Question 19:
     print "Question 19: IICF model. Strict positive similarities."
-    globals.IICF_MODEL = data.load_pickle(IICF_MODEL_NAME)  # load the IICF model
-    print "\t| Result = ", len(globals.IICF_MODEL[1])
+    # globals.IICF_MODEL = data.load_pickle(IICF_MODEL_NAME)  # load the IICF model (nested dictionaries)
+    # Load the compact IICF model (memory-mapped):
+    globals.IICF_MODEL = itemmodel.load_model(IICF_MODEL_DIRECTORY)
+    print "\t| Result = ", iicf_amount_items(globals.SIMILARITY_TYPE.positive())
     # Question 20:
     print "Question 20: Cosine similarity between items 594 and 596."
-    sim = globals.IICF_MODEL[1][594][596]
+    sim = iicf_similarity(594, 596, globals.SIMILARITY_TYPE.positive())
     print "\t| Similarity = ", sim
     print "\t| Movie 594 =", movies_pkl['594']['title']
     print "\t| Movie 596 =", movies_pkl['596']['title']
@@ -757,10 +1170,11 @@ def test():
     print "len(ratings_pkl): ", len(ratings_pkl)
     globals.RATINGS_BY_USER = utils.extract_ratings_by_users(ratings_pkl)
     globals.RATINGS_BY_USER_MAP = utils.extract_ratings_by_users_map(ratings_pkl)
-    # globals.RATINGS_X_BY_USERS = utils.extract_ratings_x_by_users(movies_pkl, ratings_pkl)
-    # globals.MEAN_RATINGS_ITEM = utils.extract_mean_ratings(movies_pkl)
-    globals.RATINGS_X_BY_USERS = data.load_pickle(RATINGS_X_BY_USERS_PATH)  # load pickle
-    globals.MEAN_RATINGS_ITEM = data.load_pickle(MEAN_RATINGS_ITEM_PATH)  # load pickle
+    globals.ITEM_RATERS = itemindex.build_item_raters(ratings_pkl)
+    globals.RATINGS_X_BY_USERS = utils.extract_ratings_x_by_users(movies_pkl, ratings_pkl)
+    globals.MEAN_RATINGS_ITEM = globals.ITEM_RATERS.mean_ratings([int(movie['id']) for movie in movies_pkl.values()])
+    # globals.RATINGS_X_BY_USERS = data.load_pickle(RATINGS_X_BY_USERS_PATH)  # load pickle
+    # globals.MEAN_RATINGS_ITEM = data.load_pickle(MEAN_RATINGS_ITEM_PATH)  # load pickle
     globals.SIMILARITY_TYPE = globals.SimilarityType()
     print "len(RATINGS_BY_USER): ", len(globals.RATINGS_BY_USER)
     print "len(RATINGS_BY_USER_MAP): ", len(globals.RATINGS_BY_USER_MAP)
@@ -0,0 +1,80 @@
+"""
+This file holds the selection of the top N (or top k) elements shared by all personalized recommenders. None of them
+sorts the whole list of candidates: lists of tuples go through a bounded heap and arrays through a partition, and only
+the few selected elements are sorted. The rules to break ties are the ones the recommenders always had:
+    - 'top_n' and 'top_positions': sorted from BIG to SMALL value. In case of a tie, the higher ID first (like
+      'sorted(..., key=operator.itemgetter(1, 0), reverse=True)'). Used by IICF, the basket and the most similar items.
+    - 'top_n_distinct' and 'top_distinct_positions': only one element per value, the one with the LOWEST ID, sorted
+      from BIG to SMALL value. Used by UUCF and the most similar neighbors.
+"""
+
+import heapq
+import operator
+import numpy as np
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+
+def top_n(pairs, N):
+    """
+    Selects the N pairs with the biggest value. In case of a tie, the pair with the higher ID is ranked first.
+    :param pairs: iterable of tuples with the form ("id", "value")
+    :param N: number of pairs to select
+    :return: a list of tuples with the form ("id", "value"), sorted from BIG to SMALL value
+    """
+    return heapq.nlargest(N, pairs, key=operator.itemgetter(1, 0))
+
+
+def top_n_distinct(pairs, N):
+    """
+    Selects the pairs with the N biggest distinct values. For every value, only the pair with the lowest ID is kept,
+    which is tracked in a dictionary while going over the pairs once.
+    :param pairs: iterable of tuples with the form ("id", "value")
+    :param N: number of pairs to select
+    :return: a list of tuples with the form ("id", "value"), sorted from BIG to SMALL value
+    """
+    lowest_ids = {}  # dictionary with "Key=value" and "Value=lowest ID with that value"
+    for pairid, value in pairs:
+        if value not in lowest_ids or pairid < lowest_ids[value]:
+            lowest_ids[value] = pairid
+    return [(pairid, value) for value, pairid in heapq.nlargest(N, lowest_ids.items())]
+
+
+def top_positions(values, ids, k):
+    """
+    Retrieves the positions of the k biggest values, sorted from BIG to SMALL value. In case of a tie, the one with the
+    higher ID is ranked first. Only the values tied with (or above) the k-th biggest value are sorted.
+    :param values: array of values
+    :param ids: array of IDs aligned with the values
+    :param k: number of positions to retrieve
+    :return: array of positions
+    """
+    candidates = np.arange(len(values))
+    if k < len(values):
+        kth_value = np.partition(values, len(values) - k)[len(values) - k]
+        candidates = np.flatnonzero(values >= kth_value)
+    order = np.lexsort((ids[candidates], values[candidates]))[::-1][:k]
+    return candidates[order]
+
+
+def top_distinct_positions(values, ids, k):
+    """
+    Retrieves the positions of the k biggest distinct values, sorted from BIG to SMALL value. For every value, only the
+    position with the lowest ID is kept. Only the values from the k-th biggest value onwards are sorted, unless there
+    are not k distinct values among them.
+    :param values: array of values
+    :param ids: array of IDs aligned with the values
+    :param k: number of positions to retrieve
+    :return: array of positions
+    """
+    candidates = np.arange(len(values))
+    if k < len(values):
+        kth_value = np.partition(values, len(values) - k)[len(values) - k]
+        above = np.flatnonzero(values >= kth_value)
+        if len(np.unique(values[above])) >= k:
+            candidates = above
+    order = candidates[np.lexsort((ids[candidates], -values[candidates]))]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = values[order][1:] != values[order][:-1]
+    return order[first][:k]
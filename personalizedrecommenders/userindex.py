@@ -0,0 +1,201 @@
+"""
+This file holds an approximate nearest neighbor index of the users for UUCF, so the similarities of a user are not
+computed against ALL users. The users are hashed with random-projection LSH (Locality-Sensitive Hashing) over their
+mean-centered rating vectors: every bit of the hash is the sign of the projection of the vector on a random direction,
+so two users get the same bit with probability 1 - angle / pi. Since the sign doesn't depend on the length of the
+vector, hashing the centered vectors is the same as hashing the normalized ones, and the angle is the one of the
+Pearson correlation (see 'usersimilarity.py'). The bits are grouped in several tables: users sharing the bucket of the
+target user in at least one table are the candidate neighbors (optionally, the buckets at one bit of distance are
+probed as well). The candidates are then scored exactly, Pearson correlation with significance weighting, and the
+rest of the users get a similarity of 0 (so they are never neighbors).
+More tables (or probing) raise the recall, more bits per table lower the amount of candidates. See 'recall_report' to
+choose them against the exact similarities.
+When new ratings arrive, only the users who rated are hashed again and merged into the sorted tables (see
+'update_rows'), so a batch of ratings doesn't cost a pass over all users' ratings.
+"""
+
+import time
+import numpy as np
+import topn
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+
+class UserLSHIndex:
+    """
+    LSH index over the users of a similarity engine. Rows are aligned with the users of the engine.
+    """
+
+    def __init__(self, engine, tables=8, bits=6, probe=True, seed=0):
+        """
+        Hashes all users of the engine.
+        :param engine: a UserSimilarity object (see 'usersimilarity.py')
+        :param tables: number of hash tables
+        :param bits: number of bits of the hash of every table
+        :param probe: if True, the buckets at one bit of distance of the user's bucket are candidates as well
+        :param seed: seed of the random directions
+        """
+        self.engine = engine
+        self.tables = tables
+        self.bits = bits
+        self.probe = probe
+        self.seed = seed
+        self.random = np.random.RandomState(seed)
+        self.itemids = engine.itemids  # items of the rows of 'directions'
+        self.directions = self.random.standard_normal((len(engine.itemids), tables * bits))
+        self.codes = self.hash(engine.centered)
+        # The users of every table sorted by hash code, so a bucket is a range found by binary search:
+        self.order = np.argsort(self.codes, axis=0, kind='mergesort')
+        self.sorted_codes = np.sort(self.codes, axis=0)
+
+    def hash(self, vectors):
+        """
+        Computes the hash codes of some vectors.
+        :param vectors: a user x item matrix (csr) of mean-centered ratings
+        :return: an array (vector x table) of int hash codes
+        """
+        signs = vectors.dot(self.directions) > 0.0
+        signs = signs.reshape(vectors.shape[0], self.tables, self.bits)
+        return signs.astype(np.int64).dot(1 << np.arange(self.bits, dtype=np.int64))
+
+    def update_rows(self, rows):
+        """
+        Hashes again the users of some rows of the engine (e.g. the users who rated something new, see
+        'usersimilarity.UserSimilarity.update_users') and moves them to their place in the sorted tables. The other
+        users keep their codes: new items get new random directions, and only the users who rated them have a
+        non-zero value on them. New users (rows at the end of the engine) are added.
+        :param rows: array of rows of the engine
+        :return: nothing
+        """
+        engine = self.engine
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if len(engine.itemids) > len(self.itemids):
+            directions = np.empty((len(engine.itemids), self.tables * self.bits))
+            old = np.searchsorted(engine.itemids, self.itemids)
+            new = np.setdiff1d(np.arange(len(engine.itemids)), old)
+            directions[old] = self.directions
+            directions[new] = self.random.standard_normal((len(new), self.tables * self.bits))
+            self.itemids = engine.itemids
+            self.directions = directions
+        if len(engine.userids) > len(self.codes):
+            self.codes = np.concatenate([self.codes, np.zeros((len(engine.userids) - len(self.codes), self.tables),
+                                                              dtype=self.codes.dtype)])
+        if len(rows) == 0:
+            return
+        self.codes[rows] = self.hash(engine.centered[rows])
+        updating = np.zeros(len(self.codes), dtype=bool)
+        updating[rows] = True
+        order = np.empty((len(self.codes), self.tables), dtype=self.order.dtype)
+        sorted_codes = np.empty((len(self.codes), self.tables), dtype=self.codes.dtype)
+        for table in range(self.tables):
+            # The other users stay sorted by code and row (like a stable sort), the updated ones are merged in:
+            keep = ~updating[self.order[:, table]]
+            kept = self.order[keep, table]
+            kept_keys = self.sorted_codes[keep, table] * len(self.codes) + kept
+            keys = self.codes[rows, table] * len(self.codes) + rows
+            moved = np.argsort(keys, kind='mergesort')
+            positions = np.searchsorted(kept_keys, keys[moved])
+            order[:, table] = np.insert(kept, positions, rows[moved])
+            sorted_codes[:, table] = np.insert(self.sorted_codes[keep, table], positions,
+                                               self.codes[rows[moved], table])
+        self.order = order
+        self.sorted_codes = sorted_codes
+
+    def candidates(self, userID):
+        """
+        Retrieves the candidate neighbors of a user: the users sharing a bucket with her/him in at least one table.
+        :param userID: int number of the user
+        :return: sorted array of rows of the engine (the user her/himself included), empty if the user is not indexed
+        """
+        row = self.engine.index_of(userID)
+        if row == -1:
+            return np.zeros(0, dtype=np.int64)
+        rows = []
+        for table in range(self.tables):
+            codes = [self.codes[row, table]]
+            if self.probe:
+                codes.extend(self.codes[row, table] ^ (1 << bit) for bit in range(self.bits))
+            for code in codes:
+                start = np.searchsorted(self.sorted_codes[:, table], code, side='left')
+                end = np.searchsorted(self.sorted_codes[:, table], code, side='right')
+                rows.append(self.order[start:end, table])
+        return np.unique(np.concatenate(rows))
+
+    def profile(self, userID):
+        """
+        Computes the similarity profile of the user (see 'usersimilarity.UserSimilarity.profile') over the candidates
+        only: the Pearson correlation with significance weighting is exact for them and 0 for all other users.
+        :param userID: int number of the target user
+        :return: an array of floats aligned with the users of the engine
+        """
+        engine = self.engine
+        similarities = np.zeros(len(engine.userids))
+        rows = self.candidates(userID)
+        if len(rows) == 0:
+            return similarities
+        a = engine.index_of(userID)
+        numerators = engine.centered[rows].dot(engine.centered[a].T).toarray().ravel()
+        amounts = np.rint(engine.incidence[rows].dot(engine.incidence[a].T).toarray().ravel())
+        denominators = engine.norms[rows] * engine.norms[a]
+        valid = (amounts > 1) & (denominators != 0.0)
+        values = np.zeros(len(rows))
+        values[valid] = numerators[valid] / denominators[valid]
+        similarities[rows] = values * (np.minimum(engine.cut_off, amounts) / float(engine.cut_off))
+        return similarities
+
+
+def build_user_index(engine, tables=8, bits=6, probe=True, seed=0):
+    """
+    Builds the LSH index of the users of a similarity engine.
+    :param engine: a UserSimilarity object (see 'usersimilarity.py')
+    :param tables: number of hash tables
+    :param bits: number of bits of the hash of every table
+    :param probe: if True, the buckets at one bit of distance of the user's bucket are candidates as well
+    :param seed: seed of the random directions
+    :return: a UserLSHIndex object
+    """
+    return UserLSHIndex(engine, tables, bits, probe, seed)
+
+
+def recall_report(index, userIDs, ks=(10, 20, 50)):
+    """
+    Compares the approximate similarity profiles against the exact ones. For every user and k, the recall@k is the
+    fraction of the k most similar users (positive similarity only) that the index also finds among its k most similar.
+    :param index: a UserLSHIndex object
+    :param userIDs: list of ints of the users to query
+    :param ks: sizes of the neighborhoods
+    :return: a dictionary with the mean recall@k ('recall@<k>'), the mean fraction of users scored ('candidates'), and
+    the mean time (in ms) of an approximate and an exact profile
+    """
+    engine = index.engine
+    recalls = dict((k, []) for k in ks)
+    candidates = []
+    approximate_ms = []
+    exact_ms = []
+    for userID in userIDs:
+        start = time.time()
+        approximate = index.profile(userID)
+        approximate_ms.append((time.time() - start) * 1000.0)
+        start = time.time()
+        exact = engine.similarities(userID)
+        exact_ms.append((time.time() - start) * 1000.0)
+        candidates.append(len(index.candidates(userID)) / float(len(engine.userids)))
+        # The user her/himself is never a neighbor:
+        exact[engine.index_of(userID)] = 0.0
+        approximate[engine.index_of(userID)] = 0.0
+        for k in ks:
+            expected = topn.top_positions(exact, engine.userids, k)
+            expected = expected[exact[expected] > 0.0]
+            if len(expected) == 0:
+                continue
+            found = topn.top_positions(approximate, engine.userids, k)
+            found = found[approximate[found] > 0.0]
+            recalls[k].append(len(np.intersect1d(expected, found)) / float(len(expected)))
+    report = {'users': len(userIDs),
+              'candidates': float(np.mean(candidates)) if len(candidates) > 0 else 0.0,
+              'approximate_ms': float(np.mean(approximate_ms)) if len(approximate_ms) > 0 else 0.0,
+              'exact_ms': float(np.mean(exact_ms)) if len(exact_ms) > 0 else 0.0}
+    for k in ks:
+        report['recall@%d' % k] = float(np.mean(recalls[k])) if len(recalls[k]) > 0 else None
+    return report
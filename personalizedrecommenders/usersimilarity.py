@@ -0,0 +1,217 @@
+"""
+This file holds the user-user similarity engine used by UUCF (User-User Collaborative Filtering).
+All ratings are stored once in a sparse user x item matrix, centered by the mean rating of every user. This way, the
+Pearson correlation of a target user 'a' against ALL users 'u' comes out of a single sparse matrix-vector product:
+    numerator(a, u)   = sum over the items rated by both users of (r_a,i - mean_a) * (r_u,i - mean_u)
+    denominator(a, u) = sqrt(sum over ALL items rated by a of (r_a,i - mean_a)^2) * sqrt(same for u)
+Like in 'main.calculate_pearson_correlation', the norms go over all the ratings of every user, not only over the common
+ones. The amount of common items comes out of the same product over the binary (rated or not) matrix, and it is used
+for the significance weighting.
+The mean rating and the norm of every user are not computed here: they are read from the user statistics store (see
+'userstats.py'), whose rows are also the rows of the matrices. When new ratings arrive, only the rows of the users who
+rated are built again (see 'update_users').
+The similarities of a user against all users (the similarity profile of the user) are computed once per top-N request
+and reused for every candidate item. Optionally, the most recent profiles are cached across requests.
+"""
+
+import collections
+import numpy as np
+from scipy import sparse
+import userstats
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+
+class UserSimilarity:
+    """
+    Pearson correlation (with significance weighting) of any user against all users. Rows of the matrices are aligned
+    with the rows of the user statistics store ('userids', in the order the users were first seen) and columns with
+    'itemids' (sorted). Every user rates an item at most once.
+    """
+
+    def __init__(self, userids, itemids, stars, statistics, cut_off=10, cache_size=0):
+        """
+        Builds the mean-centered user x item matrix out of three parallel arrays.
+        :param userids: array of ints, the user ID of every rating
+        :param itemids: array of ints, the item ID of every rating
+        :param stars: array of floats, the rating (stars) of every rating
+        :param statistics: a UserStatistics object (see 'userstats.py') holding the statistics of these same ratings
+        :param cut_off: cut-off value (gamma) of the significance weighting
+        :param cache_size: number of similarity profiles kept across requests (0 means no cache)
+        """
+        self.cut_off = cut_off
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # dictionary with "Key=userID" and "Value=similarity profile", oldest first
+        self.statistics = statistics
+        self.userids = np.array(statistics.userids, dtype=np.int64)
+        self.itemids, item_index = np.unique(itemids, return_inverse=True)
+        users, user_index = np.unique(userids, return_inverse=True)
+        user_index = np.array([statistics.row_of(userID) for userID in users.tolist()], dtype=np.int64)[user_index]
+        stars = np.asarray(stars, dtype=np.float64)
+        shape = (len(self.userids), len(self.itemids))
+        centered = stars - self.means[user_index]
+        self.centered = sparse.csr_matrix((centered, (user_index, item_index)), shape=shape)
+        self.incidence = sparse.csr_matrix((np.ones(len(stars)), (user_index, item_index)), shape=shape)
+        # The users who rated every item (item x user), to filter the neighbors of a target item:
+        self.raters = self.incidence.T.tocsr()
+
+    @property
+    def means(self):
+        """
+        :return: array with the mean rating of every user (see 'userstats.UserStatistics')
+        """
+        return self.statistics.means[:len(self.userids)]
+
+    @property
+    def norms(self):
+        """
+        :return: array with the norm of the mean-centered ratings of every user (see 'userstats.UserStatistics')
+        """
+        return np.sqrt(self.statistics.squares[:len(self.userids)])
+
+    def index_of(self, userID):
+        """
+        Retrieves the row of a user.
+        :param userID: int number of the user
+        :return: int number, -1 if the user didn't rate anything
+        """
+        row = self.statistics.rows.get(userID, -1)
+        if row >= len(self.userids):
+            return -1
+        return row
+
+    def update_users(self, ratings_by_user):
+        """
+        Builds again the rows of the users who rated something new, centered by their current means. The user
+        statistics store must already hold the new ratings. New users and items get a row and a column.
+        :param ratings_by_user: a dictionary with "Key=userID" and "Value=list of ALL ratings of that user", only for
+        the users who rated something new
+        :return: nothing
+        """
+        if len(ratings_by_user) == 0:
+            return
+        ratings = [rating for ratings_user in ratings_by_user.values() for rating in ratings_user]
+        itemIDs = np.fromiter((rating['movieid'] for rating in ratings), dtype=np.int64, count=len(ratings))
+        # New users (rows at the end) and new items (columns in their sorted place):
+        userids = np.array(self.statistics.userids, dtype=np.int64)
+        itemids = np.union1d(self.itemids, itemIDs)
+        columns = np.searchsorted(itemids, self.itemids)
+        shape = (len(userids), len(itemids))
+        indptr = np.concatenate([self.centered.indptr,
+                                 np.repeat(self.centered.indptr[-1], len(userids) - len(self.userids))])
+        self.userids = userids
+        self.itemids = itemids
+        # The old rows of the users are left out and their current ratings are added:
+        rows = np.array([self.statistics.row_of(userID) for userID in ratings_by_user.keys()], dtype=np.int64)
+        keep = np.ones(len(userids))
+        keep[rows] = 0.0
+        keep = sparse.diags(keep)
+        new_rows = np.array([self.statistics.row_of(rating['userid']) for rating in ratings], dtype=np.int64)
+        new_columns = np.searchsorted(itemids, itemIDs)
+        stars = np.fromiter((rating['rating'] for rating in ratings), dtype=np.float64, count=len(ratings))
+        self.centered = (keep.dot(sparse.csr_matrix((self.centered.data, columns[self.centered.indices], indptr),
+                                                    shape=shape)) +
+                         sparse.csr_matrix((stars - self.means[new_rows], (new_rows, new_columns)), shape=shape)).tocsr()
+        self.incidence = (keep.dot(sparse.csr_matrix((self.incidence.data, columns[self.incidence.indices], indptr),
+                                                     shape=shape)) +
+                          sparse.csr_matrix((np.ones(len(ratings)), (new_rows, new_columns)), shape=shape)).tocsr()
+        self.raters = self.incidence.T.tocsr()
+        # Every profile involves the rows that changed:
+        self.clear_cache()
+
+    def raters_of(self, itemID):
+        """
+        Retrieves the rows of the users who rated the item.
+        :param itemID: int number of the item
+        :return: array of row indices
+        """
+        column = np.searchsorted(self.itemids, itemID)
+        if column == len(self.itemids) or self.itemids[column] != itemID:
+            return np.zeros(0, dtype=np.int32)
+        return self.raters.indices[self.raters.indptr[column]:self.raters.indptr[column + 1]]
+
+    def pearson(self, userID):
+        """
+        Calculates the Pearson correlation of the user against all users.
+        If both users have 1 or 0 items in common => 0
+        If denominator is 0 => 0
+        :param userID: int number of the target user
+        :return: an array of floats aligned with 'userids' AND an array with the amount of common items
+        """
+        a = self.index_of(userID)
+        if a == -1:
+            return np.zeros(len(self.userids)), np.zeros(len(self.userids), dtype=np.int64)
+        numerators = self.centered.dot(self.centered[a].T).toarray().ravel()
+        amounts = np.rint(self.incidence.dot(self.incidence[a].T).toarray().ravel()).astype(np.int64)
+        denominators = self.norms * self.norms[a]
+        values = np.zeros(len(self.userids))
+        valid = (amounts > 1) & (denominators != 0.0)
+        values[valid] = numerators[valid] / denominators[valid]
+        return values, amounts
+
+    def similarities(self, userID):
+        """
+        Calculates the Pearson correlation of the user against all users, multiplied by the significance weighting
+        factor: min(cut_off, amount of common items) / cut_off.
+        :param userID: int number of the target user
+        :return: an array of floats aligned with 'userids'
+        """
+        values, amounts = self.pearson(userID)
+        return values * (np.minimum(self.cut_off, amounts) / float(self.cut_off))
+
+    def profile(self, userID):
+        """
+        Retrieves the similarity profile of the user (see 'similarities'). If the cache is enabled, the profile is only
+        computed the first time and the least recently used profile is dropped when the cache is full.
+        :param userID: int number of the target user
+        :return: an array of floats aligned with 'userids'
+        """
+        if userID in self.cache:
+            self.cache[userID] = self.cache.pop(userID)  # moved to the end: most recently used
+            return self.cache[userID]
+        similarities = self.similarities(userID)
+        if self.cache_size > 0:
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+            self.cache[userID] = similarities
+        return similarities
+
+    def clear_cache(self):
+        """
+        Forgets all the cached similarity profiles (e.g. after the ratings changed).
+        :return: nothing
+        """
+        self.cache.clear()
+
+    def neighbor_candidates(self, userID, itemID, similarities=None):
+        """
+        Retrieves the users (except the target user) who rated the item and have a positive similarity with the target
+        user.
+        :param userID: int number of the target user
+        :param itemID: int number of the target item
+        :param similarities: the similarity profile of the target user (see 'profile'). Retrieved if not provided.
+        :return: an array with the user IDs AND an array with their similarity values
+        """
+        if similarities is None:
+            similarities = self.profile(userID)
+        rows = self.raters_of(itemID)
+        rows = rows[(similarities[rows] > 0.0) & (self.userids[rows] != userID)]
+        return self.userids[rows], similarities[rows]
+
+
+def build_user_similarity(ratings, cut_off=10, cache_size=0, statistics=None):
+    """
+    Builds the user-user similarity engine from a collection of all ratings.
+    :param ratings: a list of ALL ratings
+    :param cut_off: cut-off value (gamma) of the significance weighting
+    :param cache_size: number of similarity profiles kept across requests (0 means no cache)
+    :param statistics: the UserStatistics object (see 'userstats.py') of the same ratings. Built if not provided.
+    :return: a UserSimilarity object
+    """
+    if statistics is None:
+        statistics = userstats.build_user_statistics(ratings)
+    userids = np.fromiter((rating['userid'] for rating in ratings), dtype=np.int64, count=len(ratings))
+    itemids = np.fromiter((rating['movieid'] for rating in ratings), dtype=np.int64, count=len(ratings))
+    stars = np.fromiter((rating['rating'] for rating in ratings), dtype=np.float64, count=len(ratings))
+    return UserSimilarity(userids, itemids, stars, statistics, cut_off, cache_size)
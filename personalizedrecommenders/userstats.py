@@ -0,0 +1,164 @@
+"""
+This file holds the user statistics store used by UUCF: the amount of ratings, the mean rating and the norm of the
+mean-centered ratings of every user, kept in dense arrays. They are computed once when the ratings are loaded, so
+neither Pearson nor the rating predictions go over the lists of ratings of the users again.
+When new ratings arrive, the statistics are updated incrementally (without going over the old ratings) by merging the
+statistics of the new ratings into the stored ones:
+    n    = n_old + n_new
+    mean = mean_old + delta * n_new / n,  where delta = mean_new - mean_old
+    M2   = M2_old + M2_new + delta^2 * n_old * n_new / n
+M2 being the sum of the squared deviations from the mean (the centered sum of squares).
+A rating that replaces an older one (same user and item) is added as a new rating and the old one is removed by the
+inverse merge:
+    n    = n_old - n_removed
+    mean = (n_old * mean_old - n_removed * mean_removed) / n
+    M2   = M2_old - M2_removed - delta^2 * n * n_removed / n_old,  where delta = mean_removed - mean
+"""
+
+import numpy as np
+
+__author__ = "Aitor De Blas Granja"
+__email__ = "aitor.deblas@ugent.be"
+
+
+class UserStatistics:
+    """
+    Amount of ratings, mean rating and centered sum of squares of every user. Users get a row the first time they are
+    seen, so the arrays are aligned with 'userids'.
+    """
+
+    def __init__(self):
+        self.userids = []  # user IDs, in the order they were first seen (row of the user)
+        self.rows = {}  # dictionary with "Key=userID" and "Value=row of the user"
+        self.counts = np.zeros(0, dtype=np.int64)  # amount of ratings of every user
+        self.means = np.zeros(0)  # mean rating of every user
+        self.squares = np.zeros(0)  # sum of the squared deviations from the mean (M2) of every user
+
+    def __row(self, userID):
+        """
+        Retrieves the row of the user, adding it (and growing the arrays if needed) the first time it is seen.
+        :param userID: int number of the user
+        :return: int number
+        """
+        if userID in self.rows:
+            return self.rows[userID]
+        row = len(self.userids)
+        if row == len(self.counts):
+            capacity = max(16, 2 * row)  # the arrays double their capacity, so growing is amortized
+            self.counts = np.concatenate([self.counts, np.zeros(capacity - row, dtype=np.int64)])
+            self.means = np.concatenate([self.means, np.zeros(capacity - row)])
+            self.squares = np.concatenate([self.squares, np.zeros(capacity - row)])
+        self.userids.append(userID)
+        self.rows[userID] = row
+        return row
+
+    def add_ratings(self, userIDs, stars):
+        """
+        Adds a batch of ratings to the statistics.
+        :param userIDs: list of ints, the user of every rating
+        :param stars: list of floats, the rating (stars) of every rating
+        """
+        if len(userIDs) == 0:
+            return
+        rows = np.array([self.__row(userID) for userID in userIDs], dtype=np.int64)
+        stars = np.asarray(stars, dtype=np.float64)
+        # Statistics of the new ratings alone:
+        touched, index = np.unique(rows, return_inverse=True)
+        new_counts = np.bincount(index)
+        new_means = np.bincount(index, weights=stars) / new_counts
+        new_squares = np.bincount(index, weights=(stars - new_means[index]) ** 2)
+        # Merged with the stored ones:
+        old_counts = self.counts[touched]
+        counts = old_counts + new_counts
+        delta = new_means - self.means[touched]
+        self.means[touched] += delta * new_counts / counts
+        self.squares[touched] += new_squares + delta ** 2 * old_counts * new_counts / counts
+        self.counts[touched] = counts
+
+    def remove_ratings(self, userIDs, stars):
+        """
+        Removes a batch of ratings (that were added before) from the statistics, e.g. the old ratings of the items
+        rated again.
+        :param userIDs: list of ints, the user of every rating
+        :param stars: list of floats, the rating (stars) of every rating
+        """
+        if len(userIDs) == 0:
+            return
+        rows = np.array([self.row_of(userID) for userID in userIDs], dtype=np.int64)
+        stars = np.asarray(stars, dtype=np.float64)
+        # Statistics of the removed ratings alone:
+        touched, index = np.unique(rows, return_inverse=True)
+        removed_counts = np.bincount(index)
+        removed_means = np.bincount(index, weights=stars) / removed_counts
+        removed_squares = np.bincount(index, weights=(stars - removed_means[index]) ** 2)
+        old_counts = self.counts[touched]
+        counts = old_counts - removed_counts
+        if (counts < 0).any():
+            raise ValueError("[Error] More ratings removed than added! Cannot continue with the method!")
+        # Taken out of the stored ones (users left without ratings go back to zero):
+        left = counts > 0
+        means = np.zeros(len(touched))
+        means[left] = (old_counts[left] * self.means[touched][left] -
+                       removed_counts[left] * removed_means[left]) / counts[left]
+        delta = removed_means - means
+        squares = self.squares[touched] - removed_squares - delta ** 2 * counts * removed_counts / old_counts
+        self.means[touched] = means
+        self.squares[touched] = np.where(left, np.maximum(squares, 0.0), 0.0)  # no negative rounding errors
+        self.counts[touched] = counts
+
+    def add_rating(self, userID, stars):
+        """
+        Adds one rating to the statistics.
+        :param userID: int number of the user
+        :param stars: float number, the rating (stars)
+        """
+        self.add_ratings([userID], [stars])
+
+    def row_of(self, userID):
+        """
+        Retrieves the row of a user that has ratings.
+        :param userID: int number of the user
+        :return: int number
+        """
+        if userID not in self.rows:
+            raise ValueError("[Error] User %s has no ratings! Cannot continue with the method!" % userID)
+        return self.rows[userID]
+
+    def count(self, userID):
+        """
+        :param userID: int number of the user
+        :return: int number, amount of ratings of the user
+        """
+        return int(self.counts[self.row_of(userID)])
+
+    def mean(self, userID):
+        """
+        :param userID: int number of the user
+        :return: float number, average of the ratings of the user
+        """
+        return float(self.means[self.row_of(userID)])
+
+    def centered_sum_of_squares(self, userID):
+        """
+        :param userID: int number of the user
+        :return: float number, sum of the squared mean-centered ratings of the user
+        """
+        return float(self.squares[self.row_of(userID)])
+
+    def norm(self, userID):
+        """
+        :param userID: int number of the user
+        :return: float number, norm of the mean-centered ratings of the user
+        """
+        return float(np.sqrt(self.squares[self.row_of(userID)]))
+
+
+def build_user_statistics(ratings):
+    """
+    Builds the user statistics store from a collection of all ratings.
+    :param ratings: a list of ALL ratings
+    :return: a UserStatistics object
+    """
+    statistics = UserStatistics()
+    statistics.add_ratings([rating['userid'] for rating in ratings], [rating['rating'] for rating in ratings])
+    return statistics
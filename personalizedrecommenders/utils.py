@@ -111,20 +111,16 @@ def extract_ratings_x_by_users(movies, ratings):
     :param ratings: list of ALL ratings
     :return: a dictionary with "Key=itemID" and "Value=list of ratings for that item by all user who rated it"
     """
-    # Firstly, we collect all the item IDs of all movies to iterate over them later on:
-    itemIDs = [int(movie['id']) for movie in movies.values()]
+    # Firstly, we collect all the item IDs of all movies (items nobody rated get an empty list):
     ratings_x_by_users = {}
-
-    for itemid in itemIDs:
-        ratings_x_by_users[itemid] = []
-        if globals.LOG_STATUS is True:
-            print "ITEM ID: ", itemid
-        for rating in ratings:
-            if rating['movieid'] == itemid:
-                # Put it into the dictionary
-                ratings_x_by_users[itemid].append(rating)
-                if globals.LOG_STATUS is True:
-                    print "\t| rating: ", rating
+    for movie in movies.values():
+        ratings_x_by_users[int(movie['id'])] = []
+    # Secondly, a single pass over all ratings puts every rating in the list of its item:
+    for rating in ratings:
+        if rating['movieid'] in ratings_x_by_users:
+            ratings_x_by_users[rating['movieid']].append(rating)
+            if globals.LOG_STATUS is True:
+                print "ITEM ID: ", rating['movieid'], "\t| rating: ", rating
     return ratings_x_by_users
 
 